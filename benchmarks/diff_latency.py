@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+#
+# diffoscope: in-depth comparison of files, archives, and directories
+#
+# Copyright © 2022 Chris Lamb <lamby@debian.org>
+#
+# diffoscope is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# diffoscope is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with diffoscope.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Measure the per-call latency of diffoscope.diff.diff() for each
+--diff-engine on the small inputs that make up the majority of calls when
+comparing (eg.) the members of a package.
+
+    $ python3 benchmarks/diff_latency.py [--calls N]
+"""
+
+import os
+import sys
+import random
+import argparse
+import statistics
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from diffoscope import feeders  # noqa: E402
+from diffoscope.diff import diff  # noqa: E402
+from diffoscope.config import Config  # noqa: E402
+
+
+def make_inputs(lines, seed=0):
+    rnd = random.Random(seed)
+    a = [
+        b"  %08x: %s\n" % (x, bytes(rnd.choices(b"abcdef", k=32)))
+        for x in range(lines)
+    ]
+    b = list(a)
+    for _ in range(max(1, lines // 20)):
+        b[rnd.randrange(lines)] = b"  changed\n"
+    return b"".join(a), b"".join(b)
+
+
+def bench(engine, data1, data2, calls):
+    Config().diff_engine = engine
+    timings = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        diff(feeders.from_text(data1), feeders.from_text(data2))
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--calls", type=int, default=200)
+    args = parser.parse_args()
+
+    print(f"{'lines':>6} {'engine':>7} {'median':>10} {'mean':>10}")
+    for lines in (5, 50, 500, 2000):
+        data1, data2 = make_inputs(lines)
+        for engine in ("gnu", "python", "auto"):
+            timings = bench(engine, data1, data2, args.calls)
+            print(
+                "{:>6} {:>7} {:>8.3f}ms {:>8.3f}ms".format(
+                    lines,
+                    engine,
+                    statistics.median(timings) * 1000,
+                    statistics.mean(timings) * 1000,
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
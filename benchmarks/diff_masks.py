@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+#
+# diffoscope: in-depth comparison of files, archives, and directories
+#
+# Copyright © 2022 Chris Lamb <lamby@debian.org>
+#
+# diffoscope is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# diffoscope is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with diffoscope.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Measure the throughput of applying --diff-mask regular expressions to
+synthetic objdump(1) output, comparing DiffMasks with applying each mask to
+each line in turn.
+
+    $ python3 benchmarks/diff_masks.py [--size MiB] [--masks N]
+
+Use (eg.) --size 4096 to filter multiple gigabytes. The output is generated
+as it is filtered, so this does not need that much memory.
+"""
+
+import os
+import re
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from diffoscope.config import Config  # noqa: E402
+from diffoscope.feeders import filter_lines  # noqa: E402
+
+# The kind of masks used to hide build paths, timestamps, etc.
+MASKS = (
+    r"/build/[^/\s]+/",
+    r"/tmp/tmp[a-z0-9_]{8}",
+    r"/usr/src/packages/BUILD/[^/\s]+",
+    r"\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d",
+    r"Build ID: [0-9a-f]{40}",
+    r"GCC: \(Debian [^)]*\)",
+    r"clang version [0-9.]+",
+    r"SOURCE_DATE_EPOCH=\d+",
+    r"buildinfo-[0-9a-f]{16}",
+    r"\.gnu_debuglink.*\.debug",
+    r"sbuild-[a-z0-9-]+",
+    r"BUILD_PATH_PREFIX_MAP=\S+",
+    r"HOSTNAME=\S+",
+    r"@\(#\)[^\n]*built on [^\n]*",
+    r"__DATE__ = \"[A-Z][a-z]{2} [ 0-9]\d \d{4}\"",
+    r"__TIME__ = \"\d\d:\d\d:\d\d\"",
+    r"compiled by \w+@\w+",
+    r"rustc [0-9.]+ \([0-9a-f]{9} \d{4}-\d\d-\d\d\)",
+    r"go1\.\d+(?:\.\d+)? [a-z]+/[a-z0-9]+",
+    r"-ffile-prefix-map=\S+",
+    r"-fdebug-prefix-map=\S+",
+    r"\.note\.gnu\.build-id",
+    r"/home/[a-z]+/",
+    r"Last modified: .*",
+    r"Generated by Doxygen [0-9.]+",
+    r"javac [0-9._]+",
+    r"Created-By: .*",
+    r"Built-Date: .*",
+    r"uuid: [0-9a-f-]{36}",
+    r"randomseed=\d+",
+)
+
+
+def make_block(lines, seed=0):
+    rnd = random.Random(seed)
+    result = []
+    for x in range(lines):
+        insn = rnd.choice(
+            (
+                "mov    %rdi,%rax",
+                "lea    0x{:x}(%rip),%rsi".format(rnd.randrange(2**20)),
+                "call   {:x} <memcpy@plt>".format(rnd.randrange(2**20)),
+                "ret",
+                "xor    %eax,%eax",
+            )
+        )
+        line = "  {:x}:\t{}\t{}\n".format(
+            0x1000 + x * 4,
+            " ".join("{:02x}".format(rnd.randrange(256)) for _ in range(4)),
+            insn,
+        )
+        # An occasional line that a mask should hide
+        if x % 10000 == 0:
+            line = "  {:x}:\t/build/pkg-{}/src/main.c:42\n".format(x, x)
+        result.append(line.encode("utf-8"))
+    return result
+
+
+def generate(block, size):
+    block_size = sum(len(x) for x in block)
+    for _ in range(max(1, size // block_size)):
+        yield from block
+
+
+def filter_each(lines):
+    # filter_reader() as it was before DiffMasks
+    regexes = [re.compile(x.encode("utf-8")) for x in Config().diff_masks]
+    for line in lines:
+        buf = line
+        for regex in regexes:
+            buf = regex.sub(b"[masked]", buf)
+        yield line, buf
+
+
+def measure(fn, block, size):
+    start = time.perf_counter()
+    total, masked = 0, 0
+    for line, buf in fn(generate(block, size)):
+        total += len(buf)
+        masked += buf != line
+    return time.perf_counter() - start, total, masked
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip().splitlines()[0]
+    )
+    parser.add_argument(
+        "--size", type=int, default=256, help="MiB of output to filter"
+    )
+    parser.add_argument("--masks", type=int, default=len(MASKS))
+    args = parser.parse_args()
+
+    Config().diff_masks = list(MASKS[: args.masks])
+    block = make_block(100000)
+
+    print(f"{args.size} MiB of objdump output, {args.masks} masks")
+    results = []
+    for name, fn in (("before", filter_each), ("after", filter_lines)):
+        elapsed, total, masked = measure(fn, block, args.size * 2**20)
+        results.append((total, masked))
+        print(
+            "{:>7}: {:7.1f}s {:7.1f} MiB/s".format(
+                name, elapsed, total / 2**20 / elapsed
+            )
+        )
+
+    if results[0] != results[1]:
+        print(f"MISMATCH: {results}")
+
+
+if __name__ == "__main__":
+    main()
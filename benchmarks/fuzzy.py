@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+#
+# diffoscope: in-depth comparison of files, archives, and directories
+#
+# Copyright © 2022 Chris Lamb <lamby@debian.org>
+#
+# diffoscope is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# diffoscope is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with diffoscope.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Measure perform_fuzzy_matching() on two synthetic sets of container members
+where none of the names match, comparing the TLSH index against comparing
+every member with every other.
+
+Half of the members on the right are modified copies of those on the left
+and the rest are unrelated. Comparing everything takes some minutes with the
+default of 10,000 members on each side so, unless --full is passed, it is
+only run for the first --sample members and extrapolated:
+
+    $ python3 benchmarks/fuzzy.py
+    $ python3 benchmarks/fuzzy.py --members 2000 --full
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+
+import tlsh
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from diffoscope.config import Config  # noqa: E402
+from diffoscope.comparators.utils.fuzzy import (  # noqa: E402
+    perform_fuzzy_matching,
+)
+
+
+class Member:
+    def __init__(self, data):
+        self.fuzzy_hash = tlsh.hash(data)
+
+    def is_directory(self):
+        return False
+
+
+def perform_fuzzy_matching_linear(members1, members2):
+    # perform_fuzzy_matching() as it was before the index
+    threshold = Config().fuzzy_threshold
+    seen = set()
+
+    for name1, (file1, _) in members1.items():
+        comparisons = []
+        for name2, (file2, _) in members2.items():
+            if name2 in seen:
+                continue
+            comparisons.append(
+                (tlsh.diff(file1.fuzzy_hash, file2.fuzzy_hash), name2)
+            )
+
+        if not comparisons:
+            continue
+
+        comparisons.sort(key=lambda x: x[0])
+        score, name2 = comparisons[0]
+        if score < threshold:
+            seen.add(name2)
+            yield name1, name2, score
+
+
+def random_bytes(rnd, n):
+    # Random.randbytes() requires Python 3.9
+    return rnd.getrandbits(8 * n).to_bytes(n, "little")
+
+
+def mutate(rnd, data, ratio):
+    data = bytearray(data)
+    for _ in range(int(len(data) * ratio)):
+        data[rnd.randrange(len(data))] = rnd.randrange(256)
+    return bytes(data)
+
+
+def generate(n, seed):
+    rnd = random.Random(seed)
+    left = [random_bytes(rnd, rnd.randrange(1024, 16384)) for _ in range(n)]
+    right = [mutate(rnd, x, rnd.uniform(0, 0.1)) for x in left[: n // 2]] + [
+        random_bytes(rnd, rnd.randrange(1024, 16384))
+        for _ in range(n - n // 2)
+    ]
+    rnd.shuffle(right)
+
+    return (
+        {f"left/{i}": (Member(x), None) for i, x in enumerate(left)},
+        {f"right/{i}": (Member(x), None) for i, x in enumerate(right)},
+    )
+
+
+def measure(fn, members1, members2):
+    start = time.perf_counter()
+    result = list(fn(members1, members2))
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip().splitlines()[0]
+    )
+    parser.add_argument("--members", type=int, default=10000)
+    parser.add_argument("--sample", type=int, default=200)
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="Compare everything on the full set and check the results match",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    members1, members2 = generate(args.members, args.seed)
+    print(f"{len(members1)} x {len(members2)} members")
+
+    after, result = measure(perform_fuzzy_matching, members1, members2)
+    print(f"index: {after:.2f}s, {len(result)} matches")
+
+    if args.full:
+        before, expected = measure(
+            perform_fuzzy_matching_linear, members1, members2
+        )
+        print(f"linear: {before:.2f}s, {len(expected)} matches")
+        if result != expected:
+            print("MISMATCH")
+            sys.exit(1)
+    else:
+        sample = dict(list(members1.items())[: args.sample])
+        elapsed, _ = measure(perform_fuzzy_matching_linear, sample, members2)
+        before = elapsed * len(members1) / len(sample)
+        print(
+            f"linear: {before:.2f}s (extrapolated from {len(sample)} members)"
+        )
+
+    print(f"{before / after:.1f}x faster")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+#
+# diffoscope: in-depth comparison of files, archives, and directories
+#
+# Copyright © 2022 Chris Lamb <lamby@debian.org>
+#
+# diffoscope is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# diffoscope is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with diffoscope.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Measure the peak memory of writing and reading --json reports of a
+synthetic tree of differences, comparing the streaming JSONPresenter and
+incremental JSONReaderV1 with building the whole document at once.
+
+    $ python3 benchmarks/json_memory.py [--nodes N] [--fanout N]
+
+Each measurement runs in its own process so that their peaks are separate.
+"""
+
+import os
+import sys
+import json
+import time
+import codecs
+import argparse
+import resource
+import tempfile
+import subprocess
+
+from collections import OrderedDict
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from diffoscope.difference import Difference  # noqa: E402
+from diffoscope.presenters.json import (  # noqa: E402
+    JSONPresenter,
+    JSON_FORMAT_MAGIC,
+    JSON_FORMAT_VERSION,
+)
+from diffoscope.presenters.utils import present  # noqa: E402
+from diffoscope.readers.json import JSONReaderV1  # noqa: E402
+
+MODES = ("write-streaming", "write-dumps", "read-incremental", "read-load")
+
+
+def make_tree(start, count, fanout):
+    """
+    Return a Difference with `count` nodes in total whose children are only
+    created as they are visited.
+    """
+
+    difference = Difference(
+        f"a/file{start}",
+        f"b/file{start}",
+        unified_diff=f"@@ -1 +1 @@\n-{start:x}\n+{start:X}\n",
+    )
+
+    def details():
+        remaining, offset = count - 1, start + 1
+        size = -(-remaining // fanout) if remaining else 0
+        while remaining:
+            n = min(size, remaining)
+            yield make_tree(offset, n, fanout)
+            remaining, offset = remaining - n, offset + n
+
+    difference.add_lazy_details(details())
+    return difference
+
+
+def to_dict(difference, root=True):
+    # As JSONPresenter built the document before it was made to stream
+    result = OrderedDict()
+    if root:
+        result[JSON_FORMAT_MAGIC] = JSON_FORMAT_VERSION
+    result["source1"] = difference.source1
+    result["source2"] = difference.source2
+    result["unified_diff"] = difference.unified_diff
+    if difference.details:
+        result["details"] = [to_dict(x, False) for x in difference.details]
+    return result
+
+
+def from_dict(raw):
+    # As JSONReaderV1 loaded documents before it was made incremental
+    return Difference(
+        raw["source1"],
+        raw["source2"],
+        details=[from_dict(x) for x in raw.get("details", [])],
+        unified_diff=raw["unified_diff"],
+    )
+
+
+def run(mode, path, nodes, fanout):
+    if mode == "write-streaming":
+        with open(path, "w", encoding="utf-8") as f:
+            presenter = JSONPresenter(print, f.write)
+            present(make_tree(0, nodes, fanout), [presenter], True)
+    elif mode == "write-dumps":
+        with open(path, "w", encoding="utf-8") as f:
+            print(json.dumps(to_dict(make_tree(0, nodes, fanout))), file=f)
+    elif mode == "read-incremental":
+        with open(path, "rb") as f:
+            JSONReaderV1().load(codecs.getreader("utf-8")(f), path)
+    elif mode == "read-load":
+        with open(path, "r", encoding="utf-8") as f:
+            from_dict(json.load(f))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--nodes", type=int, default=1000000)
+    parser.add_argument("--fanout", type=int, default=10)
+    parser.add_argument("--mode", choices=MODES, help=argparse.SUPPRESS)
+    parser.add_argument("--path", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        start = time.perf_counter()
+        run(args.mode, args.path, args.nodes, args.fanout)
+        elapsed = time.perf_counter() - start
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        print(f"{maxrss // 1024} {elapsed}")
+        return
+
+    print(f"{'mode':>17} {'peak RSS':>10} {'time':>8}")
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "report.json")
+        for mode in MODES:
+            out = subprocess.check_output(
+                (
+                    sys.executable,
+                    __file__,
+                    f"--mode={mode}",
+                    f"--path={path}",
+                    f"--nodes={args.nodes}",
+                    f"--fanout={args.fanout}",
+                )
+            )
+            maxrss, elapsed = out.split()
+            print(
+                "{:>17} {:>6} MiB {:>7.1f}s".format(
+                    mode, int(maxrss), float(elapsed)
+                )
+            )
+        print(f"(report size: {os.path.getsize(path) // 2**20} MiB)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+#
+# diffoscope: in-depth comparison of files, archives, and directories
+#
+# Copyright © 2022 Chris Lamb <lamby@debian.org>
+#
+# diffoscope is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# diffoscope is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with diffoscope.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Measure the time taken by the intra-line differences of the side-by-side
+HTML output on real minified JavaScript or CSS.
+
+Given two versions of a file, each pair of differing lines is compared as
+the HTML presenter would. With --mutate, each long line of each file is
+instead compared to a copy in which every 1000th character has been
+changed, as a rebuild with different identifier mangling or embedded hashes
+might:
+
+    $ python3 benchmarks/linediff.py old/jquery.min.js new/jquery.min.js
+    $ python3 benchmarks/linediff.py --mutate /usr/share/javascript/*/*.min.*
+"""
+
+import os
+import sys
+import time
+import argparse
+import itertools
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from diffoscope.diff import linediff, DIFFON, DIFFOFF  # noqa: E402
+
+
+def mutate(line):
+    return "".join(
+        "#" if i % 1000 == 999 else c for i, c in enumerate(line)
+    )
+
+
+def read_lines(path):
+    with open(path, encoding="utf-8", errors="replace") as f:
+        return f.read().splitlines()
+
+
+def pairs(paths, mutated):
+    if not mutated:
+        for a, b in itertools.zip_longest(*map(read_lines, paths)):
+            if a and b and a != b:
+                yield os.path.basename(paths[0]), a, b
+        return
+
+    for path in paths:
+        for line in read_lines(path):
+            if len(line) >= 1000:
+                yield os.path.basename(path), line, mutate(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip().splitlines()[0]
+    )
+    parser.add_argument("paths", nargs="+", metavar="FILE")
+    parser.add_argument(
+        "--mutate",
+        action="store_true",
+        help="Compare each file to a modified copy of itself",
+    )
+    args = parser.parse_args()
+
+    if not args.mutate and len(args.paths) != 2:
+        parser.error("Two files are required unless --mutate is used")
+
+    print(f"{'file':<30} {'len1':>8} {'len2':>8} {'changed':>8} {'time':>10}")
+
+    total = 0
+    for name, a, b in pairs(args.paths, args.mutate):
+        start = time.perf_counter()
+        s1, _ = linediff(a, b, DIFFON, DIFFOFF)
+        elapsed = time.perf_counter() - start
+        total += elapsed
+
+        print(
+            "{:<30} {:>8} {:>8} {:>8} {:>8.1f}ms".format(
+                name[:30],
+                len(a),
+                len(b),
+                s1.count(DIFFON),
+                elapsed * 1000,
+            )
+        )
+
+    print(f"total: {total * 1000:.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+#
+# diffoscope: in-depth comparison of files, archives, and directories
+#
+# Copyright © 2022 Chris Lamb <lamby@debian.org>
+#
+# diffoscope is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# diffoscope is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with diffoscope.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Measure the time specialize() takes to recognise each file under tests/data
+(or the given paths), comparing the dispatch index against trying every
+comparator in turn.
+
+"cold" times include the libmagic lookup and reading the file header, which
+happen at most once per file. "warm" times have those already memoized and
+so show the cost of the dispatch alone:
+
+    $ python3 benchmarks/specialize.py
+    $ python3 benchmarks/specialize.py --verbose /usr/lib/x86_64-linux-gnu
+"""
+
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from diffoscope.comparators import ComparatorManager  # noqa: E402
+from diffoscope.comparators.binary import FilesystemFile  # noqa: E402
+from diffoscope.comparators.utils.specialize import (  # noqa: E402
+    specialize,
+    try_recognize,
+)
+
+
+def specialize_linear(file):
+    # specialize() as it was before the dispatch index
+    for method in ("recognizes", "fallback_recognizes"):
+        for cls in ComparatorManager().classes:
+            if try_recognize(file, cls, getattr(cls, method)):
+                return file
+    return file
+
+
+def walk(paths):
+    for path in paths:
+        if os.path.isfile(path):
+            yield path
+        for root, _, files in os.walk(path):
+            for x in sorted(files):
+                yield os.path.join(root, x)
+
+
+def recognised_as(file):
+    # Our dynamically-created class is named after the comparator
+    return type(file).__name__
+
+
+def measure(fn, path, repeat, warm):
+    best = float("inf")
+
+    for _ in range(repeat):
+        file = FilesystemFile(path)
+        if warm:
+            file.magic_file_type, file.file_header
+
+        start = time.perf_counter()
+        fn(file)
+        best = min(best, time.perf_counter() - start)
+
+    return best, recognised_as(file)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip().splitlines()[0]
+    )
+    parser.add_argument(
+        "paths",
+        nargs="*",
+        metavar="PATH",
+        default=[
+            os.path.join(os.path.dirname(__file__), "..", "tests", "data")
+        ],
+    )
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument(
+        "--verbose", action="store_true", help="Show timings for every file"
+    )
+    args = parser.parse_args()
+
+    ComparatorManager()
+
+    # Warm up libmagic, imports, etc.
+    for fn in (specialize_linear, specialize):
+        fn(FilesystemFile(__file__))
+
+    totals = {}
+    mismatches = 0
+    paths = list(walk(args.paths))
+
+    if args.verbose:
+        print(
+            f"{'file':<40} {'comparator':<22} {'before':>9} {'after':>9} "
+            f"{'before':>9} {'after':>9}"
+        )
+        print(f"{'':<63} {'(cold)':>19} {'(warm)':>19}")
+
+    for path in paths:
+        row = []
+        for warm in (False, True):
+            for fn in (specialize_linear, specialize):
+                elapsed, name = measure(fn, path, args.repeat, warm)
+                totals[fn, warm] = totals.get((fn, warm), 0) + elapsed
+                row.append((elapsed, name))
+
+        if len({x[1] for x in row}) != 1:
+            mismatches += 1
+            print(f"MISMATCH: {path}: {[x[1] for x in row]}")
+
+        if args.verbose:
+            print(
+                "{:<40} {:<22} {}".format(
+                    os.path.basename(path)[:40],
+                    row[0][1][:22],
+                    " ".join(f"{x * 1e6:>7.0f}µs" for x, _ in row),
+                )
+            )
+
+    print(f"{len(paths)} files, {mismatches} mismatches")
+    for warm in (False, True):
+        before = totals[specialize_linear, warm] / len(paths)
+        after = totals[specialize, warm] / len(paths)
+        print(
+            "{}: {:7.1f}µs/file before, {:7.1f}µs/file after ({:.1f}x)".format(
+                "warm" if warm else "cold",
+                before * 1e6,
+                after * 1e6,
+                before / after,
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
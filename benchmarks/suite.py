@@ -0,0 +1,486 @@
+#!/usr/bin/env python3
+#
+# diffoscope: in-depth comparison of files, archives, and directories
+#
+# Copyright © 2022 Chris Lamb <lamby@debian.org>
+#
+# diffoscope is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# diffoscope is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with diffoscope.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Run diffoscope end-to-end on synthetic corpora that exercise its hot paths
+and report the wall time, CPU time, number of forks and peak RSS of each.
+
+The corpora are generated from a fixed seed, so they are identical between
+runs (and revisions). They are: a tarball with many members of which a
+proportion are modified, an ELF object with many sections, a long text
+file, and archives nested inside each other. Each scenario runs in its own
+process, --repeat times, and the fastest run is reported:
+
+    $ python3 benchmarks/suite.py
+    $ python3 benchmarks/suite.py --scenario tarball --scale 4 --save a.json
+    $ python3 benchmarks/suite.py --baseline a.json
+
+--save writes the results as JSON. --baseline compares each result with
+one saved earlier, for example from a checkout of another revision.
+"""
+
+import io
+import os
+import sys
+import json
+import gzip
+import time
+import random
+import struct
+import tarfile
+import argparse
+import resource
+import tempfile
+import subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+SEED = 0
+
+METRICS = (
+    ("wall", "{:>8.2f}s", "wall time"),
+    ("cpu", "{:>8.2f}s", "CPU time (user + system, including children)"),
+    ("forks", "{:>9}", "processes started"),
+    ("maxrss", "{:>5} MiB", "peak RSS of diffoscope itself"),
+    ("children_maxrss", "{:>5} MiB", "peak RSS of its largest child"),
+)
+
+
+def text_lines(rnd, count, width=60):
+    return [
+        "{:08x} {}\n".format(
+            x, "".join(rnd.choices("abcdefghij klmnop", k=width))
+        )
+        for x in range(count)
+    ]
+
+
+def modify(rnd, lines):
+    result = list(lines)
+    result[rnd.randrange(len(result))] = "modified\n"
+    return result
+
+
+def make_tarball(files):
+    """
+    Return a tarball of `files` (a dict of names to bytes) that does not
+    depend on when or by whom it was created.
+    """
+
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode="w", format=tarfile.GNU_FORMAT) as f:
+        for name in sorted(files):
+            info = tarfile.TarInfo(name)
+            info.size = len(files[name])
+            info.mode = 0o644
+            f.addfile(info, io.BytesIO(files[name]))
+    return buf.getvalue()
+
+
+def gzip_compress(data):
+    buf = io.BytesIO()
+    with gzip.GzipFile(fileobj=buf, mode="wb", mtime=0) as f:
+        f.write(data)
+    return buf.getvalue()
+
+
+def gen_tarball(rnd, scale, ratio):
+    count = int(2000 * scale)
+    changed = set(rnd.sample(range(count), int(count * ratio)))
+    files1, files2 = {}, {}
+
+    for x in range(count):
+        name = "dir{:02d}/member{:05d}.txt".format(x % 20, x)
+        lines = text_lines(rnd, rnd.randrange(5, 200))
+        files1[name] = "".join(lines).encode()
+        if x in changed:
+            lines = modify(rnd, lines)
+        files2[name] = "".join(lines).encode()
+
+    return make_tarball(files1), make_tarball(files2)
+
+
+def make_elf(sections):
+    """
+    Return a (relocatable, x86-64) ELF object with the given list of (name,
+    executable, data) sections.
+    """
+
+    header = struct.Struct("<16sHHIQQQIHHHHHH")
+    section_header = struct.Struct("<IIQQQQIIQQ")
+
+    names = [b"", b".shstrtab"] + [x[0].encode() for x in sections]
+    shstrtab = b"\0".join(names) + b"\0"
+    name_offsets = [shstrtab.index(b"\0%s\0" % x) + 1 for x in names[1:]]
+
+    body = bytearray()
+    headers = [section_header.pack(*([0] * 10))]
+    offset = header.size
+
+    for (_, executable, data), name in zip(sections, name_offsets[1:]):
+        flags = 0x6 if executable else 0x2  # SHF_ALLOC [| SHF_EXECINSTR]
+        headers.append(
+            section_header.pack(
+                name, 1, flags, 0, offset + len(body), len(data), 0, 0, 16, 0
+            )
+        )
+        body += data + b"\0" * (-len(data) % 16)
+
+    headers.append(
+        section_header.pack(
+            name_offsets[0],
+            3,  # SHT_STRTAB
+            0,
+            0,
+            offset + len(body),
+            len(shstrtab),
+            0,
+            0,
+            1,
+            0,
+        )
+    )
+    body += shstrtab + b"\0" * (-len(shstrtab) % 16)
+
+    return (
+        header.pack(
+            b"\x7fELF\x02\x01\x01" + b"\0" * 9,
+            1,  # ET_REL
+            62,  # EM_X86_64
+            1,
+            0,
+            0,
+            offset + len(body),
+            0,
+            header.size,
+            0,
+            0,
+            section_header.size,
+            len(headers),
+            len(headers) - 1,
+        )
+        + bytes(body)
+        + b"".join(headers)
+    )
+
+
+def gen_elf(rnd, scale, ratio):
+    count = int(200 * scale)
+    changed = set(rnd.sample(range(count), int(count * ratio)))
+    sections1, sections2 = [], []
+
+    for x in range(count):
+        executable = x % 2 == 0
+        name = ".text.fn{:04d}" if executable else ".rodata.str{:04d}"
+        data = bytes(rnd.choices(range(256), k=rnd.randrange(64, 4096)))
+        sections1.append((name.format(x), executable, data))
+        if x in changed:
+            pos = rnd.randrange(len(data))
+            data = data[:pos] + bytes([data[pos] ^ 0xFF]) + data[pos + 1 :]
+        sections2.append((name.format(x), executable, data))
+
+    return make_elf(sections1), make_elf(sections2)
+
+
+def gen_text(rnd, scale, ratio):
+    lines1 = text_lines(rnd, int(200000 * scale))
+    lines2 = list(lines1)
+    for x in rnd.sample(range(len(lines1)), int(len(lines1) * ratio)):
+        lines2[x] = "modified {}\n".format(x)
+    return "".join(lines1).encode(), "".join(lines2).encode()
+
+
+def gen_nested(rnd, scale, ratio):
+    depth = max(1, int(8 * scale))
+    lines = text_lines(rnd, 1000)
+    data1, data2 = ("".join(x).encode() for x in (lines, modify(rnd, lines)))
+    name = "innermost.txt"
+
+    for x in range(depth):
+        siblings = {
+            "sibling{}.txt".format(y): "".join(text_lines(rnd, 50)).encode()
+            for y in range(5)
+        }
+        data1, data2 = (
+            gzip_compress(make_tarball(dict(siblings, **{name: data})))
+            for data in (data1, data2)
+        )
+        name = "level{:02d}.tar.gz".format(depth - x)
+
+    return data1, data2
+
+
+SCENARIOS = {
+    "tarball": (gen_tarball, "tar"),
+    "elf": (gen_elf, "o"),
+    "text": (gen_text, "txt"),
+    "nested": (gen_nested, "tar.gz"),
+}
+
+
+def generate(corpus_dir, scenarios, scale, ratio):
+    """
+    Write the pair of files for each of `scenarios` to `corpus_dir`, unless
+    they are already there.
+    """
+
+    paths = {}
+    for name in scenarios:
+        fn, ext = SCENARIOS[name]
+        tag = "{}-{}-{}".format(name, scale, ratio)
+        pair = [
+            os.path.join(corpus_dir, "{}.{}.{}".format(tag, x, ext))
+            for x in (1, 2)
+        ]
+        if not all(os.path.exists(x) for x in pair):
+            rnd = random.Random("{}-{}".format(SEED, name))
+            for path, data in zip(pair, fn(rnd, scale, ratio)):
+                with open(path, "wb") as f:
+                    f.write(data)
+        paths[name] = pair
+    return paths
+
+
+def measure(argv):
+    """
+    Run diffoscope with `argv` in this process and return its metrics.
+    """
+
+    from diffoscope.main import main as diffoscope_main
+
+    forks = 0
+
+    def count_fork():
+        nonlocal forks
+        forks += 1
+
+    # subprocess does not fork via os.fork(), so count it separately
+    original_init = subprocess.Popen.__init__
+
+    def popen_init(self, *args, **kwargs):
+        count_fork()
+        original_init(self, *args, **kwargs)
+
+    subprocess.Popen.__init__ = popen_init
+    os.register_at_fork(before=count_fork)
+
+    def cpu():
+        return sum(
+            x.ru_utime + x.ru_stime
+            for x in (
+                resource.getrusage(resource.RUSAGE_SELF),
+                resource.getrusage(resource.RUSAGE_CHILDREN),
+            )
+        )
+
+    cpu_start, wall_start = cpu(), time.perf_counter()
+    try:
+        diffoscope_main(argv)
+    except SystemExit as exc:
+        if exc.code not in (0, 1):
+            raise
+    wall, cpu_time = time.perf_counter() - wall_start, cpu() - cpu_start
+
+    return {
+        "wall": wall,
+        "cpu": cpu_time,
+        "forks": forks,
+        "maxrss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024,
+        "children_maxrss": resource.getrusage(
+            resource.RUSAGE_CHILDREN
+        ).ru_maxrss
+        // 1024,
+    }
+
+
+def run(scenario, paths, output, extra, tmpdir):
+    argv = list(paths) + ["--exclude-directory-metadata=yes"]
+    if output == "none":
+        # Otherwise diffoscope writes a text report to stdout
+        argv.append("--text=/dev/null")
+    else:
+        argv.append(
+            "--{}={}".format(
+                output, os.path.join(tmpdir, "{}.{}".format(scenario, output))
+            )
+        )
+    argv.extend(extra)
+
+    # Pass the metrics back in a file as diffoscope may write to stdout
+    metrics = os.path.join(tmpdir, "{}.metrics".format(scenario))
+    subprocess.check_call(
+        (
+            sys.executable,
+            __file__,
+            "--measure",
+            json.dumps(argv),
+            "--measure-output",
+            metrics,
+        ),
+        stdout=subprocess.DEVNULL,
+    )
+    with open(metrics) as f:
+        return json.load(f)
+
+
+def format_change(new, old):
+    if not old:
+        return ""
+    return " ({:+.0%})".format((new - old) / old)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip().splitlines()[0]
+    )
+    parser.add_argument(
+        "--scenario",
+        action="append",
+        choices=SCENARIOS,
+        help="Only run this scenario (may be repeated)",
+    )
+    parser.add_argument(
+        "--scale",
+        type=float,
+        default=1.0,
+        help="Multiply the size of each corpus by this (default: 1.0)",
+    )
+    parser.add_argument(
+        "--ratio",
+        type=float,
+        default=0.1,
+        help="Proportion of members, sections or lines that differ "
+        "(default: 0.1)",
+    )
+    parser.add_argument(
+        "--output",
+        choices=("html", "text", "json", "none"),
+        default="html",
+        help="Report format to write (default: html)",
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--corpus-dir",
+        help="Keep the generated corpora here and reuse them between runs "
+        "(default: a temporary directory)",
+    )
+    parser.add_argument(
+        "--save", metavar="FILE", help="Write the results to FILE as JSON"
+    )
+    parser.add_argument(
+        "--baseline",
+        metavar="FILE",
+        help="Show the change in each result relative to FILE",
+    )
+    parser.add_argument("--measure", help=argparse.SUPPRESS)
+    parser.add_argument("--measure-output", help=argparse.SUPPRESS)
+    # Any other arguments are passed to diffoscope
+    args, extra = parser.parse_known_args()
+
+    if args.measure:
+        result = measure(json.loads(args.measure))
+        if args.measure_output:
+            with open(args.measure_output, "w") as f:
+                json.dump(result, f)
+        else:
+            print(json.dumps(result))
+        return
+
+    scenarios = args.scenario or list(SCENARIOS)
+    settings = {
+        "scale": args.scale,
+        "ratio": args.ratio,
+        "output": args.output,
+        "extra": extra,
+    }
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            saved = json.load(f)
+        if saved["settings"] != settings:
+            print(
+                "W: {} was run with different settings: {}".format(
+                    args.baseline, saved["settings"]
+                )
+            )
+        baseline = saved["results"]
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        corpus_dir = args.corpus_dir or tmpdir
+        os.makedirs(corpus_dir, exist_ok=True)
+
+        start = time.perf_counter()
+        paths = generate(corpus_dir, scenarios, args.scale, args.ratio)
+        print(
+            "Generated corpora in {:.1f}s".format(time.perf_counter() - start)
+        )
+        print(
+            "{:<10} {}".format(
+                "scenario", " ".join("{:>9}".format(x) for x, _, _ in METRICS)
+            )
+        )
+
+        for scenario in scenarios:
+            runs = [
+                run(scenario, paths[scenario], args.output, extra, tmpdir)
+                for _ in range(args.repeat)
+            ]
+            result = min(runs, key=lambda x: x["wall"])
+            results[scenario] = result
+
+            print(
+                "{:<10} {}".format(
+                    scenario,
+                    " ".join(fmt.format(result[x]) for x, fmt, _ in METRICS),
+                )
+            )
+            if scenario in baseline:
+                print(
+                    "{:<10} {}".format(
+                        "",
+                        " ".join(
+                            "{:>9}".format(
+                                format_change(
+                                    result[x], baseline[scenario][x]
+                                ).strip()
+                            )
+                            for x, _, _ in METRICS
+                        ),
+                    )
+                )
+
+    print()
+    for x, _, description in METRICS:
+        print("{:>15}: {}".format(x, description))
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(
+                {"settings": settings, "results": results},
+                f,
+                indent=2,
+                sort_keys=True,
+            )
+            f.write("\n")
+
+
+if __name__ == "__main__":
+    main()
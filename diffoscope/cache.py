@@ -0,0 +1,452 @@
+#
+# diffoscope: in-depth comparison of files, archives, and directories
+#
+# Copyright © 2022 Chris Lamb <lamby@debian.org>
+#
+# diffoscope is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# diffoscope is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with diffoscope.  If not, see <https://www.gnu.org/licenses/>.
+
+import io
+import os
+import gzip
+import json
+import mmap
+import stat
+import hashlib
+import logging
+import tempfile
+import threading
+import collections
+
+from . import VERSION
+from .config import Config
+from .profiling import profile
+from .external_tools import EXTERNAL_TOOLS, REMAPPED_TOOL_NAMES
+from .tempfiles import is_temporary
+
+try:
+    import tlsh
+except ImportError:  # noqa
+    tlsh = None
+
+logger = logging.getLogger(__name__)
+
+# Config fields that may alter the Difference returned by compare_files.
+# Presentation-only limits (eg. max_report_size) are deliberately excluded.
+KEY_CONFIG_FIELDS = (
+    "diff_context",
+    "max_diff_input_lines",
+    "max_diff_block_lines_saved",
+    "diff_masks",
+    "new_file",
+    "fuzzy_threshold",
+    "excludes",
+    "exclude_commands",
+    "exclude_directory_metadata",
+    "extended_filesystem_attributes",
+    "compute_visual_diffs",
+    "max_container_depth",
+    "use_dbgsym",
+    "force_details",
+    "trust_zip_crc32",
+)
+
+HASH_CHUNK = 2**20
+
+# tlsh is not meaningful with files smaller than this many bytes
+TLSH_MIN_SIZE = 512
+
+Fingerprint = collections.namedtuple("Fingerprint", "sha256 tlsh")
+
+
+def read_chunks(f):
+    st = os.fstat(f.fileno())
+    if not stat.S_ISREG(st.st_mode) or not st.st_size:
+        yield from iter(lambda: f.read(HASH_CHUNK), b"")
+        return
+
+    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+        for x in range(0, len(m), HASH_CHUNK):
+            yield m[x : x + HASH_CHUNK]
+
+
+def compute_fingerprint(path, fuzzy=False):
+    """
+    Return the Fingerprint of the contents of `path`. Its TLSH digest is only
+    calculated (in the same pass over the file) if `fuzzy` is True, as it is
+    expensive and only used for fuzzy matching.
+    """
+
+    sha256 = hashlib.sha256()
+    fuzzy = tlsh.Tlsh() if tlsh and fuzzy else None
+    size = 0
+
+    with profile("cache", "fingerprint"), open(path, "rb") as f:
+        for buf in read_chunks(f):
+            sha256.update(buf)
+            if fuzzy is not None:
+                fuzzy.update(buf)
+            size += len(buf)
+
+    fuzzy_digest = None
+    if fuzzy is not None and size >= TLSH_MIN_SIZE:
+        fuzzy.final()
+        try:
+            fuzzy_digest = fuzzy.hexdigest()
+        except ValueError:
+            # File must contain a certain amount of randomness.
+            pass
+
+    return Fingerprint(sha256.hexdigest(), fuzzy_digest)
+
+
+def file_fingerprint(file, fuzzy=False):
+    """
+    Return the Fingerprint of the contents of `file`, memoized on the object
+    and, with --cache-dir, between runs. See compute_fingerprint.
+    """
+
+    result = memoized_fingerprint(file, fuzzy)
+    if result is None:
+        result = ComparisonCache().fingerprint(file.path, fuzzy)
+        file._fingerprints[fuzzy] = result
+    return result
+
+
+def memoized_fingerprint(file, fuzzy=False):
+    """
+    Return the Fingerprint of `file` if it has already been calculated,
+    otherwise None.
+    """
+
+    if not hasattr(file, "_fingerprints"):
+        file._fingerprints = {}
+
+    # One with a TLSH digest will do even if we did not ask for it
+    for x in (True,) if fuzzy else (True, False):
+        if x in file._fingerprints:
+            return file._fingerprints[x]
+
+    return None
+
+
+def is_cacheable(file):
+    from .comparators.missing_file import MissingFile
+
+    if isinstance(file, MissingFile):
+        return False
+
+    return not (
+        file.is_directory()
+        or file.is_symlink()
+        or file.is_device()
+        or file.is_socket_or_fifo()
+    )
+
+
+class ComparisonCache:
+    """
+    A persistent, content-addressed cache of compare_files() results.
+
+    Entries are keyed on the contents and names of both files, the
+    diffoscope version and any Config() value that can affect the result.
+    Each entry is a gzipped JSON report (as written by --json) or an empty
+    file if there were no differences.
+
+    It also holds the Fingerprint of files outside our temporary directory,
+    keyed on their device, inode, size, mtime and ctime.
+
+    Entries are evicted in least-recently-used order (by mtime) once the
+    cache exceeds `max_size`.
+    """
+
+    _singleton = {}
+
+    def __init__(self):
+        self.__dict__ = self._singleton
+
+        if not self._singleton:
+            self.lock = threading.Lock()
+            self.total_size = None
+            self.total_size_path = None
+            self.tools = {}
+
+    @property
+    def path(self):
+        return Config().cache_dir
+
+    @property
+    def max_size(self):
+        return Config().cache_max_size
+
+    @property
+    def enabled(self):
+        return self.path is not None and Config().difftool is None
+
+    def installed_tools(self):
+        """
+        Return the path, size and modification time of each external tool we
+        may run, so that results are not reused once a tool has been
+        installed, removed or upgraded.
+        """
+
+        from .tools import tool_check_installed
+
+        # Tools may be remapped (eg. by --tool-prefix-binutils)
+        remapped = tuple(sorted(REMAPPED_TOOL_NAMES.items()))
+
+        with self.lock:
+            if remapped not in self.tools:
+                result = []
+                for x in sorted(EXTERNAL_TOOLS):
+                    path = tool_check_installed(x)
+                    if path is None:
+                        continue
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    result.append((x, path, st.st_size, st.st_mtime_ns))
+                self.tools[remapped] = result
+
+            return self.tools[remapped]
+
+    def key(self, file1, file2, diff_content_only):
+        config = Config()
+        depth = getattr(file1.container, "depth", -1)
+
+        data = json.dumps(
+            [
+                VERSION,
+                file_fingerprint(file1).sha256,
+                file_fingerprint(file2).sha256,
+                file1.name,
+                file2.name,
+                depth,
+                diff_content_only,
+                [(x, getattr(config, x, None)) for x in KEY_CONFIG_FIELDS],
+                self.installed_tools(),
+            ],
+            default=str,
+        )
+
+        return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+    def entry_path(self, key, suffix=".json.gz"):
+        return os.path.join(self.path, key[:2], f"{key}{suffix}")
+
+    def fingerprint(self, path, fuzzy=False):
+        """
+        Return the Fingerprint of `path`, reusing one calculated by a previous
+        run if the file has not changed since.
+        """
+
+        # Our temporary files (eg. extracted from archives) are never seen
+        # again, so there is no point caching them.
+        if self.path is None or is_temporary(path):
+            return compute_fingerprint(path, fuzzy)
+
+        def stat_key():
+            st = os.stat(path)
+            if not stat.S_ISREG(st.st_mode):
+                return None
+            data = json.dumps(
+                [
+                    st.st_dev,
+                    st.st_ino,
+                    st.st_size,
+                    st.st_mtime_ns,
+                    st.st_ctime_ns,
+                    fuzzy and tlsh is not None,
+                ]
+            )
+            return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+        key = stat_key()
+        if key is None:
+            return compute_fingerprint(path, fuzzy)
+
+        entry = self.entry_path(key, ".fingerprint")
+        try:
+            with open(entry, encoding="utf-8") as f:
+                sha256, fuzzy_digest = json.load(f)
+            os.utime(entry)  # Mark as recently used
+            return Fingerprint(sha256, fuzzy_digest)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as exc:
+            logger.warning("Ignoring corrupt cache entry %s: %s", entry, exc)
+
+        fingerprint = compute_fingerprint(path, fuzzy)
+
+        # Don't store it if the file was modified while we were reading it
+        if stat_key() == key:
+            self.write_entry(entry, json.dumps(fingerprint).encode("utf-8"))
+
+        return fingerprint
+
+    def lookup(self, key):
+        """
+        Returns a (found, difference) tuple.
+        """
+
+        from .readers import load_diff
+        from .readers.utils import UnrecognizedFormatError
+
+        path = self.entry_path(key)
+        try:
+            with profile("cache", "lookup"):
+                with gzip.open(path, "rt", encoding="utf-8") as f:
+                    data = f.read()
+                difference = None
+                if data:
+                    difference = load_diff(io.StringIO(data), path)
+            os.utime(path)  # Mark as recently used
+        except FileNotFoundError:
+            return False, None
+        except (
+            OSError,
+            EOFError,
+            KeyError,
+            ValueError,
+            UnrecognizedFormatError,
+        ) as exc:
+            logger.warning("Ignoring corrupt cache entry %s: %s", path, exc)
+            return False, None
+
+        logger.debug("Cache hit for %s", key)
+
+        return True, difference
+
+    def store(self, key, difference):
+        from .presenters.json import JSONPresenter
+
+        if difference is not None and any(
+            x.visuals for x in difference.traverse_depth()
+        ):
+            # Visual differences are not serialised by --json
+            return
+
+        buf = io.StringIO()
+        if difference is not None:
+            JSONPresenter(lambda x: buf.write(x)).start(difference)
+
+        with profile("cache", "store"):
+            data = gzip.compress(buf.getvalue().encode("utf-8"))
+
+        self.write_entry(self.entry_path(key), data)
+
+    def write_entry(self, path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Write atomically as other processes may share this cache
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except OSError:
+            logger.exception("Unable to write cache entry %s", path)
+            try:
+                os.unlink(tmp)
+            except FileNotFoundError:
+                pass
+            return
+
+        self.account(os.path.getsize(path))
+
+    def entries(self):
+        for x in os.scandir(self.path):
+            if not x.is_dir(follow_symlinks=False):
+                continue
+            for y in os.scandir(x.path):
+                if y.name.endswith((".json.gz", ".fingerprint")):
+                    yield y
+
+    def stat_entries(self):
+        """
+        Return the mtime, size and path of each entry, skipping any that
+        another process removes in the meantime.
+        """
+
+        result = []
+        for x in self.entries():
+            try:
+                st = x.stat()
+            except FileNotFoundError:
+                continue
+            result.append((st.st_mtime, st.st_size, x.path))
+        return result
+
+    def account(self, size):
+        with self.lock:
+            if self.total_size_path != self.path:
+                self.total_size = sum(x[1] for x in self.stat_entries())
+                self.total_size_path = self.path
+            else:
+                self.total_size += size
+
+            if self.total_size > self.max_size:
+                self.evict()
+
+    def evict(self):
+        # Shrink to 90% to avoid evicting on every subsequent store
+        target = self.max_size * 0.9
+        entries = sorted(self.stat_entries())
+        self.total_size = sum(x[1] for x in entries)
+
+        logger.debug(
+            "Cache is %d bytes (max %d), evicting entries",
+            self.total_size,
+            self.max_size,
+        )
+
+        for _, size, path in entries:
+            if self.total_size <= target:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            self.total_size -= size
+
+
+def cached_compare(file1, file2, diff_content_only, compare_fn):
+    """
+    Call `compare_fn` unless the result is available in the cache.
+    """
+
+    cache = ComparisonCache()
+
+    if not (cache.enabled and is_cacheable(file1) and is_cacheable(file2)):
+        return compare_fn()
+
+    try:
+        # Identical files are cheap to compare; don't fill the cache with them
+        if file_fingerprint(file1).sha256 == file_fingerprint(file2).sha256:
+            return compare_fn()
+        key = cache.key(file1, file2, diff_content_only)
+    except OSError:
+        return compare_fn()
+
+    found, difference = cache.lookup(key)
+    if found:
+        return difference
+
+    difference = compare_fn()
+
+    # Don't store results that were cut short
+    if not Config().timeout_exceeded():
+        cache.store(key, difference)
+
+    return difference
@@ -130,7 +130,9 @@ class ComparatorManager:
             self.reload()
 
     def reload(self):
-        self.classes = []
+        # Only publish the list once it is complete as specialize() may be
+        # called concurrently from several threads (see --jobs).
+        classes = []
 
         for xs in self.COMPARATORS:
             errors = []
@@ -149,7 +151,7 @@ class ComparatorManager:
                     errors.append((x, e))
                     continue
 
-                self.classes.append(getattr(mod, klass_name))
+                classes.append(getattr(mod, klass_name))
                 break
             else:  # noqa
                 logger.error(
@@ -163,6 +165,7 @@ class ComparatorManager:
                     traceback.print_exception(None, x[1], x[1].__traceback__)
                 sys.exit(2)
 
+        self.classes = classes
         logger.debug("Loaded %d comparator classes", len(self.classes))
 
     def format_descriptions(self):
@@ -20,6 +20,7 @@
 import os
 import re
 import logging
+import threading
 
 from diffoscope.config import Config
 from diffoscope.difference import Difference
@@ -29,7 +30,11 @@ from .tar import TarContainer
 from .utils.compare import compare_files
 from .utils.file import File
 from .utils.archive import ArchiveMember
-from .utils.libarchive import LibarchiveContainer, list_libarchive
+from .utils.libarchive import (
+    LibarchiveContainer,
+    extract_member,
+    list_libarchive,
+)
 from .utils.specialize import specialize
 
 try:
@@ -41,24 +46,78 @@ except ImportError:
 logger = logging.getLogger(__name__)
 
 
-# Return a dict with build ids as keys and file as values for all deb in the
-# given container
-def get_build_id_map(container):
-    d = {}
-    for member_name, member in container.get_adjusted_members():
-        # Let's assume the name will end with .deb to avoid looking at
-        # too many irrelevant files
-        if not member_name.endswith(".deb"):
-            continue
+class BuildIdIndex:
+    """
+    The -dbgsym package providing the debug symbols for each Build ID, shared
+    by every ELF file in the run.
 
-        specialize(member)
+    Each container (eg. the directory or .changes file of a .deb) is only
+    searched once, reading the control file of just its -dbgsym packages.
+    The packages found keep their containers (and their temporary files)
+    alive, so the index is cleared at the end of each run.
+    """
 
-        if isinstance(member, DebFile) and member.control:
-            build_ids = member.control.get("Build-Ids", None)
-            if build_ids:
-                d.update({build_id: member for build_id in build_ids.split()})
+    # Let's assume the name will follow this to avoid looking at too many
+    # irrelevant files
+    RE_DBGSYM = re.compile(r"-dbgsym_[^/]*\.deb$")
 
-    return d
+    _singleton = {}
+
+    def __init__(self):
+        self.__dict__ = self._singleton
+
+        if not self._singleton:
+            self.lock = threading.Lock()
+            # Keyed on the path of each container
+            self.containers = {}
+
+    def clear(self):
+        with self.lock:
+            self.containers.clear()
+
+    def scan(self, container):
+        result = {}
+
+        for member_name, member in container.get_adjusted_members():
+            if not self.RE_DBGSYM.search(member_name):
+                continue
+
+            specialize(member)
+
+            if isinstance(member, DebFile) and member.control:
+                build_ids = member.control.get("Build-Ids", None)
+                if build_ids:
+                    result.update({x: member for x in build_ids.split()})
+
+        logger.debug(
+            "Found %d Build IDs in -dbgsym packages in %s",
+            len(result),
+            container.source.path,
+        )
+
+        return result
+
+    def lookup(self, build_id, container):
+        """
+        Return the -dbgsym DebFile for `build_id`, preferring one in
+        `container`, or None.
+        """
+
+        path = container.source.path
+
+        with self.lock:
+            if path not in self.containers:
+                self.containers[path] = self.scan(container)
+
+            candidates = [self.containers[path]] + [
+                v for k, v in self.containers.items() if k != path
+            ]
+
+        for x in candidates:
+            if build_id in x:
+                return x[build_id]
+
+        return None
 
 
 class DebContainer(LibarchiveContainer):
@@ -78,6 +137,19 @@ class DebContainer(LibarchiveContainer):
 
             return specialize(member.as_container.get_member("content"))
 
+    def extract_data_member(self, member_name, dest):
+        """
+        Write just `member_name` from data.tar to `dest`, streaming through
+        the compressed tarball rather than unpacking all of it. Returns
+        whether it was found.
+        """
+
+        for name, member in self.get_adjusted_members():
+            if DebContainer.RE_DATA_TAR.match(name):
+                return extract_member(member.path, member_name, dest)
+
+        return False
+
     @property
     def control_tar(self):
         for name, member in self.get_adjusted_members():
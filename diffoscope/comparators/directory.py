@@ -31,6 +31,7 @@ from .binary import FilesystemFile
 from .missing_file import AbstractMissingType
 from .utils.command import Command, our_check_output
 from .utils.container import Container
+from .utils.file import add_streamed_details
 
 logger = logging.getLogger(__name__)
 
@@ -275,12 +276,16 @@ class FilesystemDirectory(Directory):
 
         my_container = DirectoryContainer(self)
         other_container = DirectoryContainer(other)
-        differences.extend(my_container.compare(other_container))
+        members = my_container.compare(other_container)
+
+        difference = Difference(self.path, other.path, source)
+        if Config().streaming:
+            return add_streamed_details(difference, differences, iter(members))
+        differences.extend(members)
 
         if not differences:
             return None
 
-        difference = Difference(self.path, other.path, source)
         difference.add_details(differences)
         return difference
 
@@ -22,17 +22,24 @@ import re
 import logging
 import subprocess
 import collections
-import hashlib
 
 from diffoscope.exc import OutputParsingError
 from diffoscope.tools import get_tool_name, tool_required
 from diffoscope.config import Config
-from diffoscope.tempfiles import get_named_temporary_file
 from diffoscope.difference import Difference
 from diffoscope.utils import format_class
 
-from .deb import DebFile, get_build_id_map
+from .deb import BuildIdIndex, DebFile
 from .decompile import DecompilableContainer
+from .utils.elf import (
+    ElfImage,
+    ElfFormatError,
+    SHF_EXECINSTR,
+    SHF_STRINGS,
+    crc32_suffix,
+    file_crc32,
+    type_name,
+)
 from .utils.file import File
 from .utils.command import Command, our_check_output
 
@@ -333,8 +340,23 @@ class ElfSection(File):
         return False
 
     def has_same_content_as(self, other):
-        # Always force diff of the section
-        return False
+        # Compare the contents of the sections themselves so that we only
+        # run readelf(1), etc. on sections that differ.
+        if type(self) is not type(other):
+            return False
+
+        try:
+            digest = self.content_digest()
+            return digest is not None and digest == other.content_digest()
+        except (OSError, ElfFormatError) as e:
+            logger.debug("Unable to compare section %s: %s", self.name, e)
+            return False
+
+    def content_digest(self):
+        elf = self.container.elf
+        if elf is None:
+            return None
+        return elf.section_digest(self._name)
 
     @property
     def fuzzy_hash(self):
@@ -352,6 +374,13 @@ class ElfSection(File):
 
 
 class ElfCodeSection(ElfSection):
+    def content_digest(self):
+        # The line numbers in the disassembly may come from separate debug
+        # symbols that the section does not reflect.
+        if self.container.debug_symbols_installed:
+            return None
+        return super().content_digest()
+
     def compare(self, other, source=None):
         # Disassemble with line numbers, but if the command is excluded or
         # fails, fallback to disassembly. If that is also excluded or failing,
@@ -397,50 +426,6 @@ class ElfStringSection(ElfSection):
         )
 
 
-@tool_required("readelf")
-def get_build_id(path):
-    try:
-        output = our_check_output(
-            [get_tool_name("readelf"), "--notes", path],
-            stderr=subprocess.DEVNULL,
-        )
-    except subprocess.CalledProcessError as e:
-        logger.debug("Unable to get Build ID for %s: %s", path, e)
-        return None
-
-    m = re.search(
-        r"^\s+Build ID: ([0-9a-f]+)$",
-        output.decode("utf-8"),
-        flags=re.MULTILINE,
-    )
-    if not m:
-        return None
-
-    return m.group(1)
-
-
-@tool_required("readelf")
-def get_debug_link(path):
-    try:
-        output = our_check_output(
-            [get_tool_name("readelf"), "--string-dump=.gnu_debuglink", path],
-            stderr=subprocess.DEVNULL,
-        )
-    except subprocess.CalledProcessError as e:
-        logger.debug("Unable to get Build Id for %s: %s", path, e)
-        return None
-
-    m = re.search(
-        r"^\s+\[\s+0\]\s+(\S+)$",
-        output.decode("utf-8", errors="replace"),
-        flags=re.MULTILINE,
-    )
-    if not m:
-        return None
-
-    return m.group(1)
-
-
 class ElfContainer(DecompilableContainer):
     auto_diff_metadata = False
 
@@ -455,6 +440,74 @@ class ElfContainer(DecompilableContainer):
         super().__init__(*args, **kwargs)
         logger.debug("Creating ElfContainer for %s", self.source.path)
 
+        self.debug_symbols_installed = False
+        try:
+            self.elf = ElfImage(self.source.path)
+            sections = self._read_sections()
+        except (OSError, ElfFormatError) as e:
+            logger.debug(
+                "Unable to read sections of %s (%s); using readelf",
+                self.source.path,
+                e,
+            )
+            self.elf = None
+            sections = self._parse_readelf_sections()
+
+        has_debug_symbols = False
+        has_build_id = False
+        self._sections = collections.OrderedDict()
+
+        for name, type, elf_class in sections:
+            if name.startswith(".debug") or name.startswith(".zdebug"):
+                has_debug_symbols = True
+
+            if name == ".note.gnu.build-id" and type == "NOTE":
+                has_build_id = True
+
+            if _should_skip_section(name, type):
+                continue
+
+            logger.debug(
+                "Adding section %s (%s) as %s",
+                name,
+                type,
+                format_class(elf_class, strip="diffoscope.comparators.elf."),
+            )
+            self._sections[name] = elf_class(self, name)
+
+        if not has_debug_symbols:
+            self._install_debug_symbols()
+
+        if has_build_id:
+            try:
+                self._verify_build_id()
+            except Exception:
+                # It is fine to skip the verification of the build_id
+                pass
+
+    def _read_sections(self):
+        """
+        Return the (name, type, class) of each section, from ElfImage.
+        """
+
+        result = []
+        for x in self.elf.sections[1:]:
+            # As SECTION_FLAG_MAPPING, where "X" takes precedence over "S"
+            if x.flags & SHF_EXECINSTR:
+                elf_class = ElfCodeSection
+            elif x.flags & SHF_STRINGS:
+                elf_class = ElfStringSection
+            else:
+                elf_class = ElfSection
+            result.append((x.name, type_name(x), elf_class))
+        return result
+
+    def _parse_readelf_sections(self):
+        """
+        Return the (name, type, class) of each section, from the output of
+        `readelf --section-headers`.
+        """
+
         cmd = [
             get_tool_name("readelf"),
             "--wide",
@@ -462,8 +515,7 @@ class ElfContainer(DecompilableContainer):
             self.source.path,
         ]
         output = our_check_output(cmd, shell=False, stderr=subprocess.DEVNULL)
-        has_debug_symbols = False
-        has_build_id = False
+        result = []
 
         try:
             output = output.decode("utf-8").split("\n")
@@ -473,7 +525,6 @@ class ElfContainer(DecompilableContainer):
 
             # Entries of readelf --section-headers have the following columns:
             # [Nr]  Name  Type  Address  Off  Size  ES  Flg  Lk  Inf  Al
-            self._sections = collections.OrderedDict()
             for line in output:
                 if line.startswith("Key to Flags"):
                     break
@@ -482,15 +533,6 @@ class ElfContainer(DecompilableContainer):
                 line = line.split("]", 1)[1].split()
                 name, type, flags = line[0], line[1], line[6] + "_"
 
-                if name.startswith(".debug") or name.startswith(".zdebug"):
-                    has_debug_symbols = True
-
-                if name == ".note.gnu.build-id" and type == "NOTE":
-                    has_build_id = True
-
-                if _should_skip_section(name, type):
-                    continue
-
                 # Use first match, with last option being '_' as fallback
                 elf_class = [
                     ElfContainer.SECTION_FLAG_MAPPING[x]
@@ -498,15 +540,7 @@ class ElfContainer(DecompilableContainer):
                     if x in ElfContainer.SECTION_FLAG_MAPPING
                 ][0]
 
-                logger.debug(
-                    "Adding section %s (%s) as %s",
-                    name,
-                    type,
-                    format_class(
-                        elf_class, strip="diffoscope.comparators.elf."
-                    ),
-                )
-                self._sections[name] = elf_class(self, name)
+                result.append((name, type, elf_class))
 
         except Exception as e:
             command = " ".join(cmd)
@@ -519,15 +553,7 @@ class ElfContainer(DecompilableContainer):
             )
             raise OutputParsingError(command, self)
 
-        if not has_debug_symbols:
-            self._install_debug_symbols()
-
-        if has_build_id:
-            try:
-                self._verify_build_id()
-            except Exception:
-                # It is fine to skip the verification of the build_id
-                pass
+        return result
 
     @tool_required("objcopy")
     def _install_debug_symbols(self):
@@ -559,10 +585,17 @@ class ElfContainer(DecompilableContainer):
             return
 
         # Retrieve the Build ID for the ELF file we are examining
-        build_id = get_build_id(self.source.path)
-        debuglink = get_debug_link(self.source.path)
+        if self.elf is None:
+            return
+        try:
+            build_id = self.elf.build_id()
+            debuglink = self.elf.debug_link()
+        except (OSError, ElfFormatError) as e:
+            logger.debug("Unable to read Build ID of %s: %s", self.elf.path, e)
+            return
         if not build_id or not debuglink:
             return
+        debuglink, debuglink_crc = debuglink
 
         logger.debug(
             "Looking for a dbgsym package for Build Id %s (debuglink: %s)",
@@ -570,27 +603,29 @@ class ElfContainer(DecompilableContainer):
             debuglink,
         )
 
-        # Build a map of Build-Ids if it doesn't exist yet
-        if not hasattr(deb.container, "dbgsym_build_id_map"):
-            deb.container.dbgsym_build_id_map = get_build_id_map(deb.container)
-
-        if build_id not in deb.container.dbgsym_build_id_map:
+        dbgsym_package = BuildIdIndex().lookup(build_id, deb.container)
+        if dbgsym_package is None:
             logger.debug(
                 "Unable to find a matching debug package for Build Id %s",
                 build_id,
             )
             return
 
-        dbgsym_package = deb.container.dbgsym_build_id_map[build_id]
+        # Create a .debug directory and extract the debug symbols there with
+        # the right name
+        dest_path = os.path.join(
+            os.path.dirname(self.source.path),
+            ".debug",
+            os.path.basename(debuglink),
+        )
+        os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+
         debug_file_path = "./usr/lib/debug/.build-id/{0}/{1}.debug".format(
             build_id[:2], build_id[2:]
         )
-        debug_file = (
-            dbgsym_package.as_container.data_tar.as_container.lookup_file(
-                debug_file_path
-            )
-        )
-        if not debug_file:
+        if not dbgsym_package.as_container.extract_data_member(
+            debug_file_path, dest_path
+        ):
             logger.debug(
                 "Unable to find the matching debug file %s in %s",
                 debug_file_path,
@@ -598,52 +633,28 @@ class ElfContainer(DecompilableContainer):
             )
             return
 
-        # Create a .debug directory and link the debug symbols there with the
-        # right name
-        dest_path = os.path.join(
-            os.path.dirname(self.source.path),
-            ".debug",
-            os.path.basename(debuglink),
-        )
-        os.makedirs(os.path.dirname(dest_path), exist_ok=True)
-
-        def objcopy(*args):
-            our_check_output(
-                (get_tool_name("objcopy"),) + args,
-                shell=False,
-                stderr=subprocess.DEVNULL,
-            )
-
-        # If #812089 was fixed, we would just do os.link(debug_file.path,
-        # dest_path) but for now, we need to do more complicated things…
-        # 1. Use objcopy to create a file with only the original .gnu_debuglink
-        # section as we will have to update it to get the CRC right.
-        debuglink_path = get_named_temporary_file(
-            prefix="{}.debuglink.".format(self.source.path)
-        ).name
-
-        objcopy(
-            "--only-section=.gnu_debuglink", self.source.path, debuglink_path
+        # If #812089 was fixed, we could use the debug symbols as they are but
+        # for now, we need to decompress them…
+        our_check_output(
+            [
+                get_tool_name("objcopy"),
+                "--decompress-debug-sections",
+                dest_path,
+            ],
+            shell=False,
+            stderr=subprocess.DEVNULL,
         )
 
-        # 2. Monkey-patch the ElfSection object created for the .gnu_debuglink
-        # to change the path to point to this new file
-        section = self._sections[".gnu_debuglink"]
-
-        class MonkeyPatchedElfSection(section.__class__):
-            @property
-            def path(self):
-                return debuglink_path
-
-        section.__class__ = MonkeyPatchedElfSection
-
-        # 3. Create a file with the debug symbols in uncompressed form
-        objcopy("--decompress-debug-sections", debug_file.path, dest_path)
-
-        # 4. Update the .gnu_debuglink to this new file so we get the CRC right
-        objcopy("--remove-section=.gnu_debuglink", self.source.path)
-        objcopy("--add-gnu-debuglink={}".format(dest_path), self.source.path)
+        # … which changes their CRC32 so that it no longer matches the one in
+        # the .gnu_debuglink section. Rather than rewriting the binary with a
+        # new .gnu_debuglink, append four bytes to the debug symbols to
+        # restore it. (This leaves the original .gnu_debuglink to compare.)
+        with open(dest_path, "r+b") as f:
+            crc = file_crc32(f)
+            if crc != debuglink_crc:
+                f.write(crc32_suffix(crc, debuglink_crc))
 
+        self.debug_symbols_installed = True
         logger.debug("Installed debug symbols at %s", dest_path)
 
     def _verify_build_id(self):
@@ -652,19 +663,16 @@ class ElfContainer(DecompilableContainer):
         that matches the binary. (#260)
         """
 
-        with open(self.source.path, "rb") as f:
-            blob = f.read()
+        if self.elf is None:
+            return
 
-        # Magic value: length=0x14, owner length=3, owner='GNU', followed by the sha1 checksum
-        m = re.search(
-            b"\x14\x00\x00\x00\x03\x00\x00\x00\x47\x4e\x55\x00.{20}", blob
-        )
-        build_id = blob[m.end() - 20 : m.end()].hex()
-        blob_with_reset_build_id = (
-            blob[: m.end() - 20] + b"\x00" * 20 + blob[m.end() :]
-        )
+        build_id = self.elf.build_id()
+        # Only a SHA-1 of the binary itself can be verified
+        if build_id is None or len(build_id) != 40:
+            return
 
-        if hashlib.sha1(blob_with_reset_build_id).hexdigest() != build_id:
+        digest = self.elf.build_id_digest()
+        if digest != build_id:
             self.source.add_comment(
                 f"File has been modified after NT_GNU_BUILD_ID has been applied."
             )
@@ -673,7 +681,7 @@ class ElfContainer(DecompilableContainer):
             )
             logger.debug(
                 "Expected value: %s, current value: %s",
-                hashlib.sha1(blob_with_reset_build_id).hexdigest(),
+                digest,
                 build_id,
             )
         return
@@ -736,12 +744,12 @@ class ElfFile(File):
     FILE_TYPE_RE = re.compile(r"^ELF ")
 
     def compare_details(self, other, source=None):
-        differences = [
-            Difference.from_operation(
-                x, self.path, other.path, ignore_returncodes={1}
-            )
-            for x in list(READELF_COMMANDS) + READELF_DEBUG_DUMP_COMMANDS
-        ]
+        differences = Difference.from_operations(
+            list(READELF_COMMANDS) + READELF_DEBUG_DUMP_COMMANDS,
+            self.path,
+            other.path,
+            ignore_returncodes={1},
+        )
 
         difference = Difference.from_operation(Strings, self.path, other.path)
         if difference:
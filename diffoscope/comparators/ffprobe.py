@@ -27,6 +27,8 @@ from .utils.command import Command
 
 class Ffprobe(Command):
     MASK_STDERR = True
+    # Our output is read from stderr
+    STREAM_MIN_SIZE = None
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -35,6 +37,7 @@ class Ffprobe(Command):
 
     @property
     def output(self):
+        self.wait()
         return self._process.stderr.splitlines(True)
 
     @tool_required("ffprobe")
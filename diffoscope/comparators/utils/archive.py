@@ -110,7 +110,7 @@ class ArchiveMember(File):
                 self.container.source.name,
                 self._temp_dir.name,
             )
-            with profile("container_extract", self.container):
+            with profile("container_extract", self.container, path=self):
                 self._path = self.container.extract(
                     self._name, self._temp_dir.name
                 )
@@ -16,12 +16,16 @@
 # You should have received a copy of the GNU General Public License
 # along with diffoscope.  If not, see <https://www.gnu.org/licenses/>.
 
+import os
 import abc
 import signal
 import logging
+import threading
 import subprocess
 
 from .operation import Operation
+from .parallel import submit_subprocess
+from ...profiling import profile
 from ...utils import format_cmdline
 
 logger = logging.getLogger(__name__)
@@ -32,6 +36,11 @@ class Command(Operation, metaclass=abc.ABCMeta):
     MAX_STDERR_LINES = 25
     VALID_RETURNCODES = {0}
 
+    # Read the output of commands on files of at least this many bytes
+    # incrementally (see iter_output) rather than holding it all in memory.
+    # None to disable.
+    STREAM_MIN_SIZE = 2**22
+
     def start(self):
         logger.debug("Executing %s", self.full_name())
 
@@ -42,18 +51,161 @@ class Command(Operation, metaclass=abc.ABCMeta):
         # consider using a shell pipeline ("sh -ec $script") to implement what
         # you need, because that involves much less code - like it or not (I
         # don't) shell is still the most readable option for composing processes
-        self._process = subprocess.run(
-            self.cmdline(),
-            close_fds=True,
-            env=self.env(),
-            input=self.input(),
-            stdin=self._stdin,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
+        self._process = None
+        self._future = None
+        self._deferred = None
+        self._pending = True
+
+        cmdline, env, input = self.cmdline(), self.env(), self.input()
+
+        if input is None and self.should_stream():
+            # Only run streaming commands once their output is read (see
+            # Difference._from_started_operations), as that is when they
+            # are given their --max-subprocesses slots.
+            self.streaming = True
+            self._deferred = (cmdline, env, self._stdin)
+        else:
+            self._future = submit_subprocess(
+                self._run, cmdline, env, input, self._stdin
+            )
+
+    def _run(self, cmdline, env, input, stdin):
+        with profile("command_start", self.name):
+            return subprocess.run(
+                cmdline,
+                close_fds=True,
+                env=env,
+                input=input,
+                stdin=stdin,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+            )
+
+    def should_stream(self):
+        """
+        Whether to read the output of this command incrementally via
+        iter_output() rather than buffering all of it in memory.
+        """
+
+        if self.STREAM_MIN_SIZE is None:
+            return False
+
+        try:
+            return os.path.getsize(self.path) >= self.STREAM_MIN_SIZE
+        except OSError:
+            return False
+
+    def _launch(self):
+        if self._deferred is not None:
+            self._start_streaming(*self._deferred)
+            self._deferred = None
+
+    def _start_streaming(self, cmdline, env, stdin):
+        # Streaming commands are not run on the --max-subprocesses pool as
+        # their output is consumed elsewhere; they simply block once the pipe
+        # is full until it is read.
+        with profile("command_start", self.name):
+            self._process = subprocess.Popen(
+                cmdline,
+                close_fds=True,
+                env=env,
+                stdin=stdin,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+            )
+
+        # Read stderr concurrently so the command cannot block on it
+        self._stderr_lines = []
+        self._stderr_count = 0
+        self._stderr_thread = threading.Thread(
+            target=self._drain_stderr, daemon=True
         )
+        self._stderr_thread.start()
+
+    def _drain_stderr(self):
+        with self._process.stderr as f:
+            for line in f:
+                if self._stderr_count < Command.MAX_STDERR_LINES:
+                    self._stderr_lines.append(line)
+                self._stderr_count += 1
+
+    def wait(self):
+        """
+        Wait for the command launched by start() to complete. This is called
+        implicitly when accessing its output, return code or error string.
+        """
+
+        if not self._pending:
+            return self._returncode
+
+        self._launch()
+
+        if self._future is not None:
+            self._process = self._future.result()
+            self._stdout = self._process.stdout
+            lines = self._process.stderr.splitlines(True)
+            self._returncode = self._process.returncode
+            self._error_string = self._read_stderr(
+                lines[: Command.MAX_STDERR_LINES], len(lines)
+            )
+        else:
+            # Anything not already consumed by iter_output()
+            with self._process.stdout as f:
+                self._stdout = f.read()
+            self._returncode = self._process.wait()
+            self._stderr_thread.join()
+            self._error_string = self._read_stderr(
+                self._stderr_lines, self._stderr_count
+            )
+
+        self._pending = False
+
+        return self._returncode
+
+    def iter_output(self):
+        if self._future is not None or not self._pending:
+            yield from self.output
+            return
+
+        self._launch()
+        for line in self._process.stdout:
+            yield line
+
+        self.wait()
+
+    def terminate(self):
+        # Only streaming commands can be left waiting on their output
+        if getattr(self, "_pending", False) and self._future is None:
+            if self._deferred is not None:
+                # Never started, so there is nothing to wait for
+                self._deferred = None
+                self._pending = False
+                self._stdout = b""
+                self._returncode = -signal.SIGKILL
+                self._error_string = ""
+                return
+            self._process.kill()
+            self.wait()
+
+    @property
+    def returncode(self):
+        if getattr(self, "_pending", False):
+            self.wait()
+        return self._returncode
+
+    @returncode.setter
+    def returncode(self, val):
+        self._returncode = val
+
+    @property
+    def error_string(self):
+        if getattr(self, "_pending", False):
+            self.wait()
+        return self._error_string
 
-        self.error_string = self._read_stderr()
-        self.returncode = self._process.returncode
+    @error_string.setter
+    def error_string(self, val):
+        self._error_string = val
 
     def stdin(self):
         return None
@@ -79,21 +231,18 @@ class Command(Operation, metaclass=abc.ABCMeta):
     def input(self):
         pass
 
-    def _read_stderr(self):
+    def _read_stderr(self, lines, count):
         if self.MASK_STDERR:
             return ""
 
         buf = ""
-        lines = self._process.stderr.splitlines(True)
 
-        for index, line in enumerate(lines):
-            if index >= Command.MAX_STDERR_LINES:
-                break
+        for line in lines:
             buf += line.decode("utf-8", errors="replace")
 
-        if len(lines) > Command.MAX_STDERR_LINES:
+        if count > Command.MAX_STDERR_LINES:
             buf += "[ truncated after {} lines; {} ignored ]\n".format(
-                Command.MAX_STDERR_LINES, len(lines) - Command.MAX_STDERR_LINES
+                Command.MAX_STDERR_LINES, count - Command.MAX_STDERR_LINES
             )
 
         return buf
@@ -108,7 +257,8 @@ class Command(Operation, metaclass=abc.ABCMeta):
 
     @property
     def output(self):
-        return self._process.stdout.splitlines(True)
+        self.wait()
+        return self._stdout.splitlines(True)
 
 
 def our_check_output(cmd, *args, **kwargs):
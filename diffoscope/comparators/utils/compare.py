@@ -23,10 +23,12 @@ import logging
 import binascii
 import subprocess
 
+from diffoscope.cache import cached_compare
 from diffoscope.tools import tool_required
 from diffoscope.exc import RequiredToolNotFound
 from diffoscope.utils import exit_if_paths_do_not_exist
 from diffoscope.config import Config
+from diffoscope import hexdump
 from diffoscope.excludes import any_excluded
 from diffoscope.profiling import profile
 from diffoscope.difference import Difference
@@ -104,9 +106,24 @@ def compare_files(file1, file2, source=None, diff_content_only=False):
     if any_excluded(file1.name, file2.name):
         return None
 
+    with profile("compare_files", file1):
+        if source is None:
+            return cached_compare(
+                file1,
+                file2,
+                diff_content_only,
+                lambda: _compare_files(
+                    file1, file2, source, diff_content_only
+                ),
+            )
+
+        return _compare_files(file1, file2, source, diff_content_only)
+
+
+def _compare_files(file1, file2, source, diff_content_only):
     # Specialize the files first so "has_same_content_as" can be overridden
     # by subclasses
-    with profile("specialize", "specialize"):
+    with profile("specialize", "specialize", path=file1):
         specialize(file1)
         specialize(file2)
 
@@ -166,9 +183,26 @@ def call_difftool(file1, file2):
 
 
 def compare_binary_files(file1, file2, source=None):
+    if source is None:
+        source = [file1.name, file2.name]
+
+    # Unless we were asked to run diff(1), compare the files directly and
+    # only generate the parts of their hexdumps that we need.
+    if Config().diff_engine != "gnu" and hexdump.is_supported(
+        file1.path, file2.path
+    ):
+        unified_diff = hexdump.diff_hexdumps(file1.path, file2.path)
+        if unified_diff is None:
+            return None
+        return Difference(
+            file1.path,
+            file2.path,
+            source=source,
+            has_internal_linenos=True,
+            unified_diff=unified_diff,
+        )
+
     try:
-        if source is None:
-            source = [file1.name, file2.name]
         return Difference.from_operation(
             Xxd,
             file1.path,
@@ -190,8 +224,10 @@ def compare_binary_files(file1, file2, source=None):
 def hexdump_fallback(path):
     hexdump = io.StringIO()
     with open(path, "rb") as f:
-        for buf in iter(lambda: f.read(32), b""):
-            hexdump.write(
-                "{}\n".format(binascii.hexlify(buf).decode("us-ascii"))
-            )
+        # Hexlify many lines of 32 bytes at a time
+        for buf in iter(lambda: f.read(32 * 2**11), b""):
+            hexed = binascii.hexlify(buf).decode("us-ascii")
+            for x in range(0, len(hexed), 64):
+                hexdump.write(hexed[x : x + 64])
+                hexdump.write("\n")
     return hexdump.getvalue()
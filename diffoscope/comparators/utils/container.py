@@ -32,6 +32,7 @@ from ..missing_file import MissingFile, AbstractMissingType
 
 from .file import path_apparent_size
 from .fuzzy import perform_fuzzy_matching
+from .parallel import parallel_starmap
 
 NO_COMMENT = None
 
@@ -219,7 +220,7 @@ class Container(metaclass=abc.ABCMeta):
             return difference
 
         return filter(
-            None, itertools.starmap(compare_pair, self.comparisons(other))
+            None, parallel_starmap(compare_pair, self.comparisons(other))
         )
 
 
@@ -0,0 +1,348 @@
+#
+# diffoscope: in-depth comparison of files, archives, and directories
+#
+# Copyright © 2022 Chris Lamb <lamby@debian.org>
+#
+# diffoscope is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# diffoscope is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with diffoscope.  If not, see <https://www.gnu.org/licenses/>.
+
+import os
+import mmap
+import zlib
+import struct
+import hashlib
+import collections
+
+ELF_MAGIC = b"\x7fELF"
+
+ELFCLASS32 = 1
+ELFCLASS64 = 2
+
+ELFDATA2LSB = 1
+ELFDATA2MSB = 2
+
+# The fields of the ELF header after e_ident that we need, and the section
+# headers, for each ELF class.
+HEADER_FORMATS = {
+    ELFCLASS32: ("HHIIIIIHHHHHH", "IIIIIIIIII"),
+    ELFCLASS64: ("HHIQQQIHHHHHH", "IIQQQQIIQQ"),
+}
+
+SHN_XINDEX = 0xFFFF
+
+SHT_NULL = 0
+SHT_NOTE = 7
+SHT_NOBITS = 8
+
+SHF_EXECINSTR = 0x4
+SHF_STRINGS = 0x20
+
+NT_GNU_BUILD_ID = 3
+
+# The reflected polynomial of zlib.crc32()
+CRC32_POLY = 0xEDB88320
+
+# Section types as readelf(1) names them
+SECTION_TYPES = {
+    0: "NULL",
+    1: "PROGBITS",
+    2: "SYMTAB",
+    3: "STRTAB",
+    4: "RELA",
+    5: "HASH",
+    6: "DYNAMIC",
+    7: "NOTE",
+    8: "NOBITS",
+    9: "REL",
+    10: "SHLIB",
+    11: "DYNSYM",
+    14: "INIT_ARRAY",
+    15: "FINI_ARRAY",
+    16: "PREINIT_ARRAY",
+    17: "GROUP",
+    18: "SYMTAB SECTION INDICES",
+    19: "RELR",
+    0x6FFFFFF5: "GNU_ATTRIBUTES",
+    0x6FFFFFF6: "GNU_HASH",
+    0x6FFFFFF7: "GNU_LIBLIST",
+    0x6FFFFFFD: "VERDEF",
+    0x6FFFFFFE: "VERNEED",
+    0x6FFFFFFF: "VERSYM",
+}
+
+BLOCK_SIZE = 2**20
+
+Section = collections.namedtuple(
+    "Section",
+    "name type flags addr offset size link info addralign entsize",
+)
+
+
+class ElfFormatError(ValueError):
+    pass
+
+
+def type_name(section):
+    return SECTION_TYPES.get(section.type, "0x{:x}".format(section.type))
+
+
+def align(offset, alignment=4):
+    return -(-offset // alignment) * alignment
+
+
+def crc32_suffix(crc, target):
+    """
+    Return the four bytes that, appended to data with a zlib.crc32() of
+    `crc`, make its CRC32 `target` instead.
+
+    This runs the CRC register backwards from `target` over those 32 bits to
+    find the value it must hold after they are XORed in.
+    """
+
+    reg = target ^ 0xFFFFFFFF
+    for _ in range(32):
+        if reg & 0x80000000:
+            reg = ((reg ^ CRC32_POLY) << 1 | 1) & 0xFFFFFFFF
+        else:
+            reg = (reg << 1) & 0xFFFFFFFF
+
+    return (reg ^ crc ^ 0xFFFFFFFF).to_bytes(4, "little")
+
+
+def file_crc32(f):
+    crc = 0
+    for buf in iter(lambda: f.read(BLOCK_SIZE), b""):
+        crc = zlib.crc32(buf, crc)
+    return crc
+
+
+class ElfImage:
+    """
+    The section headers of an ELF file, read directly rather than by parsing
+    the output of readelf(1).
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+        with open(path, "rb") as f:
+            self.size = os.fstat(f.fileno()).st_size
+            ident = f.read(16)
+            if len(ident) < 16 or not ident.startswith(ELF_MAGIC):
+                raise ElfFormatError("{} is not an ELF file".format(path))
+
+            elf_class, elf_data = ident[4], ident[5]
+            try:
+                header_format, section_format = HEADER_FORMATS[elf_class]
+                endian = {ELFDATA2LSB: "<", ELFDATA2MSB: ">"}[elf_data]
+            except KeyError:
+                raise ElfFormatError(
+                    "Unknown ELF class or data encoding in {}".format(path)
+                )
+
+            self.endian = endian
+            header = struct.Struct(endian + header_format)
+            self.section_header = struct.Struct(endian + section_format)
+            self.sections = self.read_sections(
+                f, header.unpack(self.read(f, 16, header.size))
+            )
+
+    def read(self, f, offset, size):
+        f.seek(offset)
+        data = f.read(size)
+        if len(data) != size:
+            raise ElfFormatError("Truncated ELF file: {}".format(self.path))
+        return data
+
+    def read_sections(self, f, header):
+        shoff = header[5]
+        shentsize, shnum, shstrndx = header[10:]
+        if not shoff:
+            return []
+        if shentsize < self.section_header.size:
+            raise ElfFormatError(
+                "Invalid section header size in {}".format(self.path)
+            )
+
+        def read_header(index):
+            return self.section_header.unpack(
+                self.read(
+                    f, shoff + index * shentsize, self.section_header.size
+                )
+            )
+
+        # With too many sections to fit in the ELF header, their number and
+        # the index of the section name table are in the first section.
+        first = read_header(0)
+        if not shnum:
+            shnum = first[5]
+        if shstrndx == SHN_XINDEX:
+            shstrndx = first[6]
+        if shoff + shnum * shentsize > self.size or shstrndx >= shnum:
+            raise ElfFormatError(
+                "Invalid section headers in {}".format(self.path)
+            )
+
+        headers = [first] + [read_header(x) for x in range(1, shnum)]
+        names = self.read(f, headers[shstrndx][4], headers[shstrndx][5])
+
+        def name(offset):
+            end = names.find(b"\0", offset)
+            if end < 0:
+                raise ElfFormatError(
+                    "Invalid section name in {}".format(self.path)
+                )
+            return names[offset:end].decode("utf-8", "surrogateescape")
+
+        return [Section(name(x[0]), *x[1:]) for x in headers]
+
+    def sections_named(self, name):
+        return [x for x in self.sections if x.name == name]
+
+    def section_data(self, name):
+        """
+        Return the contents of the first section named `name`, or None.
+        """
+
+        for x in self.sections_named(name):
+            if x.type == SHT_NOBITS:
+                continue
+            if x.offset + x.size > self.size:
+                raise ElfFormatError(
+                    "Section {} extends beyond the end of {}".format(
+                        name, self.path
+                    )
+                )
+            with open(self.path, "rb") as f:
+                return self.read(f, x.offset, x.size)
+
+        return None
+
+    def build_id_note(self):
+        """
+        Return the file offset and contents of the NT_GNU_BUILD_ID note, or
+        None.
+        """
+
+        for x in self.sections_named(".note.gnu.build-id"):
+            if x.type == SHT_NOTE:
+                break
+        else:
+            return None
+
+        data = self.section_data(x.name)
+        note = struct.Struct(self.endian + "III")
+
+        offset = 0
+        while data and offset + note.size <= len(data):
+            namesz, descsz, type_ = note.unpack_from(data, offset)
+            offset += note.size
+            name = data[offset : offset + namesz]
+            offset = align(offset + namesz)
+            desc = data[offset : offset + descsz]
+
+            if type_ == NT_GNU_BUILD_ID and name == b"GNU\0" and desc:
+                return x.offset + offset, desc
+
+            offset = align(offset + descsz)
+
+        return None
+
+    def build_id(self):
+        """
+        Return the NT_GNU_BUILD_ID note as a hex string, or None.
+        """
+
+        note = self.build_id_note()
+        if note is None:
+            return None
+
+        return note[1].hex()
+
+    def build_id_digest(self):
+        """
+        Return the SHA-1 of the file with its NT_GNU_BUILD_ID note zeroed, as
+        a hex string, or None if there is no note.
+
+        The file is mapped into memory and hashed in three slices around the
+        note rather than read (and copied) in full.
+        """
+
+        note = self.build_id_note()
+        if note is None:
+            return None
+        offset, desc = note
+
+        h = hashlib.sha1()
+        with open(self.path, "rb") as f, mmap.mmap(
+            f.fileno(), 0, access=mmap.ACCESS_READ
+        ) as m:
+            view = memoryview(m)
+            try:
+                h.update(view[:offset])
+                h.update(bytes(len(desc)))
+                h.update(view[offset + len(desc) :])
+            finally:
+                view.release()
+
+        return h.hexdigest()
+
+    def debug_link(self):
+        """
+        Return the filename and CRC32 in the .gnu_debuglink section, or None.
+        """
+
+        data = self.section_data(".gnu_debuglink")
+        if not data:
+            return None
+
+        end = data.find(b"\0")
+        offset = align(end + 1)
+        if end <= 0 or offset + 4 > len(data):
+            return None
+
+        (crc,) = struct.unpack_from(self.endian + "I", data, offset)
+
+        return data[:end].decode("utf-8", "surrogateescape"), crc
+
+    def section_digest(self, name):
+        """
+        Return a digest of the contents of the sections named `name`, along
+        with their type, flags and address.
+        """
+
+        h = hashlib.sha256()
+
+        with open(self.path, "rb") as f:
+            for x in self.sections_named(name):
+                h.update(struct.pack(">IQQQ", x.type, x.flags, x.addr, x.size))
+                if x.type == SHT_NOBITS:
+                    continue
+                if x.offset + x.size > self.size:
+                    raise ElfFormatError(
+                        "Section {} extends beyond the end of {}".format(
+                            name, self.path
+                        )
+                    )
+                f.seek(x.offset)
+                remaining = x.size
+                while remaining:
+                    buf = f.read(min(remaining, BLOCK_SIZE))
+                    if not buf:
+                        raise ElfFormatError(
+                            "Truncated ELF file: {}".format(self.path)
+                        )
+                    h.update(buf)
+                    remaining -= len(buf)
+
+        return h.digest()
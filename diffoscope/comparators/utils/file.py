@@ -21,6 +21,7 @@ import re
 import abc
 import magic
 import logging
+import threading
 import subprocess
 
 from diffoscope.exc import (
@@ -30,6 +31,11 @@ from diffoscope.exc import (
 )
 from diffoscope.tools import tool_required
 from diffoscope.utils import format_cmdline, format_class
+from diffoscope.cache import (
+    TLSH_MIN_SIZE,
+    file_fingerprint,
+    memoized_fingerprint,
+)
 from diffoscope.config import Config
 from diffoscope.profiling import profile
 from diffoscope.difference import Difference
@@ -41,9 +47,67 @@ except ImportError:  # noqa
 
 SMALL_FILE_THRESHOLD = 65536  # 64 kiB
 
+# libmagic handles are not safe to share between threads (see --jobs)
+_MAGIC_LOCK = threading.Lock()
+
 logger = logging.getLogger(__name__)
 
 
+def add_streamed_details(difference, details, members):
+    """
+    Add `details` to `difference`, followed by the differences in `members`,
+    an iterator that is only consumed as the result is presented (see
+    --stream). Returns None if there are no differences.
+
+    We always compare the first member now, as the non-streaming path would.
+    Failing to extract a container then still raises here, so that
+    File.compare can fall back to a binary diff. We continue until we know
+    whether there are any differences at all.
+    """
+
+    details = [x for x in details if x]
+    for x in members:
+        if x:
+            details.append(x)
+        if details:
+            break
+
+    if not details:
+        return None
+
+    def guard():
+        # By the time these are compared it is too late to fall back to a
+        # binary diff as File.compare does, so record the failure in the
+        # output instead. This is why streamed output can differ on error.
+        try:
+            yield from members
+        except subprocess.CalledProcessError as e:
+            msg = "Command `{}` failed with exit code {}.".format(
+                format_cmdline(e.cmd), e.returncode
+            )
+        except RequiredToolNotFound as e:
+            msg = e.get_comment()
+        except OutputParsingError as e:
+            msg = "Error parsing output of `{}` for {}.".format(
+                e.operation, e.object_class
+            )
+        except ContainerExtractionError as e:
+            msg = "Error extracting '{}': \"{}\".".format(
+                e.pathname, e.wrapped_exc
+            )
+        else:
+            return
+        logger.debug("Error comparing members: %s", msg)
+        x = Difference(difference.source1, difference.source2)
+        x.add_comment("{} Remaining contents were not compared.".format(msg))
+        yield x
+
+    difference.add_details(details)
+    difference.add_lazy_details(guard())
+
+    return difference
+
+
 def path_apparent_size(path=".", visited=None):
     # should output the same as `du --apparent-size -bs "$path"`
     if not visited:
@@ -79,34 +143,40 @@ class File(metaclass=abc.ABCMeta):
 
         @classmethod
         def guess_file_type(cls, path):
-            if not hasattr(cls, "_mimedb"):
-                cls._mimedb = magic.open(magic.NONE)
-                cls._mimedb.load()
-            return cls._mimedb.file(
-                path.encode("utf-8", errors="surrogateescape")
-            )
+            with _MAGIC_LOCK:
+                if not hasattr(cls, "_mimedb"):
+                    cls._mimedb = magic.open(magic.NONE)
+                    cls._mimedb.load()
+                return cls._mimedb.file(
+                    path.encode("utf-8", errors="surrogateescape")
+                )
 
         @classmethod
         def guess_encoding(cls, path):
-            if not hasattr(cls, "_mimedb_encoding"):
-                cls._mimedb_encoding = magic.open(magic.MAGIC_MIME_ENCODING)
-                cls._mimedb_encoding.load()
-            return cls._mimedb_encoding.file(path)
+            with _MAGIC_LOCK:
+                if not hasattr(cls, "_mimedb_encoding"):
+                    cls._mimedb_encoding = magic.open(
+                        magic.MAGIC_MIME_ENCODING
+                    )
+                    cls._mimedb_encoding.load()
+                return cls._mimedb_encoding.file(path)
 
     else:
         # Assume we are using python-magic
 
         @classmethod
         def guess_file_type(cls, path):
-            if not hasattr(cls, "_mimedb"):
-                cls._mimedb = magic.Magic()
-            return maybe_decode(cls._mimedb.from_file(path))
+            with _MAGIC_LOCK:
+                if not hasattr(cls, "_mimedb"):
+                    cls._mimedb = magic.Magic()
+                return maybe_decode(cls._mimedb.from_file(path))
 
         @classmethod
         def guess_encoding(cls, path):
-            if not hasattr(cls, "_mimedb_encoding"):
-                cls._mimedb_encoding = magic.Magic(mime_encoding=True)
-            return maybe_decode(cls._mimedb_encoding.from_file(path))
+            with _MAGIC_LOCK:
+                if not hasattr(cls, "_mimedb_encoding"):
+                    cls._mimedb_encoding = magic.Magic(mime_encoding=True)
+                return maybe_decode(cls._mimedb_encoding.from_file(path))
 
     def __init__(self, container=None):
         self._comments = []
@@ -341,23 +411,13 @@ class File(metaclass=abc.ABCMeta):
             def calc():
                 # tlsh is not meaningful with files smaller than 512 bytes
                 try:
-                    if os.stat(self.path).st_size < 512:
+                    if os.stat(self.path).st_size < TLSH_MIN_SIZE:
                         return None
                 except FileNotFoundError:
                     # eg. invalid symlink
                     return None
 
-                h = tlsh.Tlsh()
-                with open(self.path, "rb") as f:
-                    for buf in iter(lambda: f.read(32768), b""):
-                        h.update(buf)
-                h.final()
-
-                try:
-                    return h.hexdigest()
-                except ValueError:
-                    # File must contain a certain amount of randomness.
-                    return None
+                return file_fingerprint(self, fuzzy=True).tlsh
 
             if not hasattr(self, "_fuzzy_hash"):
                 self._fuzzy_hash = calc()
@@ -447,11 +507,12 @@ class File(metaclass=abc.ABCMeta):
                 difference.add_comment(msg)
                 no_recurse = True
 
-            details.extend(
-                self.as_container.compare(
-                    other.as_container, no_recurse=no_recurse
-                )
+            members = self.as_container.compare(
+                other.as_container, no_recurse=no_recurse
             )
+            if Config().streaming:
+                return add_streamed_details(difference, details, iter(members))
+            details.extend(members)
 
         details = [x for x in details if x]
         if not details:
@@ -497,7 +558,15 @@ class File(metaclass=abc.ABCMeta):
         if my_size <= SMALL_FILE_THRESHOLD:
             return True
 
-        # Big files, same size, same first bytes
+        # Big files, same size, same first bytes. Reuse their digests if we
+        # already have them (eg. for --cache-dir) rather than reading them
+        # again, but don't read either file in full just to calculate one as
+        # cmp(1) can stop at the first difference.
+        fingerprint1 = memoized_fingerprint(self)
+        fingerprint2 = memoized_fingerprint(other)
+        if fingerprint1 is not None and fingerprint2 is not None:
+            return fingerprint1.sha256 == fingerprint2.sha256
+
         return self.cmp_external(other)
 
     @tool_required("cmp")
@@ -17,8 +17,11 @@
 # You should have received a copy of the GNU General Public License
 # along with diffoscope.  If not, see <https://www.gnu.org/licenses/>.
 
+import sys
+import array
 import logging
-import operator
+import functools
+import collections
 
 from diffoscope.config import Config
 
@@ -29,8 +32,28 @@ except ImportError:  # noqa
 
 logger = logging.getLogger(__name__)
 
+# Each of the 128 buckets in a TLSH body is a two bit value; these select
+# the low bit of every bucket.
+BUCKETS_LOW = int("01" * 128, 2)
+
+# The distance contributed by each byte (ie. four buckets) of two bodies
+# XORed together, after 1/2 and 2/1 pairs have been rewritten (see
+# xor_bodies). Two buckets differing by 3 count as 6.
+BUCKET_SCORES = bytes(
+    sum((0, 1, 2, 6)[(x >> y) & 3] for y in range(0, 8, 2)) for x in range(256)
+)
+
+# Compare bodies in bulk (see Group) once a group has this many digests
+MIN_VECTORISED = 16
+
 
 def perform_fuzzy_matching(members1, members2):
+    """
+    For each member of `members1` in turn, yield the unmatched member of
+    `members2` with the lowest TLSH distance if that is under
+    Config().fuzzy_threshold. Ties go to the earliest member of `members2`.
+    """
+
     threshold = Config().fuzzy_threshold
 
     if tlsh is None or threshold == 0:
@@ -40,35 +63,286 @@ def perform_fuzzy_matching(members1, members2):
     members1 = dict(members1)
     members2 = dict(members2)
 
-    seen = set()
+    index = None
     for name1, (file1, _) in members1.items():
         if file1.is_directory() or not file1.fuzzy_hash:
             continue
 
-        comparisons = []
-        for name2, (file2, _) in members2.items():
-            if name2 in seen or file2.is_directory() or not file2.fuzzy_hash:
-                continue
-            comparisons.append(
-                (tlsh.diff(file1.fuzzy_hash, file2.fuzzy_hash), name2)
+        if index is None:
+            index = FuzzyIndex(
+                (name2, file2.fuzzy_hash)
+                for name2, (file2, _) in members2.items()
+                if not file2.is_directory() and file2.fuzzy_hash
             )
 
-        if not comparisons:
+        match = index.nearest(file1.fuzzy_hash, threshold)
+        if match is None:
+            logger.debug(
+                "Fuzzy matching %s: no file within threshold %d",
+                name1,
+                threshold,
+            )
             continue
 
-        comparisons.sort(key=operator.itemgetter(0))
-        score, name2 = comparisons[0]
-
-        suffix = "will not compare files"
-        if score < threshold:
-            seen.add(name2)
-            yield name1, name2, score
-            suffix = "will compare files"
-
+        score, name2 = match
+        index.remove(name2)
         logger.debug(
-            "Fuzzy matching %s %s (score: %d/400): %s",
+            "Fuzzy matching %s %s (score: %d/400): will compare files",
             name1,
             name2,
             score,
-            suffix,
         )
+        yield name1, name2, score
+
+
+class Digest(collections.namedtuple("Digest", "lvalue q1 q2 checksum body")):
+    """
+    A TLSH hex digest decoded so that its distance from another can be
+    calculated without calling tlsh.diff.
+    """
+
+    __slots__ = ()
+
+    @classmethod
+    def parse(cls, hexdigest):
+        # Version 4 of the tlsh module prefixes digests with "T1"
+        if len(hexdigest) == 72 and hexdigest.startswith("T1"):
+            hexdigest = hexdigest[2:]
+        if len(hexdigest) != 70:
+            raise ValueError(f"Not a TLSH digest: {hexdigest!r}")
+
+        lvalue = int(hexdigest[2:4], 16)
+        q = int(hexdigest[4:6], 16)
+
+        return cls(
+            # The nibbles of the header bytes are swapped
+            lvalue=((lvalue & 0xF) << 4) | (lvalue >> 4),
+            q1=q >> 4,
+            q2=q & 0xF,
+            checksum=hexdigest[:2],
+            body=int(hexdigest[6:], 16),
+        )
+
+    @property
+    def parity(self):
+        # The low bit of each bucket whose two bits differ (ie. 1 or 2)
+        return (self.body ^ (self.body >> 1)) & BUCKETS_LOW
+
+    def body_distance(self, other):
+        x = xor_bodies(self.body, other.body, self.parity, BUCKETS_LOW)
+        return sum(x.to_bytes(32, "big").translate(BUCKET_SCORES))
+
+    def lvalue_distance(self, other):
+        d = mod_distance(self.lvalue, other.lvalue, 256)
+        return d if d <= 1 else d * 12
+
+    def ratio_distance(self, other):
+        result = 0
+        for x, y in ((self.q1, other.q1), (self.q2, other.q2)):
+            d = mod_distance(x, y, 16)
+            result += d if d <= 1 else (d - 1) * 12
+        return result
+
+    def distance(self, other):
+        """
+        Equivalent to tlsh.diff() on the original hex digests.
+        """
+
+        return (
+            self.lvalue_distance(other)
+            + self.ratio_distance(other)
+            + (self.checksum != other.checksum)
+            + self.body_distance(other)
+        )
+
+
+def xor_bodies(x, y, parity, low):
+    """
+    XOR two bodies (or many, packed end to end) such that each bucket is 0,
+    1, 2 or 3 where the original buckets differ by 0, 1, 2 or 3.
+
+    Buckets that are 1 and 2 (or vice versa) XOR to 3, so these are
+    rewritten to 1 using the parity of the buckets in `x`.
+    """
+
+    x ^= y
+    both = x & (x >> 1) & low
+    return x ^ ((both & parity) << 1)
+
+
+def mod_distance(x, y, modulus):
+    d = abs(x - y)
+    return min(d, modulus - d)
+
+
+@functools.lru_cache(maxsize=8)
+def lvalue_offsets(threshold):
+    """
+    The (offset, distance) of every lvalue whose contribution to the
+    distance between two digests is below `threshold`, nearest first.
+    """
+
+    origin = Digest(0, 0, 0, None, 0)
+    result = [
+        (x, origin.lvalue_distance(origin._replace(lvalue=x)))
+        for x in range(256)
+    ]
+
+    return sorted((x for x in result if x[1] < threshold), key=lambda x: x[1])
+
+
+class Group:
+    """
+    The digests in a FuzzyIndex of files of a similar length.
+    """
+
+    def __init__(self):
+        self.entries = []
+        self.removed = 0
+        self.packed = self.low = self.folds = None
+
+    def add(self, entry):
+        self.entries.append(entry)
+        self.packed = None
+
+    def compact(self, removed):
+        self.entries = [x for x in self.entries if x[1] not in removed]
+        self.removed = 0
+        self.packed = None
+
+    def pack(self):
+        size = 32 * len(self.entries)
+
+        self.packed = int.from_bytes(
+            b"".join(x.body.to_bytes(32, "big") for _, _, x in self.entries),
+            "big",
+        )
+        self.low = int.from_bytes(b"\x55" * size, "big")
+        self.folds = [
+            (
+                8 * x,
+                int.from_bytes(
+                    (b"\xff" * x + b"\x00" * x) * (size // (2 * x)), "little"
+                ),
+            )
+            for x in (1, 2, 4, 8, 16)
+        ]
+
+    def body_distances(self, digest):
+        n = len(self.entries)
+
+        if n < MIN_VECTORISED:
+            return [digest.body_distance(x) for _, _, x in self.entries]
+
+        # Compare against all of our bodies at once by packing them into a
+        # single integer, then sum the 32 bytes of scores for each body by
+        # repeatedly adding adjacent halves.
+        if self.packed is None:
+            self.pack()
+
+        x = xor_bodies(
+            int.from_bytes(digest.body.to_bytes(32, "big") * n, "big"),
+            self.packed,
+            int.from_bytes(digest.parity.to_bytes(32, "big") * n, "big"),
+            self.low,
+        )
+
+        total = int.from_bytes(
+            x.to_bytes(32 * n, "big").translate(BUCKET_SCORES), "little"
+        )
+        for width, mask in self.folds:
+            total = (total & mask) + ((total >> width) & mask)
+
+        result = array.array("H", total.to_bytes(32 * n, "little"))
+        if sys.byteorder == "big":
+            result.byteswap()
+
+        return result[::16]
+
+
+class FuzzyIndex:
+    """
+    Finds the nearest digest to another by TLSH distance.
+
+    The distance between two digests is at least the part contributed by
+    the (log of the) lengths of their files, so digests are grouped by this
+    and groups are searched in order of it until no closer digest is
+    possible. The bodies of each group are compared in bulk, and the rest
+    of the distance is only calculated for digests that could be closer.
+    """
+
+    def __init__(self, items):
+        self.exact = collections.defaultdict(list)
+        self.groups = collections.defaultdict(Group)
+        self.lvalues = {}
+        self.removed = set()
+
+        for order, (name, hexdigest) in enumerate(items):
+            try:
+                digest = Digest.parse(hexdigest)
+            except ValueError:
+                logger.debug("Ignoring fuzzy hash of %s", name)
+                continue
+            self.exact[digest].append(name)
+            self.groups[digest.lvalue].add((order, name, digest))
+            self.lvalues[name] = digest.lvalue
+
+    def remove(self, name):
+        self.removed.add(name)
+
+        group = self.groups[self.lvalues[name]]
+        group.removed += 1
+        if group.removed * 2 > len(group.entries):
+            group.compact(self.removed)
+
+    def nearest(self, hexdigest, threshold):
+        """
+        Returns the (distance, name) of the nearest digest with a distance
+        below `threshold` or None.
+        """
+
+        try:
+            digest = Digest.parse(hexdigest)
+        except ValueError:
+            return None
+
+        # Only identical digests have a distance of 0
+        for name in self.exact.get(digest, ()):
+            if name not in self.removed:
+                return 0, name
+
+        score, _, name = self.search(digest, (threshold, -1, None))
+        if name is None:
+            return None
+
+        return score, name
+
+    def search(self, digest, best):
+        for offset, cost in lvalue_offsets(best[0]):
+            # Ties are broken on order, so search groups with an equal cost
+            if cost > best[0] or cost == best[0] and best[2] is None:
+                break
+
+            group = self.groups.get((digest.lvalue + offset) % 256)
+            if group is None:
+                continue
+
+            distances = group.body_distances(digest)
+            if not distances or min(distances) + cost > best[0]:
+                continue
+
+            for (order, name, other), distance in zip(
+                group.entries, distances
+            ):
+                if distance + cost > best[0] or name in self.removed:
+                    continue
+
+                score = (
+                    cost
+                    + distance
+                    + digest.ratio_distance(other)
+                    + (digest.checksum != other.checksum)
+                )
+                best = min(best, (score, order, name))
+
+        return best
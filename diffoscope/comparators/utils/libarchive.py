@@ -21,7 +21,9 @@
 import time
 import os.path
 import ctypes
+import hashlib
 import logging
+import threading
 import libarchive
 import collections
 import stat
@@ -41,6 +43,8 @@ from .archive import Archive, ArchiveMember
 
 logger = logging.getLogger(__name__)
 
+BLOCK_SIZE = 2**17
+
 
 # Monkeypatch libarchive-c (<< 2.2)
 if not hasattr(libarchive.ffi, "entry_rdevmajor"):
@@ -176,6 +180,34 @@ def list_libarchive(path, ignore_errors=False):
             raise
 
 
+def extract_member(path, member_name, dest):
+    """
+    Write the regular file `member_name` in the archive at `path` to `dest`,
+    reading through the archive (and its compression) only as far as that
+    member rather than unpacking it. Returns whether it was found.
+    """
+
+    with libarchive.file_reader(path) as archive:
+        for entry in archive:
+            if entry.pathname != member_name or not entry.isreg:
+                continue
+
+            logger.debug(
+                "Extracting %s from %s to %s", member_name, path, dest
+            )
+
+            try:
+                with open(dest, "wb") as f:
+                    for block in entry.get_blocks(block_size=BLOCK_SIZE):
+                        f.write(block)
+            except Exception as e:
+                raise ContainerExtractionError(entry.pathname, e)
+
+            return True
+
+    return False
+
+
 class LibarchiveMember(ArchiveMember):
     def __init__(self, archive, entry):
         super().__init__(archive, entry.pathname)
@@ -259,6 +291,15 @@ class LibarchiveFIFO(SocketOrFIFO, LibarchiveMember):
 
 
 class LibarchiveContainer(Archive):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        self._lock = threading.Lock()
+        self._members = None
+        self._paths = {}
+        self._digests = {}
+        self._identical = set()
+
     def open_archive(self):
         # libarchive is very very stream oriented an not for random access
         # so we are going to reopen the archive everytime
@@ -269,7 +310,7 @@ class LibarchiveContainer(Archive):
         pass
 
     def get_member_names(self):
-        self.ensure_unpacked()
+        self.ensure_scanned()
         return self._members.keys()
 
     def get_member(self, member_name):
@@ -289,9 +330,21 @@ class LibarchiveContainer(Archive):
         except libarchive.exception.ArchiveError:
             pass
 
+    def get_adjusted_members_sizes(self):
+        # Use the sizes recorded whilst scanning the archive rather than
+        # extracting every member just to stat(2) it.
+        self.ensure_scanned()
+
+        for name, member in self.get_adjusted_members():
+            if member.is_directory():
+                size = 4096  # default "size" of a directory
+            else:
+                size, _ = self._members.get(member.name, (0, None))
+            yield name, (member, size)
+
     def extract(self, member_name, dest_dir):
-        self.ensure_unpacked()
-        return self._members[member_name]
+        self.ensure_unpacked(member_name)
+        return self._paths[member_name]
 
     def get_subclass(self, entry):
         if entry.isdir:
@@ -305,56 +358,155 @@ class LibarchiveContainer(Archive):
 
         return LibarchiveMember(self, entry)
 
-    def ensure_unpacked(self):
-        if hasattr(self, "_members"):
-            return
-
-        self._tmpdir_object = get_temporary_directory(
-            suffix=self.__class__.__name__
-        )
-        tmpdir = self._tmpdir_object.name
-        self._members = collections.OrderedDict()
+    def ensure_scanned(self):
+        """
+        Read through the archive once, recording the size and SHA256 of every
+        regular file without writing anything to disk.
+        """
+
+        with self._lock:
+            if self._members is not None:
+                return
+
+            members = collections.OrderedDict()
+
+            logger.debug("Scanning %s", self.source.path)
+
+            try:
+                with libarchive.file_reader(self.source.path) as archive:
+                    for entry in archive:
+                        # Always skip directories
+                        if entry.isdir:
+                            continue
+
+                        # Don't consider excluded files
+                        if any_excluded(entry.pathname):
+                            continue
+
+                        digest = None
+                        if entry.isreg:
+                            h = hashlib.sha256()
+                            try:
+                                for block in entry.get_blocks(
+                                    block_size=BLOCK_SIZE
+                                ):
+                                    h.update(block)
+                            except Exception as e:
+                                raise ContainerExtractionError(
+                                    entry.pathname, e
+                                )
+                            digest = h.hexdigest()
+
+                        members[entry.pathname] = (entry.size or 0, digest)
+            except libarchive.exception.ArchiveError as e:
+                # Leave it to the extraction to report this, if needed.
+                logger.debug("Error scanning %s: %s", self.source.path, e)
+
+            self._members = members
+
+    def ensure_unpacked(self, member_name=None):
+        """
+        Extract `member_name` along with every other member that may still be
+        needed (ie. that is not known to be identical to its counterpart) in a
+        single pass over the archive.
+        """
+
+        self.ensure_scanned()
+
+        with self._lock:
+            if member_name is not None and member_name in self._paths:
+                return
+
+            wanted = {
+                x
+                for x in self._members.keys()
+                if x not in self._paths and x not in self._identical
+            }
+            if member_name is not None:
+                wanted.add(member_name)
+            if not wanted:
+                return
+
+            if not hasattr(self, "_tmpdir_object"):
+                self._tmpdir_object = get_temporary_directory(
+                    suffix=self.__class__.__name__
+                )
+            tmpdir = self._tmpdir_object.name
 
-        logger.debug("Extracting %s to %s", self.source.path, tmpdir)
+            logger.debug(
+                "Extracting %d entries from %s to %s",
+                len(wanted),
+                self.source.path,
+                tmpdir,
+            )
 
-        with libarchive.file_reader(self.source.path) as archive:
-            for idx, entry in enumerate(archive):
-                # Always skip directories
-                if entry.isdir:
-                    continue
+            with libarchive.file_reader(self.source.path) as archive:
+                for idx, entry in enumerate(archive):
+                    if entry.pathname not in wanted:
+                        continue
 
-                # Don't extract excluded files
-                if any_excluded(entry.pathname):
-                    continue
+                    # Always skip directories
+                    if entry.isdir:
+                        continue
 
-                # Keep directory sizes small. could be improved but should be
-                # good enough for "ordinary" large archives.
-                dst = os.path.join(tmpdir, str(idx // 4096), str(idx % 4096))
-                _, ext = os.path.splitext(entry.pathname)
-                dst += ext
-
-                # Maintain a mapping of archive path to the extracted path,
-                # avoiding the need to sanitise filenames.
-                self._members[entry.pathname] = dst
-
-                logger.debug("Extracting %s to %s", entry.pathname, dst)
-
-                os.makedirs(os.path.dirname(dst), exist_ok=True)
-                try:
-                    with open(dst, "wb") as f:
-                        for block in entry.get_blocks(block_size=2**17):
-                            f.write(block)
-                except Exception as e:
-                    raise ContainerExtractionError(entry.pathname, e)
-
-        logger.debug(
-            "Extracted %d entries from %s to %s",
-            len(self._members),
-            self.source.path,
-            tmpdir,
-        )
+                    # Keep directory sizes small. could be improved but should
+                    # be good enough for "ordinary" large archives.
+                    dst = os.path.join(
+                        tmpdir, str(idx // 4096), str(idx % 4096)
+                    )
+                    _, ext = os.path.splitext(entry.pathname)
+                    dst += ext
+
+                    # Maintain a mapping of archive path to the extracted
+                    # path, avoiding the need to sanitise filenames.
+                    self._paths[entry.pathname] = dst
+
+                    os.makedirs(os.path.dirname(dst), exist_ok=True)
+
+                    # Members with the same contents as one we have already
+                    # written out only need a hard link.
+                    _, digest = self._members.get(entry.pathname, (0, None))
+                    if digest in self._digests:
+                        try:
+                            os.link(self._digests[digest], dst)
+                            continue
+                        except OSError:
+                            pass
+
+                    logger.debug("Extracting %s to %s", entry.pathname, dst)
+
+                    try:
+                        with open(dst, "wb") as f:
+                            for block in entry.get_blocks(
+                                block_size=BLOCK_SIZE
+                            ):
+                                f.write(block)
+                    except Exception as e:
+                        raise ContainerExtractionError(entry.pathname, e)
+
+                    if digest is not None:
+                        self._digests[digest] = dst
 
     def comparisons(self, other):
+        # Members with identical contents need never be extracted nor
+        # compared, so work out which ones they are before we start.
+        identical = set()
+        if (
+            isinstance(other, LibarchiveContainer)
+            and not Config().force_details
+        ):
+            self.ensure_scanned()
+            other.ensure_scanned()
+
+            identical = {
+                name
+                for name, (_, digest) in self._members.items()
+                if digest is not None
+                and other._members.get(name, (0, None))[1] == digest
+            }
+            self._identical.update(identical)
+            other._identical.update(identical)
+
         def hide_trivial_dirs(item):
             file1, file2, comment = item
             return not (
@@ -363,7 +515,21 @@ class LibarchiveContainer(Archive):
                 and comment is None
             )
 
-        return filter(hide_trivial_dirs, super().comparisons(other))
+        def hide_identical(item):
+            file1, file2, comment = item
+            if (
+                file1.name == file2.name
+                and file1.name in identical
+                and comment is None
+            ):
+                logger.debug("Skipping %s: identical SHA256", file1.name)
+                return False
+            return True
+
+        return filter(
+            hide_identical,
+            filter(hide_trivial_dirs, super().comparisons(other)),
+        )
 
 
 class LibarchiveContainerWithFilelist(LibarchiveContainer):
@@ -23,6 +23,10 @@ logger = logging.getLogger(__name__)
 
 
 class Operation(metaclass=abc.ABCMeta):
+    # Whether the output is only produced as it is read (see iter_output),
+    # in which case the operation runs for as long as it is being read.
+    streaming = False
+
     def __init__(self, path):
         self.path = path
         self.returncode = None
@@ -64,3 +68,10 @@ class Operation(metaclass=abc.ABCMeta):
     @abc.abstractproperty
     def output(self):
         raise NotImplementedError()
+
+    def iter_output(self):
+        """
+        Iterate over the lines of output. Subclasses may override this to
+        avoid holding all of the output in memory at once.
+        """
+        return iter(self.output)
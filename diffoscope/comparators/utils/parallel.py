@@ -0,0 +1,210 @@
+#
+# diffoscope: in-depth comparison of files, archives, and directories
+#
+# Copyright © 2022 Chris Lamb <lamby@debian.org>
+#
+# diffoscope is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# diffoscope is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with diffoscope.  If not, see <https://www.gnu.org/licenses/>.
+
+import logging
+import itertools
+import threading
+import contextlib
+import collections
+import concurrent.futures
+
+from diffoscope.config import Config
+from diffoscope.profiling import current_span, inherit_span
+
+logger = logging.getLogger(__name__)
+
+_LOCK = threading.Lock()
+_EXECUTOR = None
+_SLOTS = None
+_SUBPROCESS_EXECUTOR = None
+_SUBPROCESS_SLOTS = None
+
+
+class Slots:
+    """
+    A counting semaphore from which several slots can be acquired at once,
+    so that a pair of commands never waits whilst holding only one of them.
+    """
+
+    def __init__(self, count):
+        self.count = count
+        self.free = count
+        self.cond = threading.Condition()
+
+    def acquire(self, n):
+        # Never wait for more slots than there are.
+        n = min(n, self.count)
+        with self.cond:
+            self.cond.wait_for(lambda: self.free >= n)
+            self.free -= n
+        return n
+
+    def release(self, n):
+        with self.cond:
+            self.free += n
+            self.cond.notify_all()
+
+
+def _get_executor():
+    global _EXECUTOR, _SLOTS
+
+    with _LOCK:
+        if _EXECUTOR is None:
+            workers = Config().jobs - 1
+            logger.debug("Starting comparison pool with %d workers", workers)
+            _EXECUTOR = concurrent.futures.ThreadPoolExecutor(
+                max_workers=workers, thread_name_prefix="diffoscope"
+            )
+            _SLOTS = threading.BoundedSemaphore(workers)
+
+    return _EXECUTOR, _SLOTS
+
+
+def _get_subprocess_executor():
+    global _SUBPROCESS_EXECUTOR
+
+    with _LOCK:
+        if _SUBPROCESS_EXECUTOR is None:
+            workers = Config().max_subprocesses
+            logger.debug("Running up to %d external commands", workers)
+            _SUBPROCESS_EXECUTOR = concurrent.futures.ThreadPoolExecutor(
+                max_workers=workers, thread_name_prefix="diffoscope-command"
+            )
+
+    return _SUBPROCESS_EXECUTOR
+
+
+def _get_subprocess_slots():
+    global _SUBPROCESS_SLOTS
+
+    with _LOCK:
+        if _SUBPROCESS_SLOTS is None:
+            # Each of the --jobs threads can always run at least one command
+            _SUBPROCESS_SLOTS = Slots(
+                max(Config().max_subprocesses, Config().jobs, 1)
+            )
+
+    return _SUBPROCESS_SLOTS
+
+
+@contextlib.contextmanager
+def subprocess_slots(n):
+    """
+    Hold `n` of the slots for running external commands (see
+    --max-subprocesses) whilst in this context. Callers must not already
+    hold any slots, or they could wait on each other.
+    """
+
+    if n <= 0:
+        yield
+        return
+
+    slots = _get_subprocess_slots()
+    n = slots.acquire(n)
+    try:
+        yield
+    finally:
+        slots.release(n)
+
+
+def shutdown_executor():
+    global _EXECUTOR, _SLOTS, _SUBPROCESS_EXECUTOR, _SUBPROCESS_SLOTS
+
+    with _LOCK:
+        for x in (_EXECUTOR, _SUBPROCESS_EXECUTOR):
+            if x is not None:
+                x.shutdown(wait=True)
+        _EXECUTOR = None
+        _SLOTS = None
+        _SUBPROCESS_EXECUTOR = None
+        _SUBPROCESS_SLOTS = None
+
+
+def submit_subprocess(fn, *args):
+    """
+    Call `fn`, which should wait on an external command, on a shared pool of
+    --max-subprocesses threads and return a Future for its result.
+
+    Tasks never submit other tasks so, unlike parallel_starmap, they can
+    simply be queued until a thread is free.
+    """
+
+    if Config().max_subprocesses <= 1:
+        future = concurrent.futures.Future()
+        try:
+            with subprocess_slots(1):
+                future.set_result(fn(*args))
+        except Exception as exc:
+            future.set_exception(exc)
+        return future
+
+    def run(parent):
+        with inherit_span(parent), subprocess_slots(1):
+            return fn(*args)
+
+    return _get_subprocess_executor().submit(run, current_span())
+
+
+def parallel_starmap(fn, iterable):
+    """
+    Like itertools.starmap, but run calls on a shared pool of --jobs threads.
+
+    Results are yielded in the same order as `iterable`. Calls are only handed
+    to the pool if a worker is idle, otherwise they are run in the calling
+    thread. This means nested containers (compared from within a worker) can
+    also use idle workers without ever waiting on a queued task, avoiding
+    deadlocks regardless of how deep the nesting goes.
+
+    Most of the time is spent waiting on external commands (which release the
+    GIL), so threads are sufficient here.
+    """
+
+    if Config().jobs <= 1:
+        return itertools.starmap(fn, iterable)
+
+    return _parallel_starmap(fn, iterable)
+
+
+def _parallel_starmap(fn, iterable):
+    executor, slots = _get_executor()
+
+    def run(args, parent):
+        try:
+            with inherit_span(parent):
+                return fn(*args)
+        finally:
+            slots.release()
+
+    pending = collections.deque()
+    for args in iterable:
+        if slots.acquire(blocking=False):
+            pending.append(executor.submit(run, args, current_span()))
+        else:
+            future = concurrent.futures.Future()
+            try:
+                future.set_result(fn(*args))
+            except Exception as exc:
+                future.set_exception(exc)
+            pending.append(future)
+
+        # Emit results as soon as they are available, preserving order.
+        while pending and pending[0].done():
+            yield pending.popleft().result()
+
+    while pending:
+        yield pending.popleft().result()
@@ -16,6 +16,7 @@
 # You should have received a copy of the GNU General Public License
 # along with diffoscope.  If not, see <https://www.gnu.org/licenses/>.
 
+import re
 import logging
 
 from diffoscope.profiling import profile
@@ -23,9 +24,16 @@ from diffoscope.profiling import profile
 from ...utils import format_class
 
 from .. import ComparatorManager
+from .file import File
 
 logger = logging.getLogger(__name__)
 
+# Flags that can be scoped to part of a combined pattern, ie. "(?i:...)"
+SCOPED_FLAGS = {re.I: "i", re.M: "m", re.S: "s", re.X: "x"}
+
+# Classes created by specialize_as(), keyed on (comparator, original class)
+SPECIALIZED_CLASSES = {}
+
 
 def try_recognize(file, cls, recognizes):
     if isinstance(file, cls):
@@ -37,25 +45,205 @@ def try_recognize(file, cls, recognizes):
         if not recognizes(file):
             return False
 
+    specialize_as(file, cls)
+
+    return True
+
+
+def specialize_as(file, cls):
     # Found a match; perform type magic
     logger.debug(
         "Using %s for %s",
         format_class(cls, strip="diffoscope.comparators."),
         file.name,
     )
-    new_cls = type(cls.__name__, (cls, type(file)), {})
+    key = (cls, type(file))
+    try:
+        new_cls = SPECIALIZED_CLASSES[key]
+    except KeyError:
+        new_cls = SPECIALIZED_CLASSES.setdefault(
+            key, type(cls.__name__, key, {})
+        )
     file.__class__ = new_cls
 
-    return True
+
+def uses_default(cls, method):
+    return (
+        getattr(getattr(cls, method, None), "__func__", None)
+        is getattr(File, method).__func__
+    )
+
+
+def scoped_pattern(regex):
+    """
+    Return the pattern of `regex` with its flags inlined so that it can be
+    combined with others, or None if that is not possible.
+    """
+
+    flags = regex.flags & ~re.U
+    if not isinstance(regex.pattern, str):
+        return None
+    if regex.groupindex or re.search(r"\\[1-9]", regex.pattern):
+        # Combining would clash with named groups or renumber backreferences
+        return None
+    if flags & ~sum(SCOPED_FLAGS):
+        return None
+
+    letters = "".join(y for x, y in SCOPED_FLAGS.items() if flags & x)
+
+    return "(?{}:{})".format(letters, regex.pattern)
+
+
+class RegexStep:
+    """
+    A run of consecutive comparators that only match on FILE_TYPE_RE.
+
+    Searching each pattern in turn is equivalent to matching an alternation
+    of "(?s:.*?)<pattern>" at the start of the magic string, as alternatives
+    are tried in order. This lets the re module find the first comparator to
+    match in a single call.
+    """
+
+    def __init__(self, classes, patterns):
+        self.classes = classes
+        self.regex = re.compile(
+            "|".join(
+                "(?P<_{}>(?s:.*?){})".format(idx, x)
+                for idx, x in enumerate(patterns)
+            )
+        )
+
+    def __call__(self, file):
+        # Preserve try_recognize's check for an already-specialized file
+        limit = len(self.classes)
+        for idx, cls in enumerate(self.classes):
+            if isinstance(file, cls):
+                limit = idx
+                break
+
+        if limit == 0:
+            return True
+
+        with profile("recognizes", file):
+            m = self.regex.match(file.magic_file_type)
+
+        if m is not None:
+            idx = int(m.lastgroup[1:])
+            if idx < limit:
+                specialize_as(file, self.classes[idx])
+                return True
+
+        return limit < len(self.classes)
+
+
+class ClassStep:
+    def __init__(self, cls, method):
+        self.cls = cls
+        self.method = method
+        self.suffixes = None
+
+        if uses_default(cls, method) and uses_default(cls, "recognizes"):
+            # The default implementations AND any extension tests with the
+            # rest, so we can rule out most files by name alone.
+            suffixes = cls.FILE_EXTENSION_SUFFIX
+            if method == "fallback_recognizes":
+                suffixes = suffixes or cls.FALLBACK_FILE_EXTENSION_SUFFIX
+            if suffixes:
+                self.suffixes = tuple(suffixes)
+
+    def __call__(self, file):
+        if (
+            self.suffixes is not None
+            and not isinstance(file, self.cls)
+            and not file.name.endswith(self.suffixes)
+        ):
+            return False
+
+        return try_recognize(file, self.cls, getattr(self.cls, self.method))
+
+
+class SpecializeIndex:
+    """
+    Precomputed dispatch over ComparatorManager().classes for specialize().
+
+    Comparators that use the default recognizes() only need their
+    FILE_TYPE_RE, FILE_EXTENSION_SUFFIX and FILE_TYPE_HEADER_PREFIX
+    declarations checking. Those that cannot match are dropped and runs
+    that only depend on FILE_TYPE_RE are matched with a single regular
+    expression. Comparators are still tried in the same order.
+    """
+
+    def __init__(self, classes):
+        self.classes = classes
+        self.steps = []
+        self.fallback_steps = []
+
+        run = []
+        for cls in classes:
+            if not uses_default(cls, "recognizes"):
+                self.add_run(run)
+                self.steps.append(ClassStep(cls, "recognizes"))
+                continue
+
+            pattern = None
+            if cls.FILE_TYPE_RE and not (
+                cls.FILE_EXTENSION_SUFFIX or cls.FILE_TYPE_HEADER_PREFIX
+            ):
+                pattern = scoped_pattern(cls.FILE_TYPE_RE)
+
+            if pattern is not None:
+                run.append((cls, pattern))
+            elif (
+                cls.FILE_TYPE_RE
+                or cls.FILE_EXTENSION_SUFFIX
+                or cls.FILE_TYPE_HEADER_PREFIX
+            ):
+                self.add_run(run)
+                self.steps.append(ClassStep(cls, "recognizes"))
+
+        self.add_run(run)
+
+        for cls in classes:
+            # The default fallback_recognizes() is always False for these
+            if uses_default(cls, "fallback_recognizes") and (
+                not uses_default(cls, "recognizes")
+                or not (
+                    cls.FALLBACK_FILE_EXTENSION_SUFFIX
+                    or cls.FILE_EXTENSION_SUFFIX
+                    or cls.FALLBACK_FILE_TYPE_HEADER_PREFIX
+                    or cls.FILE_TYPE_HEADER_PREFIX
+                )
+            ):
+                continue
+            self.fallback_steps.append(ClassStep(cls, "fallback_recognizes"))
+
+    def add_run(self, run):
+        if run:
+            classes, patterns = zip(*run)
+            self.steps.append(RegexStep(classes, patterns))
+        run.clear()
+
+    @classmethod
+    def get(cls):
+        classes = ComparatorManager().classes
+
+        # Rebuild if the comparators are reloaded (eg. during tests)
+        index = getattr(cls, "_index", None)
+        if index is None or index.classes is not classes:
+            index = cls._index = cls(classes)
+
+        return index
 
 
 def specialize(file):
-    for cls in ComparatorManager().classes:
-        if try_recognize(file, cls, cls.recognizes):
+    index = SpecializeIndex.get()
+
+    for step in index.steps:
+        if step(file):
             return file
 
-    for cls in ComparatorManager().classes:
-        if try_recognize(file, cls, cls.fallback_recognizes):
+    for step in index.fallback_steps:
+        if step(file):
             logger.debug(
                 "File recognized by fallback. Magic says: %s",
                 file.magic_file_type,
@@ -0,0 +1,525 @@
+#
+# diffoscope: in-depth comparison of files, archives, and directories
+#
+# Copyright © 2022 Chris Lamb <lamby@debian.org>
+#
+# diffoscope is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# diffoscope is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with diffoscope.  If not, see <https://www.gnu.org/licenses/>.
+
+import os
+import time
+import struct
+import hashlib
+import zipfile
+
+# The most that we search back from the end of the file for the end of
+# central directory record, ie. with the longest possible comment.
+MAX_EOCD_SEARCH = zipfile.sizeEndCentDir + 0xFFFF
+
+# Values that mean the real one is in a Zip64 extra field
+ZIP64_LIMITS = (0xFFFF, 0xFFFFFFFF)
+
+# As zipinfo(1) names the "host" that made each entry
+HOSTS = (
+    "fat",
+    "ami",
+    "vms",
+    "unx",
+    "cms",
+    "atr",
+    "hpf",
+    "mac",
+    "zzz",
+    "cpm",
+    "t20",
+    "ntf",
+    "qds",
+    "aco",
+    "vft",
+    "mvs",
+    "be ",
+    "nsk",
+    "ths",
+    "osx",
+)
+
+# Amiga, VMS and THEOS file attributes are shown in their own ways
+HOSTS_UNSUPPORTED = {1, 2, 18}
+
+# Hosts with MS-DOS file attributes
+HOSTS_FAT = {0, 4, 6, 11, 13, 14, 15}
+
+# As zipinfo(1) abbreviates each compression method
+METHODS = {
+    0: "stor",
+    1: "shrk",
+    2: "re:1",
+    3: "re:2",
+    4: "re:3",
+    5: "re:4",
+    6: "i#:#",
+    7: "tokn",
+    8: "def#",
+    9: "d64#",
+    10: "dcli",
+    12: "bzp2",
+    14: "lzma",
+    18: "ters",
+    19: "lz77",
+    97: "wavp",
+    98: "ppmd",
+}
+
+MONTHS = (
+    "Jan",
+    "Feb",
+    "Mar",
+    "Apr",
+    "May",
+    "Jun",
+    "Jul",
+    "Aug",
+    "Sep",
+    "Oct",
+    "Nov",
+    "Dec",
+)
+
+# Extra fields that zipinfo(1) may take the modification time from
+EXTRA_UT = 0x5455
+EXTRA_TIMES = {0x000A, 0x000D, 0x5855}
+
+FILE_TYPES = {
+    0o040000: "d",
+    0o100000: "-",
+    0o120000: "l",
+    0o060000: "b",
+    0o020000: "c",
+    0o010000: "p",
+    0o140000: "s",
+}
+
+
+class ZipFormatError(ValueError):
+    pass
+
+
+class CentralDirectory:
+    """
+    The central directory of a .zip file as a list of zipfile.ZipInfo, read
+    directly rather than via zipinfo(1).
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+        with open(path, "rb") as f:
+            self.size = os.fstat(f.fileno()).st_size
+            self.eocd_offset, eocd = self.find_eocd(f)
+
+            (
+                _,
+                disk,
+                cd_disk,
+                disk_entries,
+                entries,
+                cd_size,
+                cd_offset,
+                comment_size,
+            ) = struct.unpack(
+                zipfile.structEndArchive, eocd[: zipfile.sizeEndCentDir]
+            )
+            self.comment = eocd[zipfile.sizeEndCentDir :]
+
+            if cd_offset + cd_size > self.eocd_offset:
+                raise ZipFormatError(
+                    "Invalid central directory in {}".format(path)
+                )
+
+            f.seek(cd_offset)
+            self.data = f.read(cd_size)
+
+        self.entries = list(self.read_entries())
+
+        # Whether zipinfo(1) would warn about, or make any adjustment for, the
+        # layout of the archive; eg. Mozilla-optimized .zip files or those
+        # with a prefix
+        self.is_simple = (
+            disk == cd_disk == 0
+            and disk_entries == entries == len(self.entries)
+            and cd_offset + cd_size == self.eocd_offset
+            and len(self.comment) == comment_size
+            and not self.is_zip64(cd_size, cd_offset, entries)
+        )
+
+        h = hashlib.sha256()
+        h.update(struct.pack("<Q", self.size))
+        h.update(self.data)
+        h.update(eocd)
+        self.digest = h.hexdigest()
+
+    def find_eocd(self, f):
+        """
+        Return the offset and contents (with the comment) of the end of
+        central directory record.
+        """
+
+        offset = max(0, self.size - MAX_EOCD_SEARCH)
+        f.seek(offset)
+        buf = f.read()
+
+        idx = buf.rfind(zipfile.stringEndArchive)
+        while idx >= 0:
+            end = idx + zipfile.sizeEndCentDir
+            if end <= len(buf):
+                (comment_size,) = struct.unpack("<H", buf[end - 2 : end])
+                # Like zipfile, allow a truncated comment
+                return offset + idx, buf[idx : end + comment_size]
+            idx = buf.rfind(zipfile.stringEndArchive, 0, idx)
+
+        raise ZipFormatError("Not a .zip file: {}".format(self.path))
+
+    def is_zip64(self, cd_size, cd_offset, entries):
+        if cd_size in ZIP64_LIMITS or cd_offset in ZIP64_LIMITS:
+            return True
+        if entries in ZIP64_LIMITS:
+            return True
+        return any(
+            x.file_size in ZIP64_LIMITS
+            or x.compress_size in ZIP64_LIMITS
+            or x.header_offset in ZIP64_LIMITS
+            for x in self.entries
+        )
+
+    def read_entries(self):
+        offset = 0
+        while offset + zipfile.sizeCentralDir <= len(self.data):
+            fields = struct.unpack_from(
+                zipfile.structCentralDir, self.data, offset
+            )
+            if fields[0] != zipfile.stringCentralDir:
+                raise ZipFormatError(
+                    "Invalid central directory entry in {}".format(self.path)
+                )
+            offset += zipfile.sizeCentralDir
+
+            name = self.data[offset : offset + fields[12]]
+            offset += fields[12]
+            extra = self.data[offset : offset + fields[13]]
+            offset += fields[13]
+            comment = self.data[offset : offset + fields[14]]
+            offset += fields[14]
+
+            if offset > len(self.data):
+                raise ZipFormatError(
+                    "Truncated central directory in {}".format(self.path)
+                )
+
+            flags = fields[5]
+            x = zipfile.ZipInfo(
+                name.decode("utf-8" if flags & 0x800 else "cp437")
+            )
+            (
+                x.create_version,
+                x.create_system,
+                x.extract_version,
+                x.reserved,
+                x.flag_bits,
+                x.compress_type,
+            ) = fields[1:7]
+            t, d = fields[7:9]
+            x.date_time = (
+                (d >> 9) + 1980,
+                (d >> 5) & 0xF,
+                d & 0x1F,
+                t >> 11,
+                (t >> 5) & 0x3F,
+                (t & 0x1F) * 2,
+            )
+            (
+                x.CRC,
+                x.compress_size,
+                x.file_size,
+            ) = fields[9:12]
+            (
+                x.volume,
+                x.internal_attr,
+                x.external_attr,
+                x.header_offset,
+            ) = fields[15:]
+            x.extra = extra
+            x.comment = comment
+            yield x
+
+    def extra_fields(self):
+        return {x.filename: x.extra for x in self.entries}
+
+
+def read_central_directory(path):
+    try:
+        return CentralDirectory(path)
+    except (OSError, ValueError, struct.error):
+        return None
+
+
+def iter_extra(extra):
+    offset = 0
+    while offset < len(extra):
+        if offset + 4 > len(extra):
+            raise ZipFormatError("Truncated extra field")
+        id_, size = struct.unpack_from("<HH", extra, offset)
+        offset += 4
+        if offset + size > len(extra):
+            raise ZipFormatError("Truncated extra field")
+        yield id_, extra[offset : offset + size]
+        offset += size
+
+
+def is_printable(name):
+    return name.isascii() and name.isprintable()
+
+
+def format_dos_attributes(x):
+    xattr = x.external_attr & 0xFF
+
+    result = list(".r.-...")
+    result[2] = "-" if xattr & 0x01 else "w"
+    result[5] = "h" if xattr & 0x02 else "-"
+    result[6] = "s" if xattr & 0x04 else "-"
+    result[4] = "a" if xattr & 0x20 else "-"
+    if xattr & 0x10:
+        result[0] = "d"
+        result[3] = "x"
+    else:
+        result[0] = "-"
+
+    if xattr & 0x08:
+        # Volume labels are named differently
+        return None
+
+    if "." in x.filename:
+        ext = x.filename.rpartition(".")[2][:3].lower()
+        if ext in {"com", "exe", "btm", "cmd", "bat"}:
+            result[3] = "x"
+
+    return "".join(result)
+
+
+def format_attributes(x):
+    xattr = x.external_attr >> 16
+
+    if x.create_system in HOSTS_FAT:
+        # Unless they look like they were converted from Unix permissions
+        dos = x.external_attr & 0xFF
+        expected = 0o400 | (not dos & 0x01) << 7 | (dos & 0x10) << 2
+        if x.create_system != 0 or xattr & 0o700 != expected:
+            return format_dos_attributes(x)
+
+    def bit(mask, char):
+        return char if xattr & mask else "-"
+
+    def execute(mask, special, chars):
+        return chars[bool(xattr & mask) * 2 + bool(xattr & special)]
+
+    return "".join(
+        (
+            FILE_TYPES.get(xattr & 0o170000, "?"),
+            bit(0o400, "r"),
+            bit(0o200, "w"),
+            execute(0o100, 0o4000, "-Sxs"),
+            bit(0o040, "r"),
+            bit(0o020, "w"),
+            execute(0o010, 0o2000, "-Sxs"),
+            bit(0o004, "r"),
+            bit(0o002, "w"),
+            execute(0o001, 0o1000, "-Txt"),
+        )
+    )
+
+
+def format_method(x):
+    result = METHODS.get(x.compress_type)
+    if result is None:
+        return "u{:03d}".format(x.compress_type)
+    if x.compress_type == 6:
+        return "i{}:{}".format(
+            "8" if x.flag_bits & 2 else "4", "3" if x.flag_bits & 4 else "2"
+        )
+    if x.compress_type in (8, 9):
+        return result[:3] + "NXFS"[(x.flag_bits >> 1) & 3]
+    return result
+
+
+def modification_time(x):
+    """
+    Return the (year, month, day, hour, minute) of `x` as zipinfo(1) shows
+    it, preferring the "UT" extra field, or None if we can't be sure of it.
+    """
+
+    # The last "UT" field wins, even if it has no modification time
+    mtime = None
+    for id_, data in iter_extra(x.extra):
+        if id_ in EXTRA_TIMES:
+            return None
+        if id_ == EXTRA_UT and data:
+            mtime = None
+            if data[0] & 0x1 and len(data) >= 5:
+                (mtime,) = struct.unpack_from("<L", data, 1)
+
+    if mtime is None:
+        return x.date_time[:5]
+
+    # Leave any interpretation of times beyond 2038 to zipinfo(1)
+    if mtime & 0x80000000:
+        return None
+
+    return time.localtime(mtime)[:5]
+
+
+def format_entry(x):
+    if x.create_system in HOSTS_UNSUPPORTED or not is_printable(x.filename):
+        return None
+
+    # Encrypted, or an attribute that zipinfo(1) (sometimes) shows as an
+    # extra field
+    if x.flag_bits & 0x1 or x.external_attr & 0x8000:
+        return None
+
+    attributes = format_attributes(x)
+    mtime = modification_time(x)
+    if attributes is None or mtime is None:
+        return None
+    year, month, day, hour, minute = mtime
+    if 1 <= month <= 12:
+        month = MONTHS[month - 1]
+    else:
+        month = "{:03d}".format(month)
+
+    return "{:<10} {:>2}.{} {} {:>8} {}{} {} {:02d}-{}-{:02d} {:02d}:{:02d} {}\n".format(
+        attributes,
+        x.create_version // 10,
+        x.create_version % 10,
+        HOSTS[x.create_system] if x.create_system < len(HOSTS) else "???",
+        x.file_size,
+        "t" if x.internal_attr & 0x1 else "b",
+        "-lxX"[bool(x.extra) * 2 + bool(x.flag_bits & 0x8)],
+        format_method(x),
+        year % 100,
+        month,
+        day,
+        hour,
+        minute,
+        x.filename,
+    )
+
+
+def ratio(uncompressed, compressed):
+    """
+    The space saved by compression in tenths of a percent, as zipinfo(1)
+    rounds it.
+    """
+
+    if not uncompressed:
+        return 0
+
+    if uncompressed > 2000000:
+        denom = uncompressed // 1000
+        diff = uncompressed - compressed
+    else:
+        denom = uncompressed
+        diff = 1000 * (uncompressed - compressed)
+
+    result = (abs(diff) + (denom >> 1)) // denom
+    return result if diff >= 0 else -result
+
+
+def zipinfo_listing(cd):
+    """
+    Return the output of zipinfo(1) for `cd` (without the "Archive:" line),
+    or None if we cannot be sure of rendering it identically.
+    """
+
+    if not cd.is_simple or not cd.entries:
+        return None
+
+    lines = [
+        "Zip file size: {} bytes, number of entries: {}\n".format(
+            cd.size, len(cd.entries)
+        )
+    ]
+
+    try:
+        for x in cd.entries:
+            line = format_entry(x)
+            if line is None:
+                return None
+            lines.append(line)
+    except (ValueError, OverflowError, OSError):
+        return None
+
+    uncompressed = sum(x.file_size for x in cd.entries)
+    compressed = sum(x.compress_size for x in cd.entries)
+    factor = ratio(uncompressed, compressed)
+    lines.append(
+        "{} file{}, {} bytes uncompressed, {} bytes compressed:  {}{}.{}%\n".format(
+            len(cd.entries),
+            "" if len(cd.entries) == 1 else "s",
+            uncompressed,
+            compressed,
+            "-" if factor < 0 else "",
+            abs(factor) // 10,
+            abs(factor) % 10,
+        )
+    )
+
+    return "".join(lines)
+
+
+def format_comment(comment):
+    # zipnote(1) would escape lines starting with "@", etc.
+    try:
+        text = comment.decode("ascii")
+    except UnicodeDecodeError:
+        return None
+    lines = text.split("\n")
+    if any(x.startswith("@") or not x.isprintable() for x in lines):
+        return None
+
+    # Zipnote joins the lines of each comment together
+    return "".join(lines)
+
+
+def zipnote_listing(cd):
+    """
+    Return the filtered output of zipnote(1) for `cd` (see Zipnote), or
+    None if we cannot be sure of rendering it identically.
+    """
+
+    if not cd.is_simple:
+        return None
+
+    result = []
+    for x in cd.entries:
+        comment = format_comment(x.comment)
+        if comment is None or not is_printable(x.filename):
+            return None
+        result.append(
+            "Filename: {}\nComment: {}\n\n".format(x.filename, comment)
+        )
+
+    comment = format_comment(cd.comment)
+    if comment is None:
+        return None
+    result.append("Zip file comment: {}".format(comment))
+
+    return "".join(result)
@@ -20,6 +20,7 @@
 import re
 import sys
 import shutil
+import logging
 import os.path
 import zipfile
 
@@ -27,12 +28,22 @@ from diffoscope.config import Config
 from diffoscope.tools import tool_required
 from diffoscope.difference import Difference
 from diffoscope.exc import ContainerExtractionError, RequiredToolNotFound
+from diffoscope.excludes import operation_excluded
 from diffoscope.tempfiles import get_named_temporary_file
 
 from .utils.file import File
 from .directory import Directory
 from .utils.archive import Archive, ArchiveMember
 from .utils.command import Command
+from .utils.zip import (
+    read_central_directory,
+    zipinfo_listing,
+    zipnote_listing,
+)
+
+logger = logging.getLogger(__name__)
+
+BLOCK_SIZE = 2**20
 
 
 class Zipinfo(Command):
@@ -117,34 +128,85 @@ class BsdtarVerbose(Command):
         return ["bsdtar", "-tvf", self.path]
 
 
+def central_directories(file, other):
+    """
+    Return the CentralDirectory of each file, or None if either cannot be
+    read (or is missing).
+    """
+
+    result = []
+    for x in (file, other):
+        if x.path == "/dev/null":
+            return None
+        if not hasattr(x, "_central_directory"):
+            x._central_directory = read_central_directory(x.path)
+        if x._central_directory is None:
+            return None
+        result.append(x._central_directory)
+    return result
+
+
+def listing_difference(klass, name, render, file, other, cds):
+    """
+    Compare the output of `klass` on each file, rendering it from their
+    central directories with `render` instead of running it if we can.
+    """
+
+    if cds is not None and not operation_excluded("{} {{}}".format(name)):
+        texts = [render(x) for x in cds]
+        if None not in texts:
+            return Difference.from_text(
+                texts[0],
+                texts[1],
+                file.path,
+                other.path,
+                source="{} {{}}".format(name),
+            )
+
+    return Difference.from_operation(klass, file.path, other.path)
+
+
 def zipinfo_differences(file, other):
     """
     Run all our zipinfo variants.
     """
 
-    # We need to run both "zipinfo" and "zipinfo -v" in all code paths, so just
-    # run them both first.
-    zipinfo = Difference.from_operation(Zipinfo, file.path, other.path)
-    verbose = Difference.from_operation(ZipinfoVerbose, file.path, other.path)
-
-    # First try and prefer "zipinfo"...
-    if zipinfo is not None:
-        # ... but if "zipinfo -v" indicates we have differences in .zip
-        # directory "extra fields", add a comment and prefer that output.
-        if re.search(
-            r"[-+]  The central-directory extra field contains:",
-            verbose.unified_diff,
-        ):
-            verbose.add_comment(
-                "Differences in extra fields detected; using output from zipinfo -v"
+    cds = central_directories(file, other)
+
+    # Neither "zipinfo" nor "zipinfo -v" can find any differences between
+    # identical central directories, so don't run them.
+    if cds is None or cds[0].digest != cds[1].digest:
+        # First try and prefer "zipinfo"...
+        zipinfo = listing_difference(
+            Zipinfo, "zipinfo", zipinfo_listing, file, other, cds
+        )
+        if zipinfo is not None:
+            # ... but if "zipinfo -v" might indicate we have differences in
+            # .zip directory "extra fields", run it. If it does, add a comment
+            # and prefer that output.
+            if cds is not None and not extra_fields_differ(*cds):
+                return [zipinfo]
+
+            verbose = Difference.from_operation(
+                ZipinfoVerbose, file.path, other.path
             )
-            return [verbose]
+            if verbose is not None and re.search(
+                r"[-+]  The central-directory extra field contains:",
+                verbose.unified_diff,
+            ):
+                verbose.add_comment(
+                    "Differences in extra fields detected; using output from zipinfo -v"
+                )
+                return [verbose]
 
-        return [zipinfo]
+            return [zipinfo]
 
-    # If none of this was detected, fallback to "zipinfo -v"...
-    if verbose is not None:
-        return [verbose]
+        # If none of this was detected, fallback to "zipinfo -v"...
+        verbose = Difference.from_operation(
+            ZipinfoVerbose, file.path, other.path
+        )
+        if verbose is not None:
+            return [verbose]
 
     # ... and, finally, "bsdtar -tvz"
     bsdtar = Difference.from_operation(BsdtarVerbose, file.path, other.path)
@@ -154,6 +216,19 @@ def zipinfo_differences(file, other):
     return []
 
 
+def extra_fields_differ(cd1, cd2):
+    extra1, extra2 = cd1.extra_fields(), cd2.extra_fields()
+
+    # Duplicate filenames
+    if len(extra1) != len(cd1.entries) or len(extra2) != len(cd2.entries):
+        return True
+
+    return any(
+        extra1.get(x, b"") != extra2.get(x, b"")
+        for x in extra1.keys() | extra2.keys()
+    )
+
+
 class ZipDirectory(Directory, ArchiveMember):
     def __init__(self, archive, member_name):
         ArchiveMember.__init__(self, archive, member_name)
@@ -211,6 +286,75 @@ class ZipContainer(Archive):
             return ZipDirectory(self, member_name)
         return ArchiveMember(self, member_name)
 
+    def get_adjusted_members_sizes(self):
+        # Use the sizes recorded in the central directory rather than
+        # extracting every member just to stat(2) it.
+        for name, member in self.get_adjusted_members():
+            if member.is_directory():
+                size = 4096  # default "size" of a directory
+            else:
+                size = self.archive.getinfo(member.name).file_size
+            yield name, (member, size)
+
+    def is_identical(self, member_name, other, other_member_name):
+        """
+        Whether a member has the same contents as one in `other`. Members
+        whose CRC32 or size in their central directories differ are not, and
+        the contents of the rest are decompressed and compared as they are
+        read instead of being extracted.
+
+        With --trust-zip-crc32, matching CRC32s and sizes are enough.
+        """
+
+        info1 = self.archive.getinfo(member_name)
+        info2 = other.archive.getinfo(other_member_name)
+
+        if info1.is_dir() or info2.is_dir():
+            return False
+
+        # Leave reporting encrypted members to extract()
+        if (info1.flag_bits | info2.flag_bits) & 0x1:
+            return False
+
+        if (info1.CRC, info1.file_size) != (info2.CRC, info2.file_size):
+            return False
+
+        if Config().trust_zip_crc32:
+            return True
+
+        try:
+            with self.archive.open(info1) as f1, other.archive.open(
+                info2
+            ) as f2:
+                for buf in iter(lambda: f1.read(BLOCK_SIZE), b""):
+                    if f2.read(len(buf)) != buf:
+                        return False
+                return f2.read(1) == b""
+        except Exception as e:
+            # Leave it to the extraction to report this, if needed.
+            logger.debug("Error reading %s: %s", member_name, e)
+            return False
+
+    def comparisons(self, other):
+        # Members with identical contents need never be extracted nor
+        # compared.
+        if not isinstance(other, ZipContainer) or Config().force_details:
+            return super().comparisons(other)
+
+        def hide_identical(item):
+            file1, file2, comment = item
+            if (
+                comment is None
+                and getattr(file1, "container", None) is self
+                and getattr(file2, "container", None) is other
+                and self.is_identical(file1.name, other, file2.name)
+            ):
+                logger.debug("Skipping %s: identical CRC32", file1.name)
+                return False
+            return True
+
+        return filter(hide_identical, super().comparisons(other))
+
 
 class ZipFileBase(File):
     def compare(self, other, source=None):
@@ -253,7 +397,14 @@ class ZipFile(ZipFileBase):
 
         try:
             differences.append(
-                Difference.from_operation(Zipnote, self.path, other.path)
+                listing_difference(
+                    Zipnote,
+                    "zipnote",
+                    zipnote_listing,
+                    self,
+                    other,
+                    central_directories(self, other),
+                )
             )
         except RequiredToolNotFound:  # noqa
             pass
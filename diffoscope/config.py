@@ -45,6 +45,7 @@ class Config:
         # GNU diff cannot process arbitrary large files :(
         self.max_diff_input_lines = 2**22
         self.max_diff_block_lines_saved = float("inf")
+        self.diff_engine = "auto"
 
         # hard limits, restricts single-file and multi-file formats
         self.max_report_size = defaultint(40 * 2**20)  # 40 MB
@@ -66,9 +67,15 @@ class Config:
         self.exclude_directory_metadata = "no"
         self.extended_filesystem_attributes = False
         self.compute_visual_diffs = False
+        self.streaming = False
         self.max_container_depth = 50
         self.use_dbgsym = "auto"
         self.force_details = False
+        self.trust_zip_crc32 = False
+        self.jobs = 1
+        self.max_subprocesses = 1
+        self.cache_dir = None
+        self.cache_max_size = 2**30  # 1 GiB
 
         self.started = time.time()
         self.timeout = float("inf")
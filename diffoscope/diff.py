@@ -31,13 +31,21 @@ import subprocess
 from difflib import Differ
 from multiprocessing.dummy import Queue
 
+from . import diffseq
 from .tools import get_tool_name, tool_required
 from .config import Config
 from .profiling import profile
-from .tempfiles import get_temporary_directory
+from .diffstore import store_diff
+from .tempfiles import get_named_temporary_file, get_temporary_directory
 
 DIFF_CHUNK = 4096
 
+# With --diff-engine=auto, inputs larger than this (in bytes) or requiring
+# more work than this (in roughly the number of line comparisons) are passed
+# to diff(1) as it is much faster at comparing them.
+MAX_INPROCESS_DIFF_SIZE = 2**16
+MAX_INPROCESS_DIFF_COST = 2**16
+
 logger = logging.getLogger(__name__)
 re_diff_change = re.compile(r"^([+-@]).*", re.MULTILINE)
 
@@ -74,7 +82,9 @@ class DiffParser:
 
     @property
     def diff(self):
-        return self._diff.getvalue().decode("UTF-8", errors="replace")
+        # Avoid copying the buffer as it may be large
+        with self._diff.getbuffer() as val:
+            return store_diff(val)
 
     @property
     def success(self):
@@ -197,7 +207,7 @@ def run_diff(fifo1, fifo2, end_nl_q1, end_nl_q2):
 
     if not parser.success and p.returncode not in (0, 1):
         raise subprocess.CalledProcessError(
-            p.returncode, cmd, output=parser.diff.encode("utf-8")
+            p.returncode, cmd, output=str(parser.diff).encode("utf-8")
         )
 
     if p.returncode == 0:
@@ -327,7 +337,55 @@ def make_feeder_from_raw_reader(in_file, filterfn=None):
     return feeder
 
 
-def diff(feeder1, feeder2):
+class SpooledOutput:
+    """
+    A file-like object for feeders to write to that is kept in memory until
+    it grows beyond `max_size` bytes, after which it is moved to a temporary
+    file so that it can be passed to diff(1).
+    """
+
+    def __init__(self, max_size=None):
+        self.max_size = float("inf") if max_size is None else max_size
+        self._buf = io.BytesIO()
+        self._file = None
+
+    @property
+    def name(self):
+        return self._file.name
+
+    @property
+    def in_memory(self):
+        return self._file is None
+
+    def write(self, data):
+        if self._file is None:
+            if self._buf.tell() + len(data) <= self.max_size:
+                self._buf.write(data)
+                return
+            self.spill()
+        self._file.write(data)
+
+    def flush(self):
+        # Nothing reads from us concurrently, so there is no need to flush
+        # every line as the FIFOs do.
+        pass
+
+    def getvalue(self):
+        return self._buf.getvalue()
+
+    def spill(self):
+        if self._file is None:
+            self._file = get_named_temporary_file(prefix="diff_")
+            self._file.write(self._buf.getvalue())
+            self._buf = None
+        self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+
+
+def diff_fifo(feeder1, feeder2):
     with get_temporary_directory() as tmpdir:
         fifo1_path = os.path.join(tmpdir, "fifo1")
         fifo2_path = os.path.join(tmpdir, "fifo2")
@@ -339,6 +397,117 @@ def diff(feeder1, feeder2):
             )
 
 
+def diff_inprocess(data1, data2, end_nl, max_cost=None):
+    """
+    Compute the same output as run_diff() but without calling diff(1),
+    truncating blocks longer than max_diff_block_lines_saved as DiffParser
+    does.
+
+    Raises diffseq.TooExpensive if `max_cost` is given and exceeded.
+    """
+
+    hunks = diffseq.unified_diff(
+        diffseq.split_lines(data1),
+        diffseq.split_lines(data2),
+        Config().diff_context,
+        max_cost,
+    )
+
+    return join_hunks(hunks, end_nl)
+
+
+def join_hunks(hunks, end_nl):
+    """
+    Return the hunks yielded by diffseq.unified_diff() as a diff, truncating
+    blocks longer than max_diff_block_lines_saved as DiffParser does.
+    """
+
+    out = []
+    max_lines = Config().max_diff_block_lines_saved
+
+    for header, lines in hunks:
+        out.append(header)
+        direction = None
+        block_len = 0
+
+        for prefix, line in lines:
+            # When both files don't end with \n, do not show it as a
+            # difference
+            if prefix == b"\\" and not end_nl:
+                continue
+
+            if prefix in (b"-", b"+") and prefix == direction:
+                block_len += 1
+                if block_len > max_lines:
+                    continue
+            else:
+                if block_len > max_lines:
+                    out.append(
+                        b"%s[ %d lines removed ]"
+                        % (direction, block_len - max_lines)
+                    )
+                block_len = 1
+                direction = prefix
+
+            out.append(prefix + line)
+
+        if block_len > max_lines:
+            out.append(
+                b"%s[ %d lines removed ]" % (direction, block_len - max_lines)
+            )
+
+    if not out:
+        return None
+
+    out.append(b"")
+
+    return store_diff(b"\n".join(out))
+
+
+def diff(feeder1, feeder2):
+    engine = Config().diff_engine
+
+    if engine == "gnu":
+        return diff_fifo(feeder1, feeder2)
+
+    max_size = max_cost = None
+    if engine == "auto":
+        max_size = MAX_INPROCESS_DIFF_SIZE
+        max_cost = MAX_INPROCESS_DIFF_COST
+
+    out1 = SpooledOutput(max_size)
+    out2 = SpooledOutput(max_size)
+
+    try:
+        end_nl1 = feeder1(out1)
+        end_nl2 = feeder2(out2)
+
+        if out1.in_memory and out2.in_memory:
+            try:
+                with profile("diff", "inprocess"):
+                    return diff_inprocess(
+                        out1.getvalue(),
+                        out2.getvalue(),
+                        end_nl1 and end_nl2,
+                        max_cost,
+                    )
+            except diffseq.TooExpensive:
+                pass
+
+        # Inputs are too large to compare in-process efficiently
+        out1.spill()
+        out2.spill()
+
+        end_nl_q1, end_nl_q2 = Queue(), Queue()
+        end_nl_q1.put(end_nl1)
+        end_nl_q2.put(end_nl2)
+
+        return run_diff(out1.name, out2.name, end_nl_q1, end_nl_q2)
+    finally:
+        out1.close()
+        out2.close()
+
+
 def diff_split_lines(diff, keepends=True):
     lines = diff.split("\n")
     if not keepends:
@@ -393,9 +562,16 @@ def color_unified_diff(diff):
 
 DIFFON = "\x01"
 DIFFOFF = "\x02"
-MAX_WAGNER_FISCHER_SIZE = (
-    256  # any higher, and linediff takes >1 second and >200MB RAM
-)
+# Truncate lines longer than this (in characters) before calculating their
+# differences
+MAX_LINEDIFF_SIZE = 2**16
+# Find the minimum edit distance if it requires calculating fewer cells than
+# this, otherwise fall back to the (faster, but not always minimal) algorithm
+# from diffseq. Large enough for any pair of lines up to 256 characters.
+MAX_LINEDIFF_CELLS = 2**18
+# Give up and mark everything as changed after approximately this many
+# comparisons in diffseq
+MAX_LINEDIFF_COST = 2**22
 
 
 def _linediff_sane(x):
@@ -415,7 +591,7 @@ def diffinput_truncate(s, sz):
 
 
 def linediff(s, t, diffon, diffoff):
-    # calculate common prefix/suffix, easy optimisation for Wagner-Fischer
+    # calculate common prefix/suffix, easy optimisation for the below
     prefix = os.path.commonprefix((s, t))
     if prefix:
         s = s[len(prefix) :]
@@ -425,10 +601,14 @@ def linediff(s, t, diffon, diffoff):
         s = s[: -len(suffix)]
         t = t[: -len(suffix)]
 
-    # truncate so Wagner-Fischer doesn't blow up RAM
-    s = diffinput_truncate(s, MAX_WAGNER_FISCHER_SIZE)
-    t = diffinput_truncate(t, MAX_WAGNER_FISCHER_SIZE)
-    l1, l2 = zip(*linediff_simplify(linediff_wagnerfischer(s, t)))
+    # truncate so pathologically long lines do not blow up RAM
+    s = diffinput_truncate(s, MAX_LINEDIFF_SIZE)
+    t = diffinput_truncate(t, MAX_LINEDIFF_SIZE)
+
+    pairs = linediff_ukkonen(s, t, MAX_LINEDIFF_CELLS)
+    if pairs is None:
+        pairs = linediff_myers(s, t, MAX_LINEDIFF_COST)
+    l1, l2 = zip(*linediff_simplify(pairs))
 
     def to_string(k, v):
         sanev = "".join(_linediff_sane(c) for c in v)
@@ -440,67 +620,148 @@ def linediff(s, t, diffon, diffoff):
     return f"{prefix}{s1}{suffix}", f"{prefix}{t1}{suffix}"
 
 
-def linediff_wagnerfischer(s, t):
+def linediff_ukkonen(s, t, max_cells):
     """
     Line diff algorithm, originally from diff2html.
 
     https://en.wikipedia.org/wiki/Wagner%E2%80%93Fischer_algorithm
 
-    Finds the minimum (levenshtein) edit distance between two strings, but has
-    quadratic performance O(m*n).
+    Finds the minimum (levenshtein) edit distance between two strings,
+    returning the steps of the edit as a list of (changed, text) pairs.
+
+    Only cells within `k` of the diagonal are calculated, doubling `k` until
+    the edit distance is at most `k` (after Ukkonen). The cells outside of
+    this band cannot be part of the optimal path, so the result is identical
+    to calculating the whole O(m*n) matrix but takes O((m+n)*k) time and
+    space instead. Returns None if this would require more than `max_cells`
+    cells.
     """
+
     m, n = len(s), len(t)
-    d = [[(0, 0) for i in range(n + 1)] for i in range(m + 1)]
+    k = max(abs(m - n), 8)
+
+    while (m + 1) * (2 * k + 1) <= max_cells:
+        result = _linediff_band(s, t, k)
+        if result is not None:
+            return result
+        if k >= max(m, n):
+            break
+        k *= 2
+
+    return None
 
-    d[0][0] = (0, (0, 0))
-    for i in range(1, m + 1):
-        d[i][0] = (i, (i - 1, 0))
-    for j in range(1, n + 1):
-        d[0][j] = (j, (0, j - 1))
 
-    # NB. This loop is O(len(s) * len(t))
+def _linediff_band(s, t, k):
+    DIAGONAL, UP, LEFT = range(3)
+
+    m, n = len(s), len(t)
+    width = 2 * k + 1
+    inf = m + n + 1
+
+    # Cell (i, j) is stored at index j - i + k of row i. When costs are
+    # equal, prefer the diagonal, then up and then left, as the original
+    # implementation did.
+    parents = bytearray((m + 1) * width)
+    prev = [inf] * width
+    for j in range(min(n, k) + 1):
+        prev[j + k] = j
+        parents[j + k] = LEFT
+
     for i in range(1, m + 1):
-        for j in range(1, n + 1):
-            if s[i - 1] == t[j - 1]:
-                cost = 0
+        cur = [inf] * width
+        offset = i * width - i + k
+        c = s[i - 1]
+
+        for j in range(max(0, i - k), min(n, i + k) + 1):
+            idx = j - i + k
+            if j == 0:
+                best, parent = i, UP
             else:
-                cost = 1
-            d[i][j] = min(
-                (d[i - 1][j][0] + 1, (i - 1, j)),
-                (d[i][j - 1][0] + 1, (i, j - 1)),
-                (d[i - 1][j - 1][0] + cost, (i - 1, j - 1)),
-            )
+                best, parent = prev[idx] + (c != t[j - 1]), DIAGONAL
+                if idx + 1 < width and prev[idx + 1] + 1 < best:
+                    best, parent = prev[idx + 1] + 1, UP
+                if idx > 0 and cur[idx - 1] + 1 < best:
+                    best, parent = cur[idx - 1] + 1, LEFT
+            cur[idx] = best
+            parents[offset + j] = parent
+
+        prev = cur
+
+    # Cells outside the band are only guaranteed not to matter if the edit
+    # distance fits within it.
+    if prev[n - m + k] > k:
+        return None
 
-    coords = []
-    coord = (m, n)
-    while coord != (0, 0):
-        coords.insert(0, coord)
-        x, y = coord
-        coord = d[x][y][1]
-
-    for coord in coords:
-        cx, cy = coord
-        child_val = d[cx][cy][0]
-
-        father_coord = d[cx][cy][1]
-        fx, fy = father_coord
-        father_val = d[fx][fy][0]
-
-        diff = (cx - fx, cy - fy)
-
-        if diff == (0, 1):
-            yield (False, ""), (True, t[fy])
-        elif diff == (1, 0):
-            yield (True, s[fx]), (False, "")
-        elif child_val - father_val == 1:
-            yield (True, s[fx]), (True, t[fy])
+    result = []
+    i, j = m, n
+    while i or j:
+        parent = parents[i * width + j - i + k]
+        if parent == LEFT:
+            j -= 1
+            result.append(((False, ""), (True, t[j])))
+        elif parent == UP:
+            i -= 1
+            result.append(((True, s[i]), (False, "")))
         else:
-            assert s[fx] == t[fy]
-            yield (False, s[fx]), (False, t[fy])
+            i -= 1
+            j -= 1
+            changed = s[i] != t[j]
+            result.append(((changed, s[i]), (changed, t[j])))
+
+    result.reverse()
+
+    return result
+
+
+def linediff_myers(s, t, max_cost):
+    """
+    Line diff algorithm for strings too long for linediff_ukkonen.
+
+    Uses the same algorithm as diff(1), which takes linear space and time
+    proportional to the length of the strings multiplied by the number of
+    differences between them, but does not consider substitutions. These
+    are therefore reconstructed by pairing up the removed and added
+    characters between each common substring.
+
+    Everything is marked as changed if this would take more than
+    (approximately) `max_cost` comparisons.
+    """
+
+    try:
+        deleted, inserted = diffseq.compare_sequences(s, t, max_cost)
+    except diffseq.TooExpensive:
+        deleted, inserted = range(len(s)), range(len(t))
+
+    m, n = len(s), len(t)
+    deleted = set(deleted)
+    inserted = set(inserted)
+
+    i = j = 0
+    while i < m or j < n:
+        i0, j0 = i, j
+        while i in deleted:
+            i += 1
+        while j in inserted:
+            j += 1
+
+        common = min(i - i0, j - j0)
+        if common:
+            yield (True, s[i0 : i0 + common]), (True, t[j0 : j0 + common])
+        if i - i0 > common:
+            yield (True, s[i0 + common : i]), (False, "")
+        if j - j0 > common:
+            yield (False, ""), (True, t[j0 + common : j])
+
+        i0, j0 = i, j
+        while i < m and j < n and i not in deleted and j not in inserted:
+            i += 1
+            j += 1
+        if i > i0:
+            yield (False, s[i0:i]), (False, t[j0:j])
 
 
 def linediff_simplify(g):
-    """Simplify the output of Wagner-Fischer."""
+    """Simplify the output of linediff_ukkonen or linediff_myers."""
     current = None
     for l, r in g:
         if not current:
@@ -19,13 +19,18 @@
 
 import heapq
 import io
+import itertools
 import logging
 import subprocess
+import collections
 
 from . import feeders
+from .config import Config
 from .exc import RequiredToolNotFound
 from .diff import diff, reverse_unified_diff, diff_split_lines
+from .diffstore import StoredDiff, store_diff
 from .excludes import operation_excluded
+from .comparators.utils.parallel import subprocess_slots
 
 logger = logging.getLogger(__name__)
 
@@ -42,7 +47,7 @@ class Difference:
         visuals=None,
         unified_diff=None,
     ):
-        self._unified_diff = unified_diff
+        self._unified_diff = store_diff(unified_diff)
 
         self._comments = []
         if comment:
@@ -72,6 +77,8 @@ class Difference:
         # Whether the unified_diff already contains line numbers inside itself
         self._has_internal_linenos = has_internal_linenos
         self._details = details or []
+        # Details that are only computed when required (see add_lazy_details)
+        self._pending = None
         self._visuals = visuals or []
         self._size_cache = None
 
@@ -92,7 +99,7 @@ class Difference:
                 for comment in self._comments
             ],
             has_internal_linenos=self.has_internal_linenos,
-            details=self._details[:],
+            details=self.details[:],
             visuals=self._visuals[:],
             unified_diff=unified_diff,
         )
@@ -104,7 +111,7 @@ class Difference:
                 self.source2,
                 comment=self._comments[:],
                 has_internal_linenos=self.has_internal_linenos,
-                details=[d.fmap(f) for d in self._details],
+                details=[d.fmap(f) for d in self.details],
                 visuals=self._visuals[:],
                 unified_diff=self.unified_diff,
             )
@@ -126,7 +133,7 @@ class Difference:
             self.source1,
             comment=self._comments,  # already copied by fmap in get_reverse
             has_internal_linenos=self.has_internal_linenos,
-            details=self._details,  # already reversed by fmap in get_reverse, no need to copy
+            details=self.details,  # already reversed by fmap in get_reverse, no need to copy
             unified_diff=unified_diff,
         )
 
@@ -141,7 +148,7 @@ class Difference:
             and self.source2 == other.source2
             and self._comments == other._comments
             and self.has_internal_linenos == other.has_internal_linenos
-            and all(x.equals(y) for x, y in zip(self._details, other._details))
+            and all(x.equals(y) for x, y in zip(self.details, other.details))
             and all(x.equals(y) for x, y in zip(self._visuals, other._visuals))
         )
 
@@ -155,7 +162,7 @@ class Difference:
     def size_self(self):
         """Size, excluding children."""
         return (
-            (len(self.unified_diff) if self.unified_diff else 0)
+            (len(self._unified_diff) if self._unified_diff else 0)
             + (len(self.source1) if self.source1 else 0)
             + (len(self.source2) if self.source2 else 0)
             + sum(map(len, self.comments))
@@ -171,14 +178,14 @@ class Difference:
         return (
             self._unified_diff is not None
             or self._comments
-            or self._details
+            or self.details
             or self._visuals
         )
 
     def traverse_depth(self, depth=-1):
         yield self
         if depth != 0:
-            for d in self._details:
+            for d in self.details:
                 yield from d.traverse_depth(depth - 1)
 
     def traverse_breadth(self, queue=None):
@@ -186,7 +193,7 @@ class Difference:
         if queue:
             top = queue.pop(0)
             yield top
-            queue.extend(top._details)
+            queue.extend(top.details)
             yield from self.traverse_breadth(queue)
 
     def traverse_heapq(self, scorer, yield_score=False, queue=None):
@@ -203,7 +210,7 @@ class Difference:
             val, top = heapq.heappop(queue)
             prune_descendants = yield ((top, val) if yield_score else top)
             if not prune_descendants:
-                for d in top._details:
+                for d in top.details:
                     heapq.heappush(queue, (scorer(d, val), d))
 
     @staticmethod
@@ -268,10 +275,60 @@ class Difference:
             klass, path1, path2, *args, **kwargs
         )[0]
 
+    @staticmethod
+    def from_operations(klasses, path1, path2, *args, **kwargs):
+        """
+        Equivalent to calling from_operation() with each of `klasses` in turn,
+        except that the commands for subsequent classes are started ahead of
+        time so that they run concurrently (see --max-subprocesses).
+        """
+
+        operation_args = kwargs.pop("operation_args", [])
+        # Each class runs two commands; limit how much output is buffered.
+        window = max(1, Config().max_subprocesses // 2)
+
+        differences = []
+        pending = collections.deque()
+
+        for klass in klasses:
+            if len(pending) >= window:
+                differences.append(
+                    Difference._from_started_operations(
+                        pending.popleft(), path1, path2, *args, **kwargs
+                    )[0]
+                )
+            pending.append(
+                Difference._start_operations(
+                    klass, path1, path2, operation_args
+                )
+            )
+
+        while pending:
+            differences.append(
+                Difference._from_started_operations(
+                    pending.popleft(), path1, path2, *args, **kwargs
+                )[0]
+            )
+
+        return differences
+
     @staticmethod
     def from_operation_exc(klass, path1, path2, *args, **kwargs):
         operation_args = kwargs.pop("operation_args", [])
-        ignore_returncodes = kwargs.pop("ignore_returncodes", ())
+
+        started = Difference._start_operations(
+            klass, path1, path2, operation_args
+        )
+
+        return Difference._from_started_operations(
+            started, path1, path2, *args, **kwargs
+        )
+
+    @staticmethod
+    def _start_operations(klass, path1, path2, operation_args):
+        """
+        Start the operations for both sides so that they run concurrently.
+        """
 
         def operation_and_feeder(path):
             operation = None
@@ -285,41 +342,65 @@ class Difference:
                 operation.start()
             return feeder, operation, False
 
-        feeder1, operation1, excluded1 = operation_and_feeder(path1)
-        feeder2, operation2, excluded2 = operation_and_feeder(path2)
+        return operation_and_feeder(path1), operation_and_feeder(path2)
+
+    @staticmethod
+    def _from_started_operations(started, path1, path2, *args, **kwargs):
+        kwargs = dict(kwargs)
+        ignore_returncodes = kwargs.pop("ignore_returncodes", ())
+
+        (
+            (feeder1, operation1, excluded1),
+            (feeder2, operation2, excluded2),
+        ) = started
         if not feeder1 or not feeder2:
             assert excluded1 or excluded2
+            for x in (operation1, operation2):
+                if x is not None:
+                    x.terminate()
             return None, True
 
         if "source" not in kwargs:
             source_op = operation1 or operation2
             kwargs["source"] = source_op.full_name(truncate=120)
 
-        try:
-            short = kwargs.pop("short", False)
-            # If the outputs are expected to be short, store them in memory
-            # and do a direct comparison, and only spawn diff if needed.
-            if short:
-                memfile1 = io.BytesIO()
-                feeder1(memfile1)
-                memfile2 = io.BytesIO()
-                feeder2(memfile2)
-                bytes1 = memfile1.getbuffer().tobytes()
-                bytes2 = memfile2.getbuffer().tobytes()
-                # Check if the buffers are the same before invoking diff
-                if bytes1 == bytes2:
-                    return None, True
-                difference = Difference.from_text(
-                    bytes1, bytes2, path1, path2, *args, **kwargs
-                )
-            else:
-                difference = Difference.from_feeder(
-                    feeder1, feeder2, path1, path2, *args, **kwargs
-                )
-        except subprocess.CalledProcessError as exc:
-            if exc.returncode in ignore_returncodes:
-                return None, False
-            raise
+        # Streaming commands run whilst we read their output, so take their
+        # --max-subprocesses slots for that long.
+        streaming = sum(
+            x.streaming for x in (operation1, operation2) if x is not None
+        )
+
+        with subprocess_slots(streaming):
+            try:
+                short = kwargs.pop("short", False)
+                # If the outputs are expected to be short, store them in memory
+                # and do a direct comparison, and only spawn diff if needed.
+                if short:
+                    memfile1 = io.BytesIO()
+                    feeder1(memfile1)
+                    memfile2 = io.BytesIO()
+                    feeder2(memfile2)
+                    bytes1 = memfile1.getbuffer().tobytes()
+                    bytes2 = memfile2.getbuffer().tobytes()
+                    # Check if the buffers are the same before invoking diff
+                    if bytes1 == bytes2:
+                        return None, True
+                    difference = Difference.from_text(
+                        bytes1, bytes2, path1, path2, *args, **kwargs
+                    )
+                else:
+                    difference = Difference.from_feeder(
+                        feeder1, feeder2, path1, path2, *args, **kwargs
+                    )
+            except subprocess.CalledProcessError as exc:
+                if exc.returncode in ignore_returncodes:
+                    return None, False
+                raise
+            finally:
+                # Don't leave a command blocked on output that was never read
+                for x in (operation1, operation2):
+                    if x is not None:
+                        x.terminate()
 
         if not difference:
             return None, False
@@ -373,11 +454,15 @@ class Difference:
 
     @property
     def unified_diff(self):
+        # Large diffs are only read back when required (see store_diff)
+        if isinstance(self._unified_diff, StoredDiff):
+            return str(self._unified_diff)
         return self._unified_diff
 
     @unified_diff.setter
     def unified_diff(self, value):
-        self._unified_diff = value
+        self._unified_diff = store_diff(value)
+        self._size_cache = None
 
     @property
     def has_internal_linenos(self):
@@ -385,6 +470,9 @@ class Difference:
 
     @property
     def details(self):
+        if self._pending is not None:
+            pending, self._pending = self._pending, None
+            self.add_details(list(pending))
         return self._details
 
     @property
@@ -394,9 +482,71 @@ class Difference:
     def add_details(self, differences):
         if len([d for d in differences if type(d) is not Difference]) > 0:
             raise TypeError("'differences' must contains Difference objects'")
-        self._details.extend(differences)
+        if self._pending is not None:
+            # Keep them after any details we have yet to compute
+            self._pending = itertools.chain(self._pending, differences)
+        else:
+            self._details.extend(differences)
+        self._size_cache = None
+
+    def add_lazy_details(self, differences):
+        """
+        Like add_details(), but `differences` is an iterable of Difference
+        objects (or None) that is not consumed until the details are
+        required. This allows them to be presented while they are computed
+        (see events).
+        """
+
+        def check(differences):
+            for x in differences:
+                if x is None:
+                    continue
+                if type(x) is not Difference:
+                    raise TypeError(
+                        "'differences' must contains Difference objects'"
+                    )
+                yield x
+
+        if self._pending is None:
+            self._pending = check(differences)
+        else:
+            self._pending = itertools.chain(self._pending, check(differences))
         self._size_cache = None
 
+    def iter_details(self, consume=False):
+        """
+        Iterate over the details, computing any pending ones. If `consume` is
+        True, details computed by this call are not retained so memory usage
+        need not grow with the size of the tree.
+        """
+
+        if not consume:
+            yield from self.details
+            return
+
+        pending, self._pending = self._pending, None
+        yield from self._details
+        if pending is not None:
+            yield from pending
+
+    def events(self, consume=False):
+        """
+        Yield this difference and its details as a flat sequence of events
+        for presenters:
+
+          ("enter", difference)
+          ("diff", difference, chunk)  # zero or more; the unified_diff
+          ...                          # the events of each detail
+          ("exit", difference)
+        """
+
+        yield "enter", self
+        if self._unified_diff is not None:
+            yield "diff", self, self.unified_diff
+        for x in self.iter_details(consume):
+            yield from x.events(consume)
+        yield "exit", self
+
     def add_visuals(self, visuals):
         if any([type(v) is not VisualDifference for v in visuals]):
             raise TypeError("'visuals' must contain VisualDifference objects'")
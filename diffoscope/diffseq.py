@@ -0,0 +1,657 @@
+#
+# diffoscope: in-depth comparison of files, archives, and directories
+#
+# Copyright © 2022 Chris Lamb <lamby@debian.org>
+#
+# diffoscope is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# diffoscope is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with diffoscope.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+In-process equivalent of `diff -a -U<context>`.
+
+This is a port of the algorithm used by GNU diffutils (Myers' O(ND)
+algorithm from diffseq.h as well as the "confusing lines" and boundary
+shifting heuristics from analyze.c) so that its output is byte-for-byte
+identical to that of diff(1). This lets us avoid spawning a process and a
+pair of FIFOs for each of the (typically very many, very small) inputs we
+compare.
+"""
+
+OFFSET_MAX = float("inf")
+
+# Unlike diff(1) we never enable --speed-large-files, so the "big snake"
+# heuristic is never used; we only need to give up once it gets too
+# expensive.
+MIN_TOO_EXPENSIVE = 4096
+
+
+def split_lines(data):
+    """
+    Split `data` on b"\\n" only, keeping the line endings.
+    """
+
+    lines = data.split(b"\n")
+    last = lines.pop()
+    lines = [x + b"\n" for x in lines]
+    if last:
+        lines.append(last)
+    return lines
+
+
+class TooExpensive(Exception):
+    pass
+
+
+class _Context:
+    """
+    State shared by the recursive steps of the algorithm.
+
+    If `max_cost` is given, TooExpensive is raised once (approximately) that
+    many comparisons have been made.
+    """
+
+    def __init__(self, xv, yv, too_expensive, max_cost=None):
+        self.xv = xv
+        self.yv = yv
+        self.too_expensive = too_expensive
+        self.remaining = float("inf") if max_cost is None else max_cost
+        # Forward and backward diagonal offsets
+        self.fd = {}
+        self.bd = {}
+
+    def charge(self, cost):
+        self.remaining -= cost
+        if self.remaining < 0:
+            raise TooExpensive()
+
+    def diag(self, xoff, xlim, yoff, ylim, find_minimal):
+        """
+        Find the midpoint of the shortest edit script for a specified portion
+        of the two vectors, returning (xmid, ymid, lo_minimal, hi_minimal).
+        """
+
+        xv, yv, fd, bd = self.xv, self.yv, self.fd, self.bd
+
+        dmin = xoff - ylim
+        dmax = xlim - yoff
+        fmid = xoff - yoff
+        bmid = xlim - ylim
+        fmin = fmax = fmid
+        bmin = bmax = bmid
+        odd = (fmid - bmid) & 1
+
+        fd[fmid] = xoff
+        bd[bmid] = xlim
+
+        c = 0
+        while True:
+            c += 1
+            self.charge(fmax - fmin + bmax - bmin + 2)
+
+            # Extend the top-down search by an edit step in each diagonal.
+            if fmin > dmin:
+                fmin -= 1
+                fd[fmin - 1] = -1
+            else:
+                fmin += 1
+            if fmax < dmax:
+                fmax += 1
+                fd[fmax + 1] = -1
+            else:
+                fmax -= 1
+            for d in range(fmax, fmin - 1, -2):
+                tlo = fd[d - 1]
+                thi = fd[d + 1]
+                x = thi if tlo < thi else tlo + 1
+                y = x - d
+                while x < xlim and y < ylim and xv[x] == yv[y]:
+                    x += 1
+                    y += 1
+                fd[d] = x
+                if odd and bmin <= d <= bmax and bd[d] <= x:
+                    return x, y, True, True
+
+            # Similarly extend the bottom-up search.
+            if bmin > dmin:
+                bmin -= 1
+                bd[bmin - 1] = OFFSET_MAX
+            else:
+                bmin += 1
+            if bmax < dmax:
+                bmax += 1
+                bd[bmax + 1] = OFFSET_MAX
+            else:
+                bmax -= 1
+            for d in range(bmax, bmin - 1, -2):
+                tlo = bd[d - 1]
+                thi = bd[d + 1]
+                x = tlo if tlo < thi else thi - 1
+                y = x - d
+                while xoff < x and yoff < y and xv[x - 1] == yv[y - 1]:
+                    x -= 1
+                    y -= 1
+                bd[d] = x
+                if not odd and fmin <= d <= fmax and x <= fd[d]:
+                    return x, y, True, True
+
+            if find_minimal or c < self.too_expensive:
+                continue
+
+            # We've gone well beyond the call of duty; give up and report
+            # halfway between our best results so far.
+
+            # Find forward diagonal that maximizes X + Y.
+            fxybest = -1
+            for d in range(fmax, fmin - 1, -2):
+                x = min(fd[d], xlim)
+                y = x - d
+                if ylim < y:
+                    x = ylim + d
+                    y = ylim
+                if fxybest < x + y:
+                    fxybest = x + y
+                    fxbest = x
+
+            # Find backward diagonal that minimizes X + Y.
+            bxybest = OFFSET_MAX
+            for d in range(bmax, bmin - 1, -2):
+                x = max(xoff, bd[d])
+                y = x - d
+                if y < yoff:
+                    x = yoff + d
+                    y = yoff
+                if x + y < bxybest:
+                    bxybest = x + y
+                    bxbest = x
+
+            # Use the better of the two diagonals.
+            if (xlim + ylim) - bxybest < fxybest - (xoff + yoff):
+                return fxbest, fxybest - fxbest, True, False
+            return bxbest, bxybest - bxbest, False, True
+
+    def compareseq(self):
+        """
+        Return the indices of the elements of both vectors that are not part
+        of their longest common subsequence (as found by diff(1)).
+        """
+
+        xv, yv = self.xv, self.yv
+        deleted = []
+        inserted = []
+
+        stack = [(0, len(xv), 0, len(yv), False)]
+        while stack:
+            xoff, xlim, yoff, ylim, find_minimal = stack.pop()
+            self.charge(1)
+
+            # Slide down the bottom initial diagonal.
+            while xoff < xlim and yoff < ylim and xv[xoff] == yv[yoff]:
+                xoff += 1
+                yoff += 1
+
+            # Slide up the top initial diagonal.
+            while xoff < xlim and yoff < ylim and xv[xlim - 1] == yv[ylim - 1]:
+                xlim -= 1
+                ylim -= 1
+
+            # Handle simple cases.
+            if xoff == xlim:
+                inserted.extend(range(yoff, ylim))
+            elif yoff == ylim:
+                deleted.extend(range(xoff, xlim))
+            else:
+                # Find a point of correspondence in the middle of the vectors
+                # and split this problem into subproblems.
+                xmid, ymid, lo_minimal, hi_minimal = self.diag(
+                    xoff, xlim, yoff, ylim, find_minimal
+                )
+                stack.append((xmid, xlim, ymid, ylim, hi_minimal))
+                stack.append((xoff, xmid, yoff, ymid, lo_minimal))
+
+        return deleted, inserted
+
+
+def compare_sequences(xv, yv, max_cost=None):
+    """
+    Return a (deleted, inserted) tuple of the indices of the elements of `xv`
+    and `yv` that are not part of their longest common subsequence.
+
+    `xv` and `yv` may be any indexable sequences (eg. lists or strings). Only
+    linear space is used and the time taken is proportional to the size of
+    the inputs multiplied by the number of differences, although a
+    suboptimal result is returned instead of spending too long on very
+    different inputs.
+
+    Raises TooExpensive if `max_cost` is given and exceeded.
+    """
+
+    # Set TOO_EXPENSIVE to be the approximate square root of the input size,
+    # bounded below by 4096.
+    too_expensive = 1
+    diags = len(xv) + len(yv) + 3
+    while diags:
+        too_expensive <<= 1
+        diags >>= 2
+    too_expensive = max(MIN_TOO_EXPENSIVE, too_expensive)
+
+    return _Context(xv, yv, too_expensive, max_cost).compareseq()
+
+
+def _discard_confusing_lines(equivs, counts):
+    """
+    Mark lines that match no line of the other file (1) and lines that match
+    so many that they are likely to confuse the algorithm (2), returning the
+    lines that should actually be discarded.
+    """
+
+    discards = []
+
+    for f in (0, 1):
+        other = counts[1 - f]
+        many = 5
+        tem = len(equivs[f]) // 64
+        # Multiply MANY by approximate square root of number of lines.
+        tem >>= 2
+        while tem > 0:
+            many *= 2
+            tem >>= 2
+
+        marks = bytearray(len(equivs[f]))
+        for i, x in enumerate(equivs[f]):
+            nmatch = other.get(x, 0)
+            if nmatch == 0:
+                marks[i] = 1
+            elif nmatch > many:
+                marks[i] = 2
+        discards.append(marks)
+
+    # Don't really discard the provisional lines except when they occur in a
+    # run of discardables, with nonprovisionals at the beginning and end.
+    for marks in discards:
+        end = len(marks)
+        i = 0
+        while i < end:
+            if marks[i] == 2:
+                marks[i] = 0
+            elif marks[i] != 0:
+                # Find end of this run of discardable lines and count how
+                # many are provisionally discardable.
+                provisional = 0
+                j = i
+                while j < end and marks[j] != 0:
+                    if marks[j] == 2:
+                        provisional += 1
+                    j += 1
+
+                # Cancel provisional discards at end, and shrink the run.
+                while j > i and marks[j - 1] == 2:
+                    j -= 1
+                    marks[j] = 0
+                    provisional -= 1
+
+                length = j - i
+
+                if provisional * 4 > length:
+                    # If 1/4 of the lines in the run are provisional, cancel
+                    # discarding of all provisional lines in the run.
+                    while j > i:
+                        j -= 1
+                        if marks[j] == 2:
+                            marks[j] = 0
+                else:
+                    minimum = 1
+                    tem = length >> 2
+                    tem >>= 2
+                    while tem > 0:
+                        minimum <<= 1
+                        tem >>= 2
+                    minimum += 1
+
+                    # Cancel any subrun of MINIMUM or more provisionals
+                    # within the larger run.
+                    j = 0
+                    consec = 0
+                    while j < length:
+                        if marks[i + j] != 2:
+                            consec = 0
+                        else:
+                            consec += 1
+                            if minimum == consec:
+                                # Back up to start of subrun, to cancel it.
+                                j -= consec
+                            elif minimum < consec:
+                                marks[i + j] = 0
+                        j += 1
+
+                    # Scan from beginning of run until we find 3 or more
+                    # nonprovisionals in a row or until the first
+                    # nonprovisional at least 8 lines in. Until that point,
+                    # cancel any provisionals.
+                    consec = 0
+                    for j in range(length):
+                        if j >= 8 and marks[i + j] == 1:
+                            break
+                        if marks[i + j] == 2:
+                            consec = 0
+                            marks[i + j] = 0
+                        elif marks[i + j] == 0:
+                            consec = 0
+                        else:
+                            consec += 1
+                        if consec == 3:
+                            break
+
+                    # I advances to the last line of the run.
+                    i += length - 1
+
+                    # Same thing, from end.
+                    consec = 0
+                    for j in range(length):
+                        if j >= 8 and marks[i - j] == 1:
+                            break
+                        if marks[i - j] == 2:
+                            consec = 0
+                            marks[i - j] = 0
+                        elif marks[i - j] == 0:
+                            consec = 0
+                        else:
+                            consec += 1
+                        if consec == 3:
+                            break
+            i += 1
+
+    return discards
+
+
+def _shift_boundaries(equivs, changed):
+    """
+    Adjust inserts/deletes of identical lines to join changes as much as
+    possible.
+
+    `changed` contains a bytearray per file with a zero sentinel at either
+    end; changed[f][i + 1] is set if line `i` of file `f` was changed.
+    """
+
+    for f in (0, 1):
+        eq = equivs[f]
+        ch = changed[f]
+        other = changed[1 - f]
+        i = j = 0
+        i_end = len(eq)
+
+        while True:
+            # Scan forwards to find beginning of another run of changes.
+            # Also keep track of the corresponding point in the other file.
+            while i < i_end and not ch[i + 1]:
+                while other[j + 1]:
+                    j += 1
+                j += 1
+                i += 1
+
+            if i == i_end:
+                break
+
+            start = i
+
+            # Find the end of this run of changes.
+            i += 1
+            while ch[i + 1]:
+                i += 1
+            while other[j + 1]:
+                j += 1
+
+            while True:
+                # Record the length of this run of changes, so that we can
+                # later determine whether the run has grown.
+                runlength = i - start
+
+                # Move the changed region back, so long as the previous
+                # unchanged line matches the last changed one. This merges
+                # with previous changed regions.
+                while start and eq[start - 1] == eq[i - 1]:
+                    start -= 1
+                    ch[start + 1] = 1
+                    i -= 1
+                    ch[i + 1] = 0
+                    while ch[start]:
+                        start -= 1
+                    j -= 1
+                    while other[j + 1]:
+                        j -= 1
+
+                # Set CORRESPONDING to the end of the changed run, at the
+                # last point where it corresponds to a changed run in the
+                # other file. CORRESPONDING == I_END means no such point has
+                # been found.
+                corresponding = i if other[j] else i_end
+
+                # Move the changed region forward, so long as the first
+                # changed line matches the following unchanged one. This
+                # merges with following changed regions.
+                while i != i_end and eq[start] == eq[i]:
+                    ch[start + 1] = 0
+                    start += 1
+                    ch[i + 1] = 1
+                    i += 1
+                    while ch[i + 1]:
+                        i += 1
+                    j += 1
+                    while other[j + 1]:
+                        corresponding = i
+                        j += 1
+
+                if runlength == i - start:
+                    break
+
+            # If possible, move the fully-merged run of changes back to a
+            # corresponding run in the other file.
+            while corresponding < i:
+                start -= 1
+                ch[start + 1] = 1
+                i -= 1
+                ch[i + 1] = 0
+                j -= 1
+                while other[j + 1]:
+                    j -= 1
+
+
+def _build_script(changed, n0, n1):
+    """
+    Return a list of (line0, line1, deleted, inserted) tuples.
+    """
+
+    ch0, ch1 = changed
+    i0, i1 = n0, n1
+    script = []
+
+    while i0 >= 0 or i1 >= 0:
+        if ch0[i0] or ch1[i1]:
+            line0, line1 = i0, i1
+            while ch0[i0]:
+                i0 -= 1
+            while ch1[i1]:
+                i1 -= 1
+            script.append((i0, i1, line0 - i0, line1 - i1))
+        i0 -= 1
+        i1 -= 1
+
+    script.reverse()
+
+    return script
+
+
+def find_changes(lines1, lines2, horizon=0, max_cost=None):
+    """
+    Return a list of (line1, line2, deleted, inserted) tuples describing the
+    changes between the two lists of lines, as found by diff(1).
+
+    `horizon` is the number of identical lines at either end that diff(1)
+    considers (typically the number of lines of context).
+
+    Raises TooExpensive if `max_cost` is given and exceeded.
+    """
+
+    n1, n2 = len(lines1), len(lines2)
+
+    # Discard the identical prefix and suffix, except for the last `horizon`
+    # lines of each.
+    prefix = 0
+    limit = min(n1, n2)
+    while prefix < limit and lines1[prefix] == lines2[prefix]:
+        prefix += 1
+    prefix = max(0, prefix - horizon)
+
+    suffix = 0
+    limit -= prefix
+    while (
+        suffix < limit and lines1[n1 - suffix - 1] == lines2[n2 - suffix - 1]
+    ):
+        suffix += 1
+    suffix = max(0, suffix - horizon)
+
+    # Map each line to an equivalence class
+    classes = {}
+    equivs = []
+    counts = []
+    for lines, end in ((lines1, n1), (lines2, n2)):
+        xs = [
+            classes.setdefault(x, len(classes))
+            for x in lines[prefix : end - suffix]
+        ]
+        count = {}
+        for x in xs:
+            count[x] = count.get(x, 0) + 1
+        equivs.append(xs)
+        counts.append(count)
+
+    discards = _discard_confusing_lines(equivs, counts)
+
+    changed = []
+    undiscarded = []
+    realindexes = []
+    for eq, marks in zip(equivs, discards):
+        ch = bytearray(len(eq) + 2)
+        undiscarded.append([x for x, y in zip(eq, marks) if not y])
+        realindexes.append([i for i, y in enumerate(marks) if not y])
+        for i, y in enumerate(marks):
+            if y:
+                ch[i + 1] = 1
+        changed.append(ch)
+
+    deleted, inserted = compare_sequences(*undiscarded, max_cost)
+    for x in deleted:
+        changed[0][realindexes[0][x] + 1] = 1
+    for x in inserted:
+        changed[1][realindexes[1][x] + 1] = 1
+
+    _shift_boundaries(equivs, changed)
+
+    return [
+        (line1 + prefix, line2 + prefix, deleted, inserted)
+        for line1, line2, deleted, inserted in _build_script(
+            changed, len(equivs[0]), len(equivs[1])
+        )
+    ]
+
+
+def _format_range(first, last):
+    # Line numbers are 1-based; for empty ranges diff(1) prints the number of
+    # the line before the range.
+    if last < first:
+        return b"%d,0" % (last + 1)
+    if last == first:
+        return b"%d" % (first + 1)
+    return b"%d,%d" % (first + 1, last - first + 1)
+
+
+def unified_diff(lines1, lines2, context, max_cost=None):
+    """
+    Yield the hunks of the unified diff between the two lists of lines as
+    `diff -U<context>` would print them, without the file headers.
+
+    Each hunk is a (header, lines) tuple where `lines` is a list of
+    (prefix, line) tuples. `prefix` is one of b" ", b"-", b"+" or b"\\\\" (for
+    the "No newline at end of file" marker) and `line` has its line ending
+    stripped.
+
+    All changes are computed before the first hunk is yielded, so
+    TooExpensive is raised (if at all) by the first call to next().
+    """
+
+    changes = find_changes(lines1, lines2, context, max_cost)
+
+    yield from unified_hunks(changes, lines1, lines2, context)
+
+
+def unified_hunks(changes, lines1, lines2, context):
+    """
+    Yield the hunks of a unified diff, as unified_diff() does, given the
+    changes between the lines as returned by find_changes().
+
+    `lines1` and `lines2` may be any sequences; only the lines within hunks
+    are retrieved from them.
+    """
+
+    n1, n2 = len(lines1), len(lines2)
+
+    idx = 0
+    while idx < len(changes):
+        # Find the last change in this hunk: one which is followed by a gap
+        # of more than 2 * context unchanged lines.
+        end = idx
+        while end + 1 < len(changes):
+            line1, _, deleted, _ = changes[end]
+            if changes[end + 1][0] - (line1 + deleted) > 2 * context:
+                break
+            end += 1
+        hunk = changes[idx : end + 1]
+        idx = end + 1
+
+        first1 = max(hunk[0][0] - context, 0)
+        first2 = max(hunk[0][1] - context, 0)
+        last1 = min(hunk[-1][0] + hunk[-1][2] - 1 + context, n1 - 1)
+        last2 = min(hunk[-1][1] + hunk[-1][3] - 1 + context, n2 - 1)
+
+        header = b"@@ -%s +%s @@" % (
+            _format_range(first1, last1),
+            _format_range(first2, last2),
+        )
+
+        out = []
+
+        def emit(prefix, line):
+            if line[-1:] == b"\n":
+                out.append((prefix, line[:-1]))
+            else:
+                out.append((prefix, line))
+                out.append((b"\\", b" No newline at end of file"))
+
+        i, j = first1, first2
+        changes_iter = iter(hunk)
+        change = next(changes_iter, None)
+        while i <= last1 or j <= last2:
+            if change is None or i < change[0]:
+                emit(b" ", lines1[i])
+                i += 1
+                j += 1
+                continue
+            _, _, deleted, inserted = change
+            for _ in range(deleted):
+                emit(b"-", lines1[i])
+                i += 1
+            for _ in range(inserted):
+                emit(b"+", lines2[j])
+                j += 1
+            change = next(changes_iter, None)
+
+        yield header, out
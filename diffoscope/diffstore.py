@@ -0,0 +1,144 @@
+#
+# diffoscope: in-depth comparison of files, archives, and directories
+#
+# Copyright © 2022 Chris Lamb <lamby@debian.org>
+#
+# diffoscope is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# diffoscope is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with diffoscope.  If not, see <https://www.gnu.org/licenses/>.
+
+import os
+import mmap
+import codecs
+import logging
+import threading
+
+from .tempfiles import get_named_temporary_file
+
+# Diffs at least this large (in bytes, or characters if passed as a str) are
+# kept on disk rather than in memory.
+SPILL_MIN_SIZE = 2**16
+
+DECODE_CHUNK = 2**20
+
+logger = logging.getLogger(__name__)
+
+_LOCK = threading.Lock()
+_STORE = None
+
+
+class DiffStore:
+    """
+    An append-only temporary file of diffs that are read back via mmap(2).
+    """
+
+    def __init__(self):
+        # The file is removed by clean_all_temp_files() at the end of the run
+        self.file = get_named_temporary_file(prefix="diffs_", delete=False)
+        self.size = 0
+        self.lock = threading.Lock()
+
+        logger.debug("Storing large diffs in %s", self.file.name)
+
+    def is_valid(self):
+        return os.path.exists(self.file.name)
+
+    def append(self, data):
+        with self.lock:
+            offset = self.size
+            self.file.write(data)
+            self.size += len(data)
+        return offset
+
+    def read(self, offset, length):
+        with self.lock:
+            self.file.flush()
+
+        # Only map the region we need, and only while we need it, so that
+        # its pages do not remain part of our resident set afterwards.
+        start = offset - offset % mmap.ALLOCATIONGRANULARITY
+        with mmap.mmap(
+            self.file.fileno(),
+            offset + length - start,
+            access=mmap.ACCESS_READ,
+            offset=start,
+        ) as m:
+            return m[offset - start :]
+
+
+class StoredDiff:
+    """
+    A reference to a diff in a DiffStore. Its len() is that of the decoded
+    diff so that it can be sized without reading it back.
+    """
+
+    __slots__ = ("store", "offset", "length", "size")
+
+    def __init__(self, store, offset, length, size):
+        self.store = store
+        self.offset = offset
+        self.length = length
+        self.size = size
+
+    def __len__(self):
+        return self.size
+
+    def __str__(self):
+        return self.store.read(self.offset, self.length).decode(
+            "utf-8", errors="replace"
+        )
+
+
+def get_store():
+    global _STORE
+
+    with _LOCK:
+        # Start a new file if the last one was cleaned up (eg. between runs)
+        if _STORE is None or not _STORE.is_valid():
+            _STORE = DiffStore()
+        return _STORE
+
+
+def count_chars(data):
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    view = memoryview(data)
+
+    result = 0
+    for x in range(0, len(view), DECODE_CHUNK):
+        result += len(decoder.decode(view[x : x + DECODE_CHUNK]))
+    return result + len(decoder.decode(b"", final=True))
+
+
+def store_diff(data):
+    """
+    Return the diff `data` (a str or bytes-like object in UTF-8) as a str or,
+    if it is large, as a StoredDiff.
+    """
+
+    if data is None or isinstance(data, StoredDiff):
+        return data
+
+    if len(data) < SPILL_MIN_SIZE:
+        if isinstance(data, str):
+            return data
+        return str(data, "utf-8", errors="replace")
+
+    if isinstance(data, str):
+        size = len(data)
+        data = data.encode("utf-8", errors="replace")
+    else:
+        size = count_chars(data)
+
+    store = get_store()
+    offset = store.append(data)
+
+    return StoredDiff(store, offset, len(data), size)
@@ -30,15 +30,176 @@ logger = logging.getLogger(__name__)
 
 DIFF_CHUNK = 4096
 
+re_quantifier = re.compile(r"([*+?]|\{\d*(?:,\d*)?\})[?+]?")
 
-@functools.lru_cache(maxsize=128)
-def compile_string_regex(regex_str):
-    return re.compile(regex_str)
+# A mask cannot match across lines (or differently at the start or end of
+# one) unless it contains one of these.
+re_multiline_unsafe = re.compile(r"[\x00-\x1f]|\[\^|\\[^dwb\W]|\(\?[^:P]")
 
 
-@functools.lru_cache(maxsize=128)
-def compile_bytes_regex(regex_str):
-    return re.compile(regex_str.encode("utf-8"))
+def required_literal(pattern):
+    """
+    Return the longest string that every match of the regular expression
+    `pattern` must contain, or None if there is no such string (or it is not
+    straightforward to find).
+    """
+
+    # Flags such as (?i) or (?x) change what the literals would match
+    if re.search(r"\(\?[aiLmsux]", pattern):
+        return None
+
+    best, current = "", ""
+    i = 0
+
+    while i < len(pattern):
+        c = pattern[i]
+        quantifier = re_quantifier.match(pattern, i)
+
+        if c == "\\":
+            escaped = pattern[i + 1 : i + 2]
+            if escaped in ("x", "u", "U", "N") or escaped.isdigit():
+                # We would need to decode these
+                return None
+            if escaped.isalnum() or escaped == "_":
+                # eg. \d or \b
+                best, current = max(best, current, key=len), ""
+            else:
+                current += escaped
+            i += 2
+        elif c == "|":
+            return None
+        elif c in "([":
+            # Nothing in a group or character class is required
+            best, current = max(best, current, key=len), ""
+            i = skip_brackets(pattern, i)
+        elif quantifier:
+            # The previous character may not appear, or be repeated
+            if quantifier.group(1) != "+":
+                current = current[:-1]
+            best, current = max(best, current, key=len), ""
+            i = quantifier.end()
+        elif c in ".^$":
+            best, current = max(best, current, key=len), ""
+            i += 1
+        else:
+            current += c
+            i += 1
+
+    return max(best, current, key=len) or None
+
+
+def skip_brackets(pattern, i):
+    """
+    Return the offset of the end of the group or character class starting at
+    offset `i` in `pattern`.
+    """
+
+    if pattern[i] == "[":
+        i += 1
+        if pattern[i : i + 1] == "^":
+            i += 1
+        # "]" is literal at the start of a class
+        if pattern[i : i + 1] == "]":
+            i += 1
+        while i < len(pattern) and pattern[i] != "]":
+            i += 2 if pattern[i] == "\\" else 1
+        return i + 1
+
+    depth = 0
+    while i < len(pattern):
+        if pattern[i] == "\\":
+            i += 2
+            continue
+        if pattern[i] == "[":
+            i = skip_brackets(pattern, i)
+            continue
+        if pattern[i] == "(":
+            depth += 1
+        elif pattern[i] == ")":
+            depth -= 1
+            if not depth:
+                break
+        i += 1
+    return i + 1
+
+
+class DiffMasks:
+    """
+    The --diff-mask regular expressions, compiled to filter str (or bytes)
+    lines.
+
+    Rather than applying every mask to every line, chunks of lines are first
+    checked for anything that any mask could match (see filter_chunk). The
+    masks are then only applied to the lines of chunks that do.
+    """
+
+    # The size of the chunks of lines that are checked at once
+    CHUNK_SIZE = 2**16
+
+    def __init__(self, patterns, text):
+        def convert(x):
+            return x if text else x.encode("utf-8")
+
+        self.empty = convert("")
+        self.replace = convert("[masked]")
+        self.regexes = [re.compile(convert(x)) for x in patterns]
+
+        # How to check whether any line in a chunk may match each mask:
+        # search the whole chunk at once if the mask cannot match across
+        # lines, otherwise look for a literal that every match contains.
+        self.checks = []
+        for pattern, regex in zip(patterns, self.regexes):
+            literal = required_literal(pattern)
+            if not re_multiline_unsafe.search(pattern):
+                check = re.compile(convert(pattern), re.MULTILINE).search
+            elif literal is not None:
+                check = functools.partial(contains, convert(literal))
+            else:
+                check = None
+            self.checks.append((check, regex))
+
+    def sub(self, buf):
+        for regex in self.regexes:
+            buf = regex.sub(self.replace, buf)
+
+        return buf
+
+    def filter_chunk(self, chunk):
+        """
+        Apply the masks to a list of (line, buf) tuples, where each buf ends
+        in a newline (except perhaps the last).
+        """
+
+        joined = self.empty.join(x for _, x in chunk)
+        candidates = [
+            regex
+            for check, regex in self.checks
+            if check is None or check(joined)
+        ]
+        if not candidates:
+            return chunk
+
+        # A line that no mask matches is left as it is. Otherwise, every mask
+        # is applied in turn (as before) as one may match what another has
+        # replaced.
+        return [
+            (
+                line,
+                self.sub(buf)
+                if buf and any(x.search(buf) for x in candidates)
+                else buf,
+            )
+            for line, buf in chunk
+        ]
+
+
+def contains(literal, buf):
+    return literal in buf
+
+
+@functools.lru_cache(maxsize=16)
+def compile_masks(patterns, text):
+    return DiffMasks(patterns, text)
 
 
 def filter_reader(buf, additional_filter=None):
@@ -47,21 +208,54 @@ def filter_reader(buf, additional_filter=None):
         buf = additional_filter(buf)
 
     # No need to work on empty lines
-    if not buf:
+    if not buf or not Config().diff_masks:
         return buf
 
     # Use either str or bytes objects depending on buffer type
-    if isinstance(buf, str):
-        compile_func = compile_string_regex
-        replace = "[masked]"
-    else:
-        compile_func = compile_bytes_regex
-        replace = b"[masked]"
+    masks = compile_masks(tuple(Config().diff_masks), isinstance(buf, str))
+
+    return masks.sub(buf)
+
+
+def filter_lines(lines, additional_filter=None):
+    """
+    Yield (line, filter_reader(line, additional_filter)) for each of `lines`,
+    but applying the masks to chunks of lines at a time.
+    """
 
-    for regex in Config().diff_masks:
-        buf = compile_func(regex).sub(replace, buf)
+    if not Config().diff_masks:
+        for line in lines:
+            yield line, filter_reader(line, additional_filter)
+        return
 
-    return buf
+    def flush(chunk):
+        text = [isinstance(x, str) for _, x in chunk if x]
+        if not text:
+            return chunk
+        masks = compile_masks(tuple(Config().diff_masks), text[0])
+        return masks.filter_chunk(chunk)
+
+    chunk, size = [], 0
+    for line in lines:
+        buf = additional_filter(line) if additional_filter else line
+        chunk.append((line, buf))
+        size += len(buf)
+
+        # A line without a newline would run into the next one
+        if size >= DiffMasks.CHUNK_SIZE or buf[-1:] not in ("\n", b"\n"):
+            yield from flush(chunk)
+            chunk, size = [], 0
+
+    yield from flush(chunk)
+
+
+def iter_lines(content):
+    newline = "\n" if isinstance(content, str) else b"\n"
+    offset = 0
+    while offset < len(content):
+        end = content.find(newline, offset) + 1 or len(content)
+        yield content[offset:end]
+        offset = end
 
 
 def from_raw_reader(in_file, filter=None):
@@ -76,9 +270,8 @@ def from_raw_reader(in_file, filter=None):
         if max_lines < float("inf"):
             h = hashlib.sha256()
 
-        for buf in in_file:
+        for buf, out in filter_lines(in_file, filter):
             line_count += 1
-            out = filter_reader(buf, filter)
 
             if h is not None:
                 h.update(out)
@@ -121,19 +314,28 @@ def from_text_reader(in_file, filter=None):
 
 def from_operation(operation):
     def feeder(out_file):
+        # Keep the start of the output in case we need to report an error
+        head = []
+
+        def lines():
+            for x in operation.iter_output():
+                if len(head) < 2:
+                    head.append(x)
+                yield x
+
         with profile("command", operation.name):
-            feeder = from_raw_reader(operation.output, operation.filter)
+            feeder = from_raw_reader(lines(), operation.filter)
             end_nl = feeder(out_file)
 
         if operation.should_show_error():
             # On error, default to displaying all lines of the error
             output = operation.error_string or ""
-            if not output and operation.output:
+            if not output and head:
                 # ... but if we don't have, return the first line of the
                 # standard output.
                 output = "{}{}".format(
-                    operation.output[0].decode("utf-8", "ignore").strip(),
-                    "\n[…]" if len(operation.output) > 1 else "",
+                    head[0].decode("utf-8", "ignore").strip(),
+                    "\n[…]" if len(head) > 1 else "",
                 )
             raise subprocess.CalledProcessError(
                 operation.returncode,
@@ -151,8 +353,16 @@ def from_text(content):
     """
 
     def feeder(f):
-        for offset in range(0, len(content), DIFF_CHUNK):
-            buf = filter_reader(content[offset : offset + DIFF_CHUNK])
+        if Config().diff_masks:
+            # Masks apply to lines, so do not split them
+            bufs = (x for _, x in filter_lines(iter_lines(content)))
+        else:
+            bufs = (
+                content[offset : offset + DIFF_CHUNK]
+                for offset in range(0, len(content), DIFF_CHUNK)
+            )
+
+        for buf in bufs:
             if isinstance(buf, str):
                 f.write(buf.encode("utf-8"))
             else:
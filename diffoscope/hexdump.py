@@ -0,0 +1,158 @@
+#
+# diffoscope: in-depth comparison of files, archives, and directories
+#
+# Copyright © 2022 Chris Lamb <lamby@debian.org>
+#
+# diffoscope is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# diffoscope is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with diffoscope.  If not, see <https://www.gnu.org/licenses/>.
+
+import os
+import mmap
+import binascii
+import contextlib
+
+from . import diffseq
+from .diff import join_hunks
+from .config import Config
+from .profiling import profile
+
+# As xxd(1) with its default options
+BYTES_PER_LINE = 16
+
+# Compare files in blocks of this many bytes, and only then line-by-line
+BLOCK_SIZE = 2**16
+
+# Map unprintable bytes to "." as xxd(1) does
+PRINTABLE = bytes(x if 0x20 <= x < 0x7F else ord(".") for x in range(256))
+
+
+class Hexdump:
+    """
+    The lines that xxd(1) would output for `data`, formatted on demand.
+    """
+
+    def __init__(self, data):
+        self.data = data
+
+    def __len__(self):
+        return -(-len(self.data) // BYTES_PER_LINE)
+
+    def __getitem__(self, idx):
+        offset = idx * BYTES_PER_LINE
+        buf = self.data[offset : offset + BYTES_PER_LINE]
+        hexed = binascii.hexlify(buf)
+
+        return b"%08x: %-39s  %s\n" % (
+            offset,
+            b" ".join(hexed[x : x + 4] for x in range(0, len(hexed), 4)),
+            buf.translate(PRINTABLE),
+        )
+
+
+def is_supported(path1, path2):
+    """
+    Whether diff_hexdumps() would return the same as comparing the output of
+    xxd(1) on each file.
+    """
+
+    # Masks may make lines identical, and commands may be excluded
+    if Config().diff_masks or Config().exclude_commands:
+        return False
+
+    for x in (path1, path2):
+        if x == "/dev/null":
+            continue
+        if not os.path.isfile(x):
+            return False
+        # Leave adding the "Too much input" line to the usual feeders
+        lines = -(-os.path.getsize(x) // BYTES_PER_LINE)
+        if lines >= Config().max_diff_input_lines:
+            return False
+
+    return True
+
+
+@contextlib.contextmanager
+def open_mmap(path):
+    if path == "/dev/null" or not os.path.getsize(path):
+        yield b""
+        return
+
+    with open(path, "rb") as f, mmap.mmap(
+        f.fileno(), 0, access=mmap.ACCESS_READ
+    ) as m:
+        yield m
+
+
+def find_changes(data1, data2):
+    """
+    Return the changes between the lines of the hexdumps of `data1` and
+    `data2` in the form returned by diffseq.find_changes().
+
+    As each line starts with its offset, lines can only match the line at the
+    same offset in the other file. (diff(1) discards every other line as it
+    has no counterpart, so this is also what it would find.)
+    """
+
+    changes = []
+    n1, n2 = len(Hexdump(data1)), len(Hexdump(data2))
+
+    def add(line):
+        # Extend the previous change if it ends at this line
+        if changes and changes[-1][0] + changes[-1][2] == line:
+            changes[-1][2] += 1
+            changes[-1][3] += 1
+        else:
+            changes.append([line, line, 1, 1])
+
+    size = min(len(data1), len(data2))
+    for offset in range(0, size, BLOCK_SIZE):
+        end = offset + BLOCK_SIZE
+        if data1[offset:end] == data2[offset:end]:
+            continue
+        for x in range(offset, min(end, size), BYTES_PER_LINE):
+            y = x + BYTES_PER_LINE
+            if data1[x:y] != data2[x:y]:
+                add(x // BYTES_PER_LINE)
+
+    # Lines beyond the end of the shorter file (including its last line if
+    # it is partial and so was compared above) are only in one of them.
+    common = min(n1, n2)
+    if n1 != n2:
+        if changes and changes[-1][0] + changes[-1][2] == common:
+            line = changes.pop()[0]
+        else:
+            line = common
+        changes.append([line, line, n1 - line, n2 - line])
+
+    return [tuple(x) for x in changes]
+
+
+def diff_hexdumps(path1, path2):
+    """
+    Return the same diff as comparing the output of xxd(1) on each file
+    (see is_supported), or None if they are identical, but only formatting
+    the lines that are part of the diff.
+    """
+
+    with profile("diff", "hexdump"), open_mmap(path1) as data1, open_mmap(
+        path2
+    ) as data2:
+        changes = find_changes(data1, data2)
+        if not changes:
+            return None
+
+        hunks = diffseq.unified_hunks(
+            changes, Hexdump(data1), Hexdump(data2), Config().diff_context
+        )
+        return join_hunks(hunks, True)
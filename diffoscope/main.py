@@ -49,6 +49,7 @@ from .external_tools import EXTERNAL_TOOLS, HUGE_TOOLS
 from .presenters.html import JQUERY_SYSTEM_LOCATIONS
 from .presenters.formats import PresenterManager
 from .comparators.utils.compare import compare_root_paths
+from .comparators.utils.parallel import shutdown_executor
 from .readers import load_diff, load_diff_from_path
 
 logger = logging.getLogger(__name__)
@@ -178,6 +179,14 @@ def create_parser():
         dest="json_output",
         help="Write JSON text output to given file (use - for stdout)",
     )
+    group1.add_argument(
+        "--binary-output",
+        metavar="OUTPUT_FILE",
+        dest="binary_output",
+        help="Write a compact binary report to given file (use - for "
+        "stdout). Unlike --json, it can be loaded with --load-existing-diff "
+        "without reading all of it into memory.",
+    )
     group1.add_argument(
         "--markdown",
         metavar="OUTPUT_FILE",
@@ -206,12 +215,24 @@ def create_parser():
         default=None,
         help="Write profiling info to given file (use - for stdout)",
     )
+    group1.add_argument(
+        "--profile-format",
+        metavar="FORMAT",
+        dest="profile_format",
+        choices=("text", "chrome", "folded"),
+        default="text",
+        help="Format of --profile output: a plain-text summary (text), "
+        "trace-event JSON for chrome://tracing or Perfetto (chrome) or "
+        "folded stacks for flamegraph.pl (folded). (default: %(default)s)",
+    )
     parser.add_argument(
         "--load-existing-diff",
         metavar="INPUT_FILE",
         action=LoadExistingDiffAction,
         dest="load_existing_diff",
-        help='Load existing diff from file. Specify "-" to read a diffoscope diff from stdin.',
+        help="Load existing diff from file, as written by --json or "
+        '--binary-output. Specify "-" to read a diffoscope JSON diff from '
+        "stdin.",
     )
 
     group2 = parser.add_argument_group("output limits")
@@ -357,6 +378,19 @@ def create_parser():
         "(0 to disable, default: %d)" % Config().max_diff_input_lines,
         default=None,
     ).completer = RangeCompleter(Config().max_diff_input_lines)
+    group3.add_argument(
+        "--diff-engine",
+        metavar="ENGINE",
+        choices=("auto", "python", "gnu"),
+        default=Config().diff_engine,
+        help="How to compute line-based differences. 'python' compares "
+        "inputs in-process, 'gnu' runs diff(1) on each pair of inputs and "
+        "'auto' compares in-process unless the inputs are large or "
+        "expensive to compare. Unless 'gnu' is specified, binary files are "
+        "also compared in-process rather than via xxd(1). ENGINE is one of "
+        "{%(choices)s}. The output is identical in all cases. "
+        "(default: %(default)s)",
+    )
     group3.add_argument(
         "--max-container-depth",
         metavar="DEPTH",
@@ -375,6 +409,57 @@ def create_parser():
         "seconds of total execution time. (default: no timeout) [experimental]",
         default=float("inf"),
     )
+    group3.add_argument(
+        "--jobs",
+        "-j",
+        metavar="JOBS",
+        type=int,
+        help="Number of archive members to compare concurrently. Most of the "
+        "time is spent in external tools so this can speed up comparisons of "
+        "large archives and directories considerably. Also the number of "
+        "processes used to lay out tables in HTML output. Output is "
+        "identical regardless of this setting. (0 to use all available CPUs, "
+        "default: %(default)s)",
+        default=Config().jobs,
+    )
+    group3.add_argument(
+        "--max-subprocesses",
+        metavar="N",
+        type=int,
+        help="Maximum number of external commands (eg. readelf, objdump) to "
+        "run at once across all --jobs. Both sides of a comparison, and "
+        "independent commands on the same file, are run concurrently up to "
+        "this limit, which is never less than --jobs. (0 to use all "
+        "available CPUs, default: %(default)s)",
+        default=Config().max_subprocesses,
+    )
+    group3.add_argument(
+        "--stream",
+        default=False,
+        action="store_true",
+        help="Output differences whilst still comparing files, so that "
+        "memory use does not grow with the size of the report. Not "
+        "supported with HTML output or --jobs. Errors extracting an archive "
+        "member are then reported as a comment rather than by falling back "
+        "to a binary diff of the archive. Default: %(default)s",
+    )
+    group3.add_argument(
+        "--cache-dir",
+        metavar="DIR",
+        help="Cache the results of file comparisons in DIR, keyed on the "
+        "contents and names of both files, any options that affect the "
+        "result and the external tools that are installed. Subsequent runs "
+        "skip comparing files they have already seen. (default: no cache)",
+        default=Config().cache_dir,
+    )
+    group3.add_argument(
+        "--cache-max-size",
+        metavar="BYTES",
+        type=int,
+        help="Maximum size of --cache-dir before the least-recently used "
+        "entries are evicted. (default: %(default)s)",
+        default=Config().cache_max_size,
+    )
     group3.add_argument(
         "--max-diff-block-lines-saved",
         metavar="LINES",
@@ -405,6 +490,15 @@ def create_parser():
         "even if files have the same content, only really "
         "useful for debugging diffoscope. Default: %(default)s",
     )
+    group3.add_argument(
+        "--trust-zip-crc32",
+        default=False,
+        action="store_true",
+        help="Assume that .zip archive members whose CRC32 checksums and "
+        "sizes match are identical instead of comparing their contents. "
+        "This is faster, but members that differ only in ways that CRC32 "
+        "cannot detect are then not reported. Default: %(default)s",
+    )
 
     group4 = parser.add_argument_group("information commands")
     group4.add_argument(
@@ -471,6 +565,8 @@ def create_parser():
                 f
                 for x in group3._group_actions
                 if getattr(parsed_args, x.dest) != x.default
+                # --jobs is also used when generating HTML output
+                and x.dest != "jobs"
                 for f in x.option_strings
             ]
             if ineffective_flags:
@@ -630,6 +726,7 @@ def configure(parsed_args):
             setattr(Config(), x, float("inf"))
 
     Config().diff_context = parsed_args.diff_context
+    Config().diff_engine = parsed_args.diff_engine
     Config().max_page_size = parsed_args.max_page_size
     Config().max_page_diff_block_lines = parsed_args.max_page_diff_block_lines
 
@@ -637,9 +734,19 @@ def configure(parsed_args):
     Config().new_file = parsed_args.new_file
     Config().use_dbgsym = parsed_args.use_dbgsym
     Config().force_details = parsed_args.force_details
+    Config().trust_zip_crc32 = parsed_args.trust_zip_crc32
     Config().fuzzy_threshold = parsed_args.fuzzy_threshold
     Config().timeout = parsed_args.timeout
     Config().max_container_depth = parsed_args.max_container_depth
+    Config().jobs = parsed_args.jobs or os.cpu_count() or 1
+    Config().max_subprocesses = (
+        parsed_args.max_subprocesses or os.cpu_count() or 1
+    )
+    Config().cache_dir = parsed_args.cache_dir
+    Config().cache_max_size = parsed_args.cache_max_size
+    if Config().difftool is not None and Config().jobs > 1:
+        logger.warning("--difftool is interactive; ignoring --jobs")
+        Config().jobs = 1
 
     Config().excludes = parsed_args.excludes
     Config().exclude_commands = parsed_args.exclude_commands
@@ -652,6 +759,17 @@ def configure(parsed_args):
     Config().diff_masks = parsed_args.diff_masks
 
     Config().compute_visual_diffs = PresenterManager().compute_visual_diffs()
+    # Comparing members ahead of time (see --jobs) would keep the comparisons
+    # of their parents suspended out of order.
+    Config().streaming = parsed_args.stream
+    if Config().streaming and Config().jobs > 1:
+        logger.warning("--stream is not supported with --jobs; ignoring")
+        Config().streaming = False
+    elif Config().streaming and not PresenterManager().supports_streaming():
+        logger.warning(
+            "--stream is not supported with these output formats; ignoring"
+        )
+        Config().streaming = False
 
     tool_prepend_prefix(
         parsed_args.tool_prefix_binutils,
@@ -715,7 +833,19 @@ def run_diffoscope(parsed_args):
         with Progress():
             with profile("main", "outputs"):
                 difference = compare_root_paths(path1, path2)
+            # When streaming, most of the comparison happens as the
+            # differences are output, so continue to report progress.
+            if Config().streaming:
+                retcode = output_difference(
+                    parsed_args, path1, path2, difference
+                )
         ProgressManager().finish()
+        if Config().streaming:
+            return retcode
+    return output_difference(parsed_args, path1, path2, difference)
+
+
+def output_difference(parsed_args, path1, path2, difference):
     # Generate an empty, null diff to write, saving the exit code first.
     has_differences = bool(difference is not None)
     if difference is None and parsed_args.output_empty:
@@ -786,6 +916,11 @@ def main(args=None):
         Config().reset()
 
         with profile("main", "cleanup"):
+            shutdown_executor()
+            # Imported here as it requires libarchive
+            from .comparators.deb import BuildIdIndex
+
+            BuildIdIndex().clear()
             clean_all_temp_files()
 
         # Print profiling output at the very end
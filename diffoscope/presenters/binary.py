@@ -0,0 +1,169 @@
+#
+# diffoscope: in-depth comparison of files, archives, and directories
+#
+# Copyright © 2022 Chris Lamb <lamby@debian.org>
+#
+# diffoscope is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# diffoscope is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with diffoscope.  If not, see <https://www.gnu.org/licenses/>.
+
+import sys
+import struct
+import contextlib
+
+from ..tools import python_module_missing
+
+from .utils import Presenter
+
+try:
+    import zstandard
+except ImportError:  # noqa
+    python_module_missing("zstandard")
+    zstandard = None
+
+# A binary report is laid out as follows (all integers little-endian):
+#
+#   header:   BINARY_FORMAT_MAGIC, u32 version
+#   blobs:    the unified_diff of each node as u8 codec + (compressed) UTF-8
+#   records:  one per node, written after those of its children
+#   index:    u64 offset of each record, indexed by node id
+#   trailer:  u64 offset of the index, u64 number of nodes, u8 codecs used
+#             (with bit 1 << CODEC_* set for each), BINARY_FORMAT_MAGIC
+#
+# Node ids are allocated in the order that records are written, so the root
+# node is always the last. Each record contains:
+#
+#   u8 flags (see FLAG_*), str source1, str source2, u32 number of comments,
+#   str comments..., [u64 blob offset, u64 blob length, u64 length of the
+#   decoded diff in characters], u32 number of children, u64 child ids...
+#
+# ... where each str is a u32 length followed by UTF-8.
+#
+# This allows readers to only load the nodes (and diffs) that they need.
+BINARY_FORMAT_MAGIC = b"diffoscope-binary\0"
+BINARY_FORMAT_VERSION = 1
+
+FLAG_HAS_INTERNAL_LINENOS = 1
+FLAG_HAS_UNIFIED_DIFF = 2
+
+CODEC_NONE = 0
+CODEC_ZSTD = 1
+
+# Only bother compressing diffs at least this large (in bytes)
+COMPRESS_MIN_SIZE = 2**12
+
+HEADER = struct.Struct("<I")
+TRAILER = struct.Struct("<QQB")
+U8 = struct.Struct("<B")
+U32 = struct.Struct("<I")
+U64 = struct.Struct("<Q")
+BLOB = struct.Struct("<QQQ")
+
+
+def pack_str(val):
+    val = val.encode("utf-8")
+    return U32.pack(len(val)) + val
+
+
+class BinaryPresenter(Presenter):
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.offset = 0
+        # Offsets of the records we have written, indexed by node id
+        self.index = []
+        # Which codecs we have used (see TRAILER)
+        self.codecs = 0
+        # For each node we are inside: its diff (as a list of chunks, and
+        # then the location of the blob) and the ids of its children.
+        self.stack = []
+
+        self.write(BINARY_FORMAT_MAGIC + HEADER.pack(BINARY_FORMAT_VERSION))
+
+        super().__init__()
+
+    @classmethod
+    @contextlib.contextmanager
+    def open(cls, data, parsed_args):
+        if data["target"] == "-":
+            yield cls(sys.stdout.buffer)
+            return
+
+        with open(data["target"], "wb") as f:
+            yield cls(f)
+
+    def write(self, val):
+        offset = self.offset
+        self.fileobj.write(val)
+        self.offset += len(val)
+        return offset
+
+    def enter(self, difference):
+        if self.stack:
+            self.write_diff()
+        self.stack.append([None, []])
+
+    def diff(self, difference, chunk):
+        frame = self.stack[-1]
+        if frame[0] is None:
+            frame[0] = []
+        frame[0].append(chunk)
+
+    def write_diff(self):
+        frame = self.stack[-1]
+        if not isinstance(frame[0], list):
+            return
+
+        val = "".join(frame[0])
+        data = val.encode("utf-8")
+        codec = CODEC_NONE
+        if zstandard is not None and len(data) >= COMPRESS_MIN_SIZE:
+            codec = CODEC_ZSTD
+            data = zstandard.ZstdCompressor().compress(data)
+
+        self.codecs |= 1 << codec
+        offset = self.write(U8.pack(codec) + data)
+        frame[0] = BLOB.pack(offset, len(data) + 1, len(val))
+
+    def exit(self, difference):
+        self.write_diff()
+        blob, children = self.stack.pop()
+
+        flags = 0
+        if difference.has_internal_linenos:
+            flags |= FLAG_HAS_INTERNAL_LINENOS
+        if blob is not None:
+            flags |= FLAG_HAS_UNIFIED_DIFF
+
+        record = [
+            U8.pack(flags),
+            pack_str(difference.source1),
+            pack_str(difference.source2),
+            U32.pack(len(difference.comments)),
+        ]
+        record.extend(pack_str(x) for x in difference.comments)
+        if blob is not None:
+            record.append(blob)
+        record.append(U32.pack(len(children)))
+        record.extend(U64.pack(x) for x in children)
+
+        self.index.append(self.write(b"".join(record)))
+
+        if self.stack:
+            self.stack[-1][1].append(len(self.index) - 1)
+
+    def finish(self):
+        offset = self.write(b"".join(U64.pack(x) for x in self.index))
+        self.write(
+            TRAILER.pack(offset, len(self.index), self.codecs)
+            + BINARY_FORMAT_MAGIC
+        )
+        self.fileobj.flush()
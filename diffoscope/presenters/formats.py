@@ -18,12 +18,16 @@
 
 import os
 import logging
+import contextlib
 
+from ..config import Config
 from ..profiling import profile
 from ..utils import format_bytes
 
+from .utils import present
 from .text import TextPresenter
 from .json import JSONPresenter
+from .binary import BinaryPresenter
 from .html import HTMLPresenter, HTMLDirectoryPresenter
 from .markdown import MarkdownTextPresenter
 from .restructuredtext import RestructuredTextPresenter
@@ -57,6 +61,10 @@ class PresenterManager:
                 "klass": JSONPresenter,
                 "target": parsed_args.json_output,
             },
+            "binary": {
+                "klass": BinaryPresenter,
+                "target": parsed_args.binary_output,
+            },
             "markdown": {
                 "klass": MarkdownTextPresenter,
                 "target": parsed_args.markdown_output,
@@ -89,9 +97,8 @@ class PresenterManager:
         if difference is None:
             return
 
+        passes, others = [], []
         for name, data in self.config.items():
-            logger.debug("Generating %r output at %r", name, data["target"])
-
             # As a special case for text format, write an empty file instead of
             # an empty diff (with headers including the path). This lets people
             # test if the file is empty.
@@ -101,19 +108,62 @@ class PresenterManager:
                     open(target, "w").close()
                 continue
 
+            if not data["klass"].supports_streaming:
+                others.append(name)
+                continue
+
+            # Otherwise, generate all formats we can from a single traversal
+            # of the tree, unless they would be interleaved in the same file.
+            for names in passes:
+                if all(
+                    self.config[x]["target"] != data["target"] for x in names
+                ):
+                    names.append(name)
+                    break
+            else:
+                passes.append([name])
+
+        for names in passes:
+            logger.debug(
+                "Generating %s output at %s",
+                ", ".join(repr(x) for x in names),
+                ", ".join(repr(self.config[x]["target"]) for x in names),
+            )
+
+            with profile(
+                "output", "+".join(names)
+            ), contextlib.ExitStack() as stack:
+                presenters = [
+                    stack.enter_context(
+                        self.config[x]["klass"].open(
+                            self.config[x], parsed_args
+                        )
+                    )
+                    for x in names
+                ]
+                present(difference, presenters, Config().streaming)
+
+            for x in names:
+                self.log_size(x, self.config[x])
+
+        for name in others:
+            data = self.config[name]
+            logger.debug("Generating %r output at %r", name, data["target"])
             with profile("output", name):
                 data["klass"].run(data, difference, parsed_args)
+            self.log_size(name, data)
 
-            size = "n/a"
-            if os.path.isfile(data["target"]):
-                size = format_bytes(os.path.getsize(data["target"]))
+    def log_size(self, name, data):
+        size = "n/a"
+        if os.path.isfile(data["target"]):
+            size = format_bytes(os.path.getsize(data["target"]))
 
-            logger.debug(
-                "Generated %r output at %r (size: %s)",
-                name,
-                data["target"],
-                size,
-            )
+        logger.debug(
+            "Generated %r output at %r (size: %s)",
+            name,
+            data["target"],
+            size,
+        )
 
     def compute_visual_diffs(self):
         """
@@ -123,3 +173,15 @@ class PresenterManager:
         return any(
             x["klass"].supports_visual_diffs for x in self.config.values()
         )
+
+    def supports_streaming(self):
+        """
+        Only compute differences as they are output if all outputs can
+        present them in that order from a single traversal.
+        """
+
+        targets = [x["target"] for x in self.config.values()]
+
+        return len(set(targets)) == len(targets) and all(
+            x["klass"].supports_streaming for x in self.config.values()
+        )
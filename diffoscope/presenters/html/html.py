@@ -33,6 +33,7 @@
 import base64
 import codecs
 import collections
+import concurrent.futures
 import contextlib
 import hashlib
 import html
@@ -232,7 +233,7 @@ def output_node_frame(ctx, difference, path, indentstr, indentnum, body):
     ).pformatl(indent, header, body)
 
 
-def output_node(ctx, difference, path, indentstr, indentnum):
+def output_node(ctx, difference, path, indentstr, indentnum, rows=None):
     """Returns a tuple (parent, continuation) where
 
     - parent is a PartialString representing the body of the node, including
@@ -241,6 +242,9 @@ def output_node(ctx, difference, path, indentstr, indentnum):
     - continuation is either None or (only in html-dir mode) a function which
       when called with a single integer arg, the maximum size to print, will
       print any remaining "split" pages for unified_diff up to the given size.
+
+    If given, `rows` is a Future for the rows of the unified_diff table (see
+    RowRenderer).
     """
     indent = tuple(indentstr * (indentnum + x) for x in range(3))
     t, cont = PartialString.cont()
@@ -261,7 +265,7 @@ def output_node(ctx, difference, path, indentstr, indentnum):
     ud_cont = None
     if difference.unified_diff:
         ud_cont = HTMLSideBySidePresenter().output_unified_diff(
-            ctx, difference.unified_diff, difference.has_internal_linenos
+            ctx, difference.unified_diff, difference.has_internal_linenos, rows
         )
         udiff = next(ud_cont)
         if isinstance(udiff, PartialString):
@@ -359,6 +363,117 @@ def spl_file_printer(directory, filename, accum):
         yield recording_print_func
 
 
+def output_hunk_header(hunk_off1, hunk_size1, hunk_off2, hunk_size2):
+    return '<tr class="diffhunk">{}</tr>\n'.format(
+        "".join(
+            f'<td colspan="2">Offset {a}, {b} lines modified</td>'
+            for a, b in ((hunk_off1, hunk_size1), (hunk_off2, hunk_size2))
+        )
+    )
+
+
+def output_line(has_internal_linenos, type_name, s1, line1, s2, line2):
+    result = [f'<tr class="diff{type_name}">']
+
+    for s, line, tag in ((s1, line1, "del"), (s2, line2, "ins")):
+        if not s:
+            result.append('<td colspan="2">\xa0</td>')
+            continue
+        if has_internal_linenos:
+            result.append('<td colspan="2" class="diffpresent">')
+        else:
+            result.append(f'<td class="diffline">{line} </td>')
+            result.append('<td class="diffpresent">')
+        result.append(convert(s, ponct=1, tag=tag))
+        result.append("</td>")
+
+    result.append("</tr>\n")
+
+    return "".join(result)
+
+
+def output_side_by_side_rows(unified_diff, has_internal_linenos, max_rows):
+    """
+    Return the rows of the side-by-side table for `unified_diff` (up to
+    `max_rows` of them) as HTML, each with the number of bytes of the diff
+    processed to produce it.
+
+    This only depends on its arguments so it may be called in another process
+    (see RowRenderer).
+    """
+
+    result = []
+    ydiff = SideBySideDiff(unified_diff)
+    for t, args in ydiff.items():
+        if t == "L":
+            row = output_line(has_internal_linenos, *args)
+        elif t == "H":
+            row = output_hunk_header(*args)
+        elif t == "C":
+            row = f'<td colspan="2">{args}</td>\n'
+        else:
+            raise AssertionError()
+        result.append((row, ydiff.bytes_processed))
+        if len(result) >= max_rows:
+            break
+
+    return result
+
+
+class RowRenderer:
+    """
+    Render the side-by-side tables of nodes on a pool of processes ahead of
+    HTMLPresenter.output_difference.
+
+    `nodes` must yield nodes in the order that they will be requested with
+    rows(), although the caller may skip some of them. Only the layout of the
+    tables is done ahead of time; the decisions about which page they go on
+    (and the limits on their size) are still made in order.
+    """
+
+    def __init__(self, nodes, max_rows, jobs):
+        self.nodes = nodes
+        self.max_rows = max_rows
+        self.window = 4 * jobs
+        self.pending = collections.OrderedDict()
+        self.executor = concurrent.futures.ProcessPoolExecutor(jobs)
+
+    def fill(self):
+        while len(self.pending) < self.window:
+            node = next(self.nodes, None)
+            if node is None:
+                return
+            if not node.unified_diff:
+                continue
+            self.pending[node] = self.executor.submit(
+                output_side_by_side_rows,
+                node.unified_diff,
+                node.has_internal_linenos,
+                self.max_rows,
+            )
+
+    def rows(self, node):
+        """
+        Return a Future for the rows of `node`, discarding those of any nodes
+        that were skipped.
+        """
+
+        while True:
+            self.fill()
+            if not self.pending:
+                return None
+            x, future = self.pending.popitem(last=False)
+            if x is node:
+                return future
+            future.cancel()
+
+    def close(self):
+        for x in self.pending.values():
+            x.cancel()
+        self.pending.clear()
+        self.executor.shutdown(wait=True)
+
+
 class HTMLPrintContext(
     collections.namedtuple(
         "HTMLPrintContext",
@@ -398,45 +513,6 @@ class HTMLSideBySidePresenter:
             self.write_memory += line
         self._spl_print_func(line)
 
-    def output_hunk_header(self, hunk_off1, hunk_size1, hunk_off2, hunk_size2):
-        self.spl_print_func('<tr class="diffhunk">')
-
-        for a, b in ((hunk_off1, hunk_size1), (hunk_off2, hunk_size2)):
-            self.spl_print_func(
-                f'<td colspan="2">Offset {a}, {b} lines modified</td>'
-            )
-
-        self.spl_print_func("</tr>\n")
-
-    def output_line(
-        self, has_internal_linenos, type_name, s1, line1, s2, line2
-    ):
-        self.spl_print_func(f'<tr class="diff{type_name}">')
-        try:
-            if s1:
-                if has_internal_linenos:
-                    self.spl_print_func('<td colspan="2" class="diffpresent">')
-                else:
-                    self.spl_print_func(f'<td class="diffline">{line1} </td>')
-                    self.spl_print_func('<td class="diffpresent">')
-                self.spl_print_func(convert(s1, ponct=1, tag="del"))
-                self.spl_print_func("</td>")
-            else:
-                self.spl_print_func('<td colspan="2">\xa0</td>')
-
-            if s2:
-                if has_internal_linenos:
-                    self.spl_print_func('<td colspan="2" class="diffpresent">')
-                else:
-                    self.spl_print_func(f'<td class="diffline">{line2} </td>')
-                    self.spl_print_func('<td class="diffpresent">')
-                self.spl_print_func(convert(s2, ponct=1, tag="ins"))
-                self.spl_print_func("</td>")
-            else:
-                self.spl_print_func('<td colspan="2">\xa0</td>')
-        finally:
-            self.spl_print_func("</tr>\n")
-
     def spl_print_enter(self, print_context, rotation_params):
         # Takes ownership of print_context
         self.spl_print_ctrl = print_context.__exit__, rotation_params
@@ -521,7 +597,9 @@ class HTMLSideBySidePresenter:
         }
         self.spl_print_func(self.error_row)
 
-    def output_unified_diff_table(self, unified_diff, has_internal_linenos):
+    def output_unified_diff_table(
+        self, unified_diff, has_internal_linenos, rows=None
+    ):
         """Output a unified diff <table> possibly over multiple pages.
 
         It is the caller's responsibility to set up self.spl_* correctly.
@@ -532,17 +610,16 @@ class HTMLSideBySidePresenter:
         # We need to memorize what is written in case a new page is created,
         # which will have to host parts of the previous content
         self.write_memory = ""
+        bytes_processed = 0
         try:
-            ydiff = SideBySideDiff(unified_diff)
-            for t, args in ydiff.items():
-                if t == "L":
-                    self.output_line(has_internal_linenos, *args)
-                elif t == "H":
-                    self.output_hunk_header(*args)
-                elif t == "C":
-                    self.spl_print_func(f'<td colspan="2">{args}</td>\n')
-                else:
-                    raise AssertionError()
+            if rows is None:
+                rows = output_side_by_side_rows(
+                    unified_diff, has_internal_linenos, self.max_rows()
+                )
+            else:
+                rows = rows.result()
+            for row, bytes_processed in rows:
+                self.spl_print_func(row)
                 self.spl_rows += 1
                 if not self.check_limits():
                     continue
@@ -557,12 +634,12 @@ class HTMLSideBySidePresenter:
             return
         except DiffBlockLimitReached:
             self.output_limit_reached(
-                "diff block lines", len(unified_diff), ydiff.bytes_processed
+                "diff block lines", len(unified_diff), bytes_processed
             )
             wrote_all = False
         except PrintLimitReached:
             self.output_limit_reached(
-                "report size", len(unified_diff), ydiff.bytes_processed
+                "report size", len(unified_diff), bytes_processed
             )
             wrote_all = False
         finally:
@@ -571,7 +648,19 @@ class HTMLSideBySidePresenter:
             self.write_memory = None
         yield wrote_all
 
-    def output_unified_diff(self, ctx, unified_diff, has_internal_linenos):
+    def max_rows(self):
+        """
+        The most rows that can be output for a diff; check_limits() stops at
+        this point.
+        """
+
+        if self.spl_print_ctrl[1]:
+            return self.max_lines
+        return self.max_lines_parent
+
+    def output_unified_diff(
+        self, ctx, unified_diff, has_internal_linenos, rows=None
+    ):
         self.new_unified_diff()
         rotation_params = None
         if ctx.directory:
@@ -585,7 +674,7 @@ class HTMLSideBySidePresenter:
             self.spl_print_ctrl = None, rotation_params
 
             it = self.output_unified_diff_table(
-                unified_diff, has_internal_linenos
+                unified_diff, has_internal_linenos, rows
             )
             wrote_all = next(it)
             if wrote_all is None:
@@ -639,6 +728,7 @@ class HTMLSideBySidePresenter:
 
 class HTMLPresenter(Presenter):
     supports_visual_diffs = True
+    supports_streaming = False
 
     def __init__(self):
         self.reset()
@@ -722,8 +812,11 @@ class HTMLPresenter(Presenter):
             assert ancestor in path or (
                 ancestor is None and node is root_difference
             )
+            rows = None
+            if renderer is not None and node.unified_diff:
+                rows = renderer.rows(node)
             node_output, node_continuation = output_node(
-                ctx, node, path, "  ", len(path) - 1
+                ctx, node, path, "  ", len(path) - 1, rows
             )
 
             add_to_existing = False
@@ -743,7 +836,7 @@ class HTMLPresenter(Presenter):
                     format(report_current, ","),
                     format(self.report_limit, ","),
                     format(page_current, ","),
-                    format(page_limit, ","),
+                    "n/a" if page_limit is None else format(page_limit, ","),
                     want_to_add,
                 )
                 if report_current + want_to_add > self.report_limit:
@@ -817,16 +910,32 @@ class HTMLPresenter(Presenter):
 
             self.maybe_print(stored, printers, outputs, continuations)
 
+        # With --jobs, lay out the tables of the nodes we will (probably)
+        # visit next in parallel. This visits them in the same order as we do.
+        renderer = None
+        if Config().jobs > 1:
+            renderer = RowRenderer(
+                root_difference.traverse_heapq(smallest_first),
+                Config().max_diff_block_lines
+                if ctx.directory
+                else Config().max_page_diff_block_lines,
+                Config().jobs,
+            )
+
         nodes = root_difference.traverse_heapq(
             smallest_first, yield_score=True
         )
         prune_prev_node_descendants = None
-        while True:
-            try:
-                node, score = nodes.send(prune_prev_node_descendants)
-                prune_prev_node_descendants = process_node(node, score)
-            except StopIteration:
-                break
+        try:
+            while True:
+                try:
+                    node, score = nodes.send(prune_prev_node_descendants)
+                    prune_prev_node_descendants = process_node(node, score)
+                except StopIteration:
+                    break
+        finally:
+            if renderer is not None:
+                renderer.close()
 
         if outputs:
             pprint.pprint(outputs, indent=4)
@@ -919,7 +1028,7 @@ class HTMLPresenter(Presenter):
         self.output_difference(ctx, difference)
 
     @classmethod
-    def run(cls, data, difference, parsed_args):
+    def run(cls, data, difference, parsed_args, consume=False):
         cls().output_html(
             parsed_args.html_output,
             difference,
@@ -930,7 +1039,7 @@ class HTMLPresenter(Presenter):
 
 class HTMLDirectoryPresenter(HTMLPresenter):
     @classmethod
-    def run(cls, data, difference, parsed_args):
+    def run(cls, data, difference, parsed_args, consume=False):
         cls().output_html_directory(
             parsed_args.html_output_directory,
             difference,
@@ -17,35 +17,64 @@
 # along with diffoscope.  If not, see <https://www.gnu.org/licenses/>.
 
 import json
-from collections import OrderedDict
+import contextlib
 
-from .utils import Presenter
+from .utils import Presenter, make_printer
 
 JSON_FORMAT_VERSION = 1
 JSON_FORMAT_MAGIC = "diffoscope-json-version"
 
 
 class JSONPresenter(Presenter):
-    def __init__(self, print_func):
-        self.stack = []
+    """
+    Writes the same JSON that json.dumps() would for a tree of dicts, but
+    incrementally so that the tree need not be held in memory.
+
+    If `write_func` is given, output is written via it as it is generated.
+    Otherwise it is passed to `print_func` as a single line at the end.
+    """
+
+    def __init__(self, print_func, write_func=None):
         self.print_func = print_func
+        self.write_func = write_func
+        self.buf = []
+        # For each node we are inside, the state of its unified_diff (None
+        # for not yet started, True for in progress or False for written)
+        # and whether any details have been written.
+        self.stack = []
 
         super().__init__()
 
-    def start(self, difference):
-        root = []
-        self.stack = [root]
-        super().start(difference)
+    @classmethod
+    @contextlib.contextmanager
+    def open(cls, data, parsed_args):
+        with make_printer(data["target"]) as fn:
+            yield cls(fn, fn.output.write)
 
-        root[0][JSON_FORMAT_MAGIC] = JSON_FORMAT_VERSION
-        root[0].move_to_end(JSON_FORMAT_MAGIC, last=False)
-        self.print_func(json.dumps(root[0]))
+    def finish(self):
+        if self.write_func is None:
+            self.print_func("".join(self.buf))
+            self.buf = []
+        else:
+            self.write_func("\n")
 
-    def visit_difference(self, difference):
-        while self.depth + 1 < len(self.stack):
-            self.stack.pop()
+    def write(self, val):
+        if self.write_func is None:
+            self.buf.append(val)
+        else:
+            self.write_func(val)
 
-        elements = [
+    def enter(self, difference):
+        if self.stack:
+            self.end_diff()
+            parent = self.stack[-1]
+            self.write(", " if parent[1] else ', "details": [')
+            parent[1] = True
+
+        elements = []
+        if not self.stack:
+            elements += [(JSON_FORMAT_MAGIC, JSON_FORMAT_VERSION)]
+        elements += [
             ("source1", difference.source1),
             ("source2", difference.source2),
         ]
@@ -53,12 +82,34 @@ class JSONPresenter(Presenter):
             elements += [("comments", [x for x in difference.comments])]
         if difference.has_internal_linenos:
             elements += [("has_internal_linenos", True)]
-        elements += [("unified_diff", difference.unified_diff)]
 
-        child_differences = []
-        if difference.details:
-            elements += [("details", child_differences)]
+        self.write(
+            '{%s, "unified_diff": '
+            % ", ".join(
+                "{}: {}".format(json.dumps(k), json.dumps(v))
+                for k, v in elements
+            )
+        )
+        self.stack.append([None, False])
+
+    def diff(self, difference, chunk):
+        state = self.stack[-1]
+        if state[0] is None:
+            self.write('"')
+            state[0] = True
+        # Strip the quotes; JSON escaping is per-character so the pieces of a
+        # string can be escaped separately.
+        self.write(json.dumps(chunk)[1:-1])
+
+    def end_diff(self):
+        state = self.stack[-1]
+        if state[0] is None:
+            self.write("null")
+        elif state[0]:
+            self.write('"')
+        state[0] = False
 
-        self.stack[-1].append(OrderedDict(elements))
-        if difference.details:
-            self.stack.append(child_differences)
+    def exit(self, difference):
+        self.end_diff()
+        _, has_details = self.stack.pop()
+        self.write("]}" if has_details else "}")
@@ -38,8 +38,9 @@ class MarkdownTextPresenter(Presenter):
             self.print_func(x)
             self.print_func()
 
-        if difference.unified_diff:
-            self.print_func(self.indent(difference.unified_diff, "    "))
+    def diff(self, difference, chunk):
+        if chunk:
+            self.print_func(self.indent(chunk, "    "))
             self.print_func()
 
     def title(self, val):
@@ -40,10 +40,11 @@ class RestructuredTextPresenter(Presenter):
             self.print_func()
             self.print_func(x)
 
-        if difference.unified_diff:
+    def diff(self, difference, chunk):
+        if chunk:
             self.print_func("::")
             self.print_func()
-            self.print_func(self.indent(difference.unified_diff, "    "))
+            self.print_func(self.indent(chunk, "    "))
             self.print_func()
 
     def title(self, val):
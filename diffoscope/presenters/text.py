@@ -19,6 +19,7 @@
 import re
 import sys
 import logging
+import contextlib
 
 from diffoscope.diff import color_unified_diff
 from diffoscope.config import Config
@@ -46,7 +47,8 @@ class TextPresenter(Presenter):
         super().__init__()
 
     @classmethod
-    def run(cls, data, difference, parsed_args):
+    @contextlib.contextmanager
+    def open(cls, data, parsed_args):
         with make_printer(data["target"]) as fn:
             color = {
                 "auto": fn.output.isatty(),
@@ -54,10 +56,8 @@ class TextPresenter(Presenter):
                 "always": True,
             }[parsed_args.text_color]
 
-            presenter = cls(fn, color)
-
             try:
-                presenter.start(difference)
+                yield cls(fn, color)
             except UnicodeEncodeError:
                 logger.critical(
                     "Console is unable to print Unicode characters. Set e.g. "
@@ -65,11 +65,12 @@ class TextPresenter(Presenter):
                 )
                 sys.exit(2)
 
-    def start(self, difference):
+    def handle(self, event, *args):
         try:
-            super().start(difference)
+            return super().handle(event, *args)
         except PrintLimitReached:
             self.print_func("Max text output size reached.", force=True)
+            return False
 
     def visit_difference(self, difference):
         if self.depth == 0:
@@ -84,12 +85,11 @@ class TextPresenter(Presenter):
         for x in difference.comments:
             self.output("│┄ {}".format(x))
 
-        diff = difference.unified_diff
-
-        if diff:
-            self.output(color_unified_diff(diff) if self.color else diff, True)
+    def diff(self, difference, chunk):
+        # As we are called after enter(), this is indented one level deeper
+        # than the headers
+        if chunk:
+            self.output(color_unified_diff(chunk) if self.color else chunk)
 
-    def output(self, val, raw=False):
-        self.print_func(
-            self.indent(val, self.PREFIX * (self.depth + (0 if raw else -1)))
-        )
+    def output(self, val):
+        self.print_func(self.indent(val, self.PREFIX * (self.depth - 1)))
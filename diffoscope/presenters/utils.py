@@ -45,26 +45,57 @@ def sizeof_fmt(num, suffix="B", sigfig=3):
 
 class Presenter:
     supports_visual_diffs = False
+    # Whether we can present differences while they are being computed
+    supports_streaming = True
 
     def __init__(self):
         self.depth = 0
 
     @classmethod
-    def run(cls, data, difference, parsed_args):
+    def run(cls, data, difference, parsed_args, consume=False):
+        with cls.open(data, parsed_args) as presenter:
+            presenter.start(difference, consume)
+
+    @classmethod
+    @contextlib.contextmanager
+    def open(cls, data, parsed_args):
+        """
+        Yield a presenter that writes to data["target"], eg. for passing to
+        present() alongside others.
+        """
+
         with make_printer(data["target"]) as fn:
-            cls(fn).start(difference)
+            yield cls(fn)
 
-    def start(self, difference):
-        self.visit(difference)
+    def start(self, difference, consume=False):
+        """
+        Present `difference` from its events (see Difference.events). If
+        `consume` is True, details that have yet to be computed are computed
+        as we go and are discarded once presented.
+        """
 
-    def visit(self, difference):
-        self.visit_difference(difference)
+        present(difference, [self], consume)
+
+    def handle(self, event, *args):
+        """
+        Handle an event, returning False if we want no further events.
+        """
 
+        getattr(self, event)(*args)
+        return True
+
+    def finish(self):
+        pass
+
+    def enter(self, difference):
+        self.visit_difference(difference)
         self.depth += 1
 
-        for x in difference.details:
-            self.visit(x)
+    def diff(self, difference, chunk):
+        # By default, visit_difference presents the unified_diff
+        pass
 
+    def exit(self, difference):
         self.depth -= 1
 
     def visit_difference(self, difference):
@@ -80,6 +111,22 @@ class Presenter:
         return prefix + val.rstrip().replace("\n", "\n{}".format(prefix))
 
 
+def present(difference, presenters, consume=False):
+    """
+    Present `difference` with each of `presenters` from a single traversal of
+    its events.
+    """
+
+    active = list(presenters)
+    for event, *args in difference.events(consume):
+        active = [x for x in active if x.handle(event, *args)]
+        if not active:
+            break
+
+    for x in presenters:
+        x.finish()
+
+
 class PrintLimitReached(Exception):
     pass
 
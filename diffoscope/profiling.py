@@ -16,8 +16,12 @@
 # You should have received a copy of the GNU General Public License
 # along with diffoscope.  If not, see <https://www.gnu.org/licenses/>.
 
+import os
 import sys
+import json
 import time
+import itertools
+import threading
 import contextlib
 import collections
 
@@ -25,15 +29,153 @@ from .utils import format_class
 from .logging import setup_logging
 
 _ENABLED = False
+_TRACING = False
+
+_LOCAL = threading.local()
+_IDS = itertools.count(1)
+
+
+_DISABLED = contextlib.nullcontext()
+
+
+def profile(namespace, key, path=None):
+    # Avoid the overhead of a generator in hot paths such as specialize()
+    if not _ENABLED:
+        return _DISABLED
+
+    return _profile(namespace, key, path)
 
 
 @contextlib.contextmanager
-def profile(namespace, key):
-    start = time.time()
-    yield
+def _profile(namespace, key, path):
+    start = time.perf_counter()
+    span = None
+    if _TRACING:
+        span = Span(namespace, key, path, start)
+        span.push()
+
+    try:
+        yield
+    finally:
+        end = time.perf_counter()
+        if span is not None:
+            span.pop(end)
+        ProfileManager().increment(start, end, namespace, key)
+
+
+def current_span():
+    stack = getattr(_LOCAL, "stack", None)
+    return stack[-1] if stack else None
+
+
+@contextlib.contextmanager
+def inherit_span(parent):
+    """
+    Make spans started from this thread children of `parent`, a span that
+    was current in another thread (see current_span).
+    """
+
+    previous = getattr(_LOCAL, "parent", None)
+    _LOCAL.parent = parent
+    try:
+        yield
+    finally:
+        _LOCAL.parent = previous
+
+
+def member_path(file):
+    """
+    Return eg. "foo.deb ::: data.tar.xz ::: data.tar ::: ./usr/bin/foo" for
+    a (possibly nested) archive member.
+    """
+
+    names = []
+    while file is not None:
+        names.append(file.name)
+        container = getattr(file, "container", None)
+        parent = getattr(container, "source", None)
+        # Stop at the directory the top-level file was found in.
+        if getattr(parent, "container", None) is None:
+            break
+        file = parent
+
+    return " ::: ".join(reversed(names))
+
+
+class Span:
+    __slots__ = (
+        "id",
+        "parent",
+        "namespace",
+        "key",
+        "path",
+        "start",
+        "end",
+        "thread",
+        "obj",
+        "cls",
+    )
+
+    def __init__(self, namespace, key, path, start):
+        if path is None and not isinstance(key, str):
+            # Record which (nested) file or container we were working on
+            path = getattr(key, "source", key)
+
+        # Record the class of the file we were working on once we are done,
+        # as it may have been specialized in the meantime.
+        self.obj = None
+        self.cls = None
+        if path is not None and not isinstance(path, str):
+            if isinstance(key, str):
+                self.obj = path
+            path = member_path(path) if hasattr(path, "name") else None
+
+        if not isinstance(key, str):
+            key = format_class(key.__class__)
+
+        self.id = next(_IDS)
+        self.parent = None
+        self.namespace = namespace
+        self.key = key
+        self.path = path
+        self.start = start
+        self.end = None
+        self.thread = threading.get_ident()
 
-    if _ENABLED:
-        ProfileManager().increment(start, namespace, key)
+    def push(self):
+        if not hasattr(_LOCAL, "stack"):
+            _LOCAL.stack = []
+
+        parent = current_span() or getattr(_LOCAL, "parent", None)
+        if parent is not None:
+            self.parent = parent.id
+
+        _LOCAL.stack.append(self)
+
+    def pop(self, end):
+        self.end = end
+
+        if self.obj is not None:
+            self.cls = format_class(self.obj.__class__)
+            self.obj = None
+
+        # Tolerate spans being closed out of order (eg. by __del__)
+        stack = _LOCAL.stack
+        if stack and stack[-1] is self:
+            stack.pop()
+        elif self in stack:
+            stack.remove(self)
+
+        ProfileManager().record(self)
+
+    @property
+    def label(self):
+        val = "{}({})".format(self.namespace, self.path or self.key)
+        if self.cls is not None:
+            val = "{}({}: {})".format(
+                self.namespace, self.path or self.key, self.cls
+            )
+        return val.replace(";", ":").replace("\n", " ")
 
 
 class ProfileManager:
@@ -48,17 +190,36 @@ class ProfileManager:
                     lambda: {"time": 0.0, "count": 0}
                 )
             )
+            self.spans = []
+            self.threads = {}
+            self.epoch = time.perf_counter()
+            self.lock = threading.Lock()
 
     def setup(self, parsed_args):
-        global _ENABLED
+        global _ENABLED, _TRACING
         _ENABLED = parsed_args.profile_output is not None or parsed_args.debug
+        _TRACING = (
+            parsed_args.profile_output is not None
+            and parsed_args.profile_format != "text"
+        )
+
+        self.spans = []
+        self.threads = {}
+        self.epoch = time.perf_counter()
 
-    def increment(self, start, namespace, key):
+    def increment(self, start, end, namespace, key):
         if not isinstance(key, str):
             key = format_class(key.__class__)
 
-        self.data[namespace][key]["time"] += time.time() - start
-        self.data[namespace][key]["count"] += 1
+        with self.lock:
+            self.data[namespace][key]["time"] += end - start
+            self.data[namespace][key]["count"] += 1
+
+    def record(self, span):
+        with self.lock:
+            self.spans.append(span)
+            if span.thread not in self.threads:
+                self.threads[span.thread] = threading.current_thread().name
 
     def finish(self, parsed_args):
         from .presenters.utils import make_printer
@@ -67,9 +228,16 @@ class ProfileManager:
         if parsed_args.profile_output is None:
             with setup_logging(parsed_args.debug, None) as logger:
                 self.output(lambda x: logger.debug(x.strip("\n")))
-        else:
-            with make_printer(parsed_args.profile_output) as fn:
-                self.output(fn)
+            return
+
+        output = {
+            "text": self.output,
+            "chrome": self.output_chrome,
+            "folded": self.output_folded,
+        }[parsed_args.profile_format]
+
+        with make_printer(parsed_args.profile_output) as fn:
+            output(fn)
 
     def output(self, print_fn):
         title = "# Profiling output for: {}".format(" ".join(sys.argv))
@@ -95,3 +263,76 @@ class ProfileManager:
                         value,
                     )
                 )
+
+    def output_chrome(self, print_fn):
+        """
+        Chrome trace-event format, as read by chrome://tracing, Perfetto and
+        speedscope.
+        """
+
+        pid = os.getpid()
+        events = [
+            {
+                "name": "thread_name",
+                "ph": "M",
+                "pid": pid,
+                "tid": tid,
+                "args": {"name": name},
+            }
+            for tid, name in self.threads.items()
+        ]
+
+        for x in sorted(self.spans, key=lambda x: x.start):
+            args = {"id": x.id, "parent": x.parent}
+            if x.path is not None:
+                args["path"] = x.path
+            if x.cls is not None:
+                args["class"] = x.cls
+            events.append(
+                {
+                    "name": x.key,
+                    "cat": x.namespace,
+                    "ph": "X",
+                    "ts": (x.start - self.epoch) * 1e6,
+                    "dur": (x.end - x.start) * 1e6,
+                    "pid": pid,
+                    "tid": x.thread,
+                    "args": args,
+                }
+            )
+
+        print_fn(
+            json.dumps(
+                {
+                    "traceEvents": events,
+                    "displayTimeUnit": "ms",
+                    "otherData": {"command": " ".join(sys.argv)},
+                }
+            )
+        )
+
+    def output_folded(self, print_fn):
+        """
+        "Folded stacks" as read by flamegraph.pl, inferno and speedscope. The
+        value of each stack is its self-time in microseconds.
+        """
+
+        spans = {x.id: x for x in self.spans}
+
+        children = collections.defaultdict(float)
+        for x in self.spans:
+            children[x.parent] += x.end - x.start
+
+        stacks = collections.defaultdict(int)
+        for x in self.spans:
+            frames = []
+            parent = x
+            while parent is not None:
+                frames.append(parent.label)
+                parent = spans.get(parent.parent)
+
+            elapsed = max(0.0, (x.end - x.start) - children[x.id])
+            stacks[";".join(reversed(frames))] += round(elapsed * 1e6)
+
+        for stack, value in sorted(stacks.items()):
+            print_fn("{} {}".format(stack, value))
@@ -22,6 +22,7 @@ import sys
 import json
 import signal
 import logging
+import threading
 
 from .logging import line_eraser
 from .tools import python_module_missing
@@ -96,21 +97,47 @@ class ProgressManager:
 
         return log_handler
 
+    @staticmethod
+    def is_tracking():
+        """
+        Progress is only tracked from the main thread; members compared on
+        other threads (see --jobs) are accounted for by their parent's step.
+        """
+        return threading.current_thread() is threading.main_thread()
+
     def push(self, progress):
+        if not self.is_tracking():
+            return
         assert not self.stack or self.stack[-1].is_active()
         self.stack.append(progress)
 
     def pop(self, progress):
+        if not self.is_tracking() or progress not in self.stack:
+            return
         x = self.stack.pop()
         assert x is progress
         if self.stack:
             self.stack[-1].child_done(x.total)
 
+    def unwind(self, progress):
+        """
+        Forget any progress above `progress`. These belong to comparisons that
+        were abandoned due to an exception but not yet closed (eg. a suspended
+        generator of container members that is only closed when collected).
+        """
+
+        if not self.is_tracking() or progress not in self.stack:
+            return
+        while self.stack[-1] is not progress:
+            self.stack.pop()
+
     def register(self, observer):
         logger.debug("Registering %s as a progress observer", observer)
         self.observers.append(observer)
 
     def update(self, msg):
+        if not self.is_tracking():
+            return
         if self.stack:
             cur_estimates = None
             for progress in reversed(self.stack):
@@ -143,6 +170,7 @@ class Progress:
         return self
 
     def __exit__(self, exc_type, exc_value, exc_traceback):
+        ProgressManager().unwind(self)
         self.maybe_end()
         ProgressManager().pop(self)
 
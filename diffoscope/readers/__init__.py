@@ -18,15 +18,33 @@
 # along with diffoscope.  If not, see <https://www.gnu.org/licenses/>.
 
 import codecs
+import weakref
 
 from diffoscope.utils import exit_if_paths_do_not_exist
 
 from .json import JSONReaderV1
+from .binary import BinaryReaderV1
 
 
 def load_diff_from_path(path):
     exit_if_paths_do_not_exist(path)
-    with open(path, "rb") as fp:
+
+    fp = open(path, "rb")
+    try:
+        if BinaryReaderV1.recognizes(fp):
+            reader = BinaryReaderV1()
+            difference = reader.load(fp, path)
+            # Binary reports are read from lazily, so only close the file
+            # along with the reader, ie. once no Difference loaded from it
+            # is in use.
+            weakref.finalize(reader, fp.close)
+            return difference
+    except BaseException:
+        fp.close()
+        raise
+
+    with fp:
+        fp.seek(0)
         return load_diff(codecs.getreader("utf-8")(fp), path)
 
 
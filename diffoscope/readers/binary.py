@@ -0,0 +1,183 @@
+#
+# diffoscope: in-depth comparison of files, archives, and directories
+#
+# Copyright © 2022 Chris Lamb <lamby@debian.org>
+#
+# diffoscope is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# diffoscope is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with diffoscope.  If not, see <https://www.gnu.org/licenses/>.
+
+import threading
+
+from ..difference import Difference
+from ..diffstore import StoredDiff
+from ..presenters.binary import (
+    BINARY_FORMAT_MAGIC,
+    BINARY_FORMAT_VERSION,
+    FLAG_HAS_INTERNAL_LINENOS,
+    FLAG_HAS_UNIFIED_DIFF,
+    CODEC_NONE,
+    CODEC_ZSTD,
+    HEADER,
+    TRAILER,
+    U8,
+    U32,
+    U64,
+    BLOB,
+    zstandard,
+)
+
+from .utils import UnrecognizedFormatError
+
+
+class BinaryReaderV1:
+    """
+    Loads a report written by BinaryPresenter. Nodes are only read when their
+    parent's details are required, and their diffs only when presented.
+    """
+
+    @staticmethod
+    def recognizes(fp):
+        return fp.read(len(BINARY_FORMAT_MAGIC)) == BINARY_FORMAT_MAGIC
+
+    def load(self, fp, fn):
+        # fp should be a seekable bytes-stream. It is read from until the
+        # loaded Difference objects are no longer used.
+        self.fp = fp
+        self.fn = fn
+        self.lock = threading.Lock()
+
+        header = self.read(0, len(BINARY_FORMAT_MAGIC) + HEADER.size)
+        if not header.startswith(BINARY_FORMAT_MAGIC):
+            raise UnrecognizedFormatError("Magic not found in {}".format(fn))
+        (version,) = HEADER.unpack_from(header, len(BINARY_FORMAT_MAGIC))
+        if version != BINARY_FORMAT_VERSION:
+            raise UnrecognizedFormatError(
+                "Unsupported binary report version: {}".format(version)
+            )
+
+        size = len(BINARY_FORMAT_MAGIC) + TRAILER.size
+        with self.lock:
+            fp.seek(-size, 2)
+            trailer = fp.read(size)
+        if not trailer.endswith(BINARY_FORMAT_MAGIC):
+            raise UnrecognizedFormatError(
+                "Truncated binary report: {}".format(fn)
+            )
+        offset, count, codecs = TRAILER.unpack_from(trailer)
+
+        # Rather than failing part of the way through presenting it
+        if codecs & (1 << CODEC_ZSTD) and zstandard is None:
+            raise RuntimeError(
+                "The zstandard module is required to read {}".format(fn)
+            )
+
+        self.index = self.read(offset, count * U64.size)
+
+        return self.load_node(count - 1)
+
+    def read(self, offset, length):
+        with self.lock:
+            self.fp.seek(offset)
+            return self.fp.read(length)
+
+    def read_diff(self, offset, length):
+        # Called via StoredDiff
+        data = self.read(offset, length)
+        (codec,) = U8.unpack_from(data)
+        if codec == CODEC_NONE:
+            return data[1:]
+        if codec == CODEC_ZSTD:
+            return zstandard.ZstdDecompressor().decompress(data[1:])
+        raise ValueError("Unknown codec {} in {}".format(codec, self.fn))
+
+    def load_node(self, node_id):
+        (offset,) = U64.unpack_from(self.index, node_id * U64.size)
+        record = Record(self, offset)
+
+        flags = record.u8()
+        source1 = record.str()
+        source2 = record.str()
+        comments = [record.str() for _ in range(record.u32())]
+
+        unified_diff = None
+        if flags & FLAG_HAS_UNIFIED_DIFF:
+            blob_offset, blob_length, size = record.unpack(BLOB)
+            unified_diff = StoredDiff(
+                DiffReader(self), blob_offset, blob_length, size
+            )
+
+        children = [record.u64() for _ in range(record.u32())]
+
+        difference = Difference(
+            source1,
+            source2,
+            comment=comments,
+            has_internal_linenos=bool(flags & FLAG_HAS_INTERNAL_LINENOS),
+            unified_diff=unified_diff,
+        )
+        difference.add_lazy_details(self.load_node(x) for x in children)
+
+        return difference
+
+
+class DiffReader:
+    """
+    Adapts BinaryReaderV1 to what StoredDiff expects of a DiffStore.
+    """
+
+    def __init__(self, reader):
+        self.reader = reader
+
+    def read(self, offset, length):
+        return self.reader.read_diff(offset, length)
+
+
+class Record:
+    """
+    Reads the fields of a record sequentially, in blocks.
+    """
+
+    BLOCK_SIZE = 2**12
+
+    def __init__(self, reader, offset):
+        self.reader = reader
+        self.offset = offset
+        self.buf = b""
+        self.pos = 0
+
+    def take(self, length):
+        if self.pos + length > len(self.buf):
+            self.offset += self.pos
+            self.buf = self.buf[self.pos :] + self.reader.read(
+                self.offset + len(self.buf) - self.pos,
+                max(length, self.BLOCK_SIZE),
+            )
+            self.pos = 0
+        result = self.buf[self.pos : self.pos + length]
+        self.pos += length
+        return result
+
+    def unpack(self, fmt):
+        return fmt.unpack(self.take(fmt.size))
+
+    def u8(self):
+        return self.unpack(U8)[0]
+
+    def u32(self):
+        return self.unpack(U32)[0]
+
+    def u64(self):
+        return self.unpack(U64)[0]
+
+    def str(self):
+        return self.take(self.u32()).decode("utf-8")
@@ -17,36 +17,269 @@
 # You should have received a copy of the GNU General Public License
 # along with diffoscope.  If not, see <https://www.gnu.org/licenses/>.
 
+import re
 import json
 
+from json.decoder import scanstring
+
 from ..difference import Difference
-from ..presenters.json import JSON_FORMAT_MAGIC
+from ..presenters.json import JSON_FORMAT_MAGIC, JSON_FORMAT_VERSION
 
 from .utils import UnrecognizedFormatError
 
+# Matches a token along with any "," or ":" separator that precedes it
+re_token = re.compile(
+    r'[ \t\n\r]*([,:]?)[ \t\n\r]*(?:([{}\[\]"])|([^ \t\n\r{}\[\],:"]+))?'
+)
+
+
+class JSONTokenizer:
+    """
+    Splits a str-stream into JSON tokens, reading it in chunks.
+
+    If `decoder` is given, it is used to decode objects and arrays that lie
+    entirely within what has been read so far as single "value" tokens.
+    """
+
+    CHUNK_SIZE = 2**16
+
+    def __init__(self, fp, decoder=None):
+        self.fp = fp
+        self.decoder = decoder
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    def fill(self):
+        # Read at least as much as we have buffered so that rescanning a long
+        # token after each read is amortised linear.
+        data = self.fp.read(max(self.CHUNK_SIZE, len(self.buf) - self.pos))
+        if not data:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos :] + data
+        self.pos = 0
+        return True
+
+    def error(self, msg):
+        return json.JSONDecodeError(msg, self.buf, self.pos)
+
+    def tokens(self):
+        """
+        Yield (separator, token, value) tuples where separator is "", "," or
+        ":" and token is one of "{}[]", "string", "literal" or None at the
+        end of the stream.
+        """
+
+        while True:
+            match = re_token.match(self.buf, self.pos)
+            # Our token (or the whitespace before it) may continue past what
+            # we have read so far.
+            if match.end() == len(self.buf) and not self.eof:
+                self.fill()
+                continue
+
+            sep, token, literal = match.groups()
+
+            if token == '"':
+                try:
+                    val, end = scanstring(self.buf, match.end())
+                except json.JSONDecodeError:
+                    if self.fill():
+                        continue
+                    raise
+                self.pos = end
+                yield sep, "string", val
+            elif token in ("{", "[") and self.decoder is not None:
+                try:
+                    val, end = self.decoder.raw_decode(
+                        self.buf, match.start(2)
+                    )
+                except json.JSONDecodeError:
+                    # Not (yet) complete, so tokenize it instead
+                    self.pos = match.end()
+                    yield sep, token, None
+                else:
+                    self.pos = end
+                    yield sep, "value", val
+            elif token is not None:
+                self.pos = match.end()
+                yield sep, token, None
+            elif literal is not None:
+                self.pos = match.start(3)
+                try:
+                    val = json.loads(literal)
+                except json.JSONDecodeError:
+                    raise self.error("Expecting value")
+                self.pos = match.end()
+                yield sep, "literal", val
+            elif match.end() == len(self.buf):
+                self.pos = match.end()
+                yield sep, None, None
+                return
+            else:
+                self.pos = match.end()
+                raise self.error("Expecting value")
+
+
+def iterparse(fp, whole=False):
+    """
+    Parse JSON from a str-stream incrementally, yielding (event, value)
+    tuples in the style of ijson.basic_parse: "start_map", "map_key",
+    "end_map", "start_array", "end_array", "string" and "literal".
+
+    If `whole` is true, objects and arrays that are small enough to have been
+    read in their entirety are instead decoded at once (which is much faster)
+    and yielded as a single "value" event.
+    """
+
+    tokenizer = JSONTokenizer(fp, json.JSONDecoder() if whole else None)
+    containers = []
+    # The separator required before the next key or value, and whether it
+    # should be a key.
+    need, key = "", False
+    done = False
+
+    for sep, token, val in tokenizer.tokens():
+        if token is None:
+            if sep or not done:
+                raise tokenizer.error("Unexpected end of data")
+            return
+
+        if done:
+            raise tokenizer.error("Extra data")
+
+        if token in "}]":
+            if (
+                sep
+                or need == ":"
+                or not containers
+                or containers.pop() != ("{" if token == "}" else "[")
+            ):
+                raise tokenizer.error("Unexpected {!r}".format(token))
+            yield ("end_map" if token == "}" else "end_array"), None
+        elif sep != need:
+            raise tokenizer.error("Expecting {!r}".format(need or token))
+        elif key:
+            if token != "string":
+                raise tokenizer.error("Expecting property name")
+            yield "map_key", val
+            need, key = ":", False
+            continue
+        elif token == "{":
+            containers.append(token)
+            yield "start_map", None
+            need, key = "", True
+            continue
+        elif token == "[":
+            containers.append(token)
+            yield "start_array", None
+            need, key = "", False
+            continue
+        else:
+            yield token, val
+
+        # We have just finished a value
+        done = not containers
+        need, key = ",", bool(containers) and containers[-1] == "{"
+
 
 class JSONReaderV1:
     def load(self, fp, fn):
         # fp should be a str-stream not a bytes-stream. If you need to pass in
         # a bytes-stream, wrap it in codecs.getreader('utf-8')(fp)
-        raw = json.load(fp)
-        if JSON_FORMAT_MAGIC not in raw or raw[JSON_FORMAT_MAGIC] != 1:
-            raise UnrecognizedFormatError(
-                "Magic not found in JSON: {}".format(JSON_FORMAT_MAGIC)
-            )
-        return self.load_rec(raw)
+        #
+        # The file is parsed incrementally and each Difference is created as
+        # soon as its object ends, so that we never hold the whole document
+        # (or the whole tree of dicts) in memory. Until we have seen the magic
+        # (which we always write first, but which may be anywhere in the
+        # root object) we cannot tell whether any objects are Differences,
+        # so they are kept as dicts until it has been checked.
+        root = None
+        # The objects we are inside and, for each, the key we are reading
+        nodes, keys = [], []
+        array = None
+
+        for event, val in iterparse(fp, whole=True):
+            if event == "start_map":
+                nodes.append({"details": []})
+                keys.append(None)
+            elif not nodes:
+                # The whole document was small enough to decode at once
+                if event != "value" or not isinstance(val, dict):
+                    raise self.unrecognized()
+                self.check_magic(val)
+                root = self.load_rec(val)
+            elif event == "map_key":
+                keys[-1] = val
+            elif event == "start_array":
+                # Objects within "details" are appended by end_map instead
+                if keys[-1] != "details":
+                    array = []
+            elif event == "end_array":
+                if array is not None:
+                    nodes[-1][keys[-1]] = array
+                    array = None
+            elif event == "end_map":
+                raw = nodes.pop()
+                keys.pop()
+                if not nodes:
+                    self.check_magic(raw)
+                    root = self.load_node(
+                        raw, [self.load_deferred(x) for x in raw["details"]]
+                    )
+                elif self.has_magic(nodes[0]):
+                    nodes[-1]["details"].append(
+                        self.load_node(raw, raw["details"])
+                    )
+                else:
+                    nodes[-1]["details"].append(raw)
+            elif array is not None:
+                array.append(val)
+            elif keys[-1] == "details" and event == "value":
+                # Either all of the details or just one of them
+                if not isinstance(val, list):
+                    val = [val]
+                if self.has_magic(nodes[0]):
+                    val = [self.load_rec(x) for x in val]
+                nodes[-1]["details"].extend(val)
+            else:
+                nodes[-1][keys[-1]] = val
+
+        return root
+
+    def has_magic(self, raw):
+        return raw.get(JSON_FORMAT_MAGIC) == JSON_FORMAT_VERSION
+
+    def check_magic(self, raw):
+        if not self.has_magic(raw):
+            raise self.unrecognized()
+
+    def load_deferred(self, x):
+        # See load()
+        return x if isinstance(x, Difference) else self.load_rec(x)
+
+    def unrecognized(self):
+        return UnrecognizedFormatError(
+            "Magic not found in JSON: {}".format(JSON_FORMAT_MAGIC)
+        )
 
     def load_rec(self, raw):
+        details = [self.load_rec(child) for child in raw.get("details", [])]
+        return self.load_node(raw, details)
+
+    def load_node(self, raw, details):
         source1 = raw["source1"]
         source2 = raw["source2"]
         unified_diff = raw["unified_diff"]
         comments = raw.get("comments", [])
-        details = [self.load_rec(child) for child in raw.get("details", [])]
+        has_internal_linenos = raw.get("has_internal_linenos", False)
 
         return Difference(
             source1,
             source2,
             comment=comments,
+            has_internal_linenos=has_internal_linenos,
             details=details,
             unified_diff=unified_diff,
         )
@@ -23,10 +23,12 @@ import sys
 import shutil
 import logging
 import tempfile
+import threading
 
 from .utils import format_bytes
 
 _BASEDIR = None
+_BASEDIR_LOCK = threading.Lock()
 _FILES = []
 
 logger = logging.getLogger(__name__)
@@ -72,6 +74,17 @@ def get_temporary_directory(*args, **kwargs):
     return d
 
 
+def is_temporary(path):
+    """
+    Whether `path` is within our temporary directory.
+    """
+
+    if _BASEDIR is None:
+        return False
+
+    return os.path.abspath(path).startswith(os.path.join(_BASEDIR.name, ""))
+
+
 def clean_all_temp_files():
     logger.debug("Cleaning %d temp files", len(_FILES))
 
@@ -106,6 +119,12 @@ def clean_all_temp_files():
 
 
 def _get_base_temporary_directory():
+    # Threads must not race to replace (and thus remove) the directory.
+    with _BASEDIR_LOCK:
+        return _create_base_temporary_directory()
+
+
+def _create_base_temporary_directory():
     global _BASEDIR
 
     if _BASEDIR is None or not os.path.exists(_BASEDIR.name):
@@ -58,7 +58,7 @@ setup(
     ],
     extras_require={
         "distro_detection": ["distro"],
-        "cmdline": ["argcomplete", "progressbar"],
+        "cmdline": ["argcomplete", "progressbar", "zstandard"],
         "comparators": [
             "androguard",
             "binwalk",
@@ -25,6 +25,7 @@ from os import mkdir, symlink
 from tempfile import TemporaryDirectory
 
 from diffoscope.tools import tool_required
+from diffoscope.config import Config
 from diffoscope.exc import RequiredToolNotFound
 from diffoscope.difference import Difference
 from diffoscope.comparators.binary import FilesystemFile
@@ -112,12 +113,58 @@ def test_no_differences_without_xxd(xxd_not_found, binary1):
     assert difference is None
 
 
-def test_compare_without_xxd(xxd_not_found, binary1, binary2):
+def test_compare_without_xxd(monkeypatch, xxd_not_found, binary1, binary2):
+    # Otherwise we do not need xxd(1) at all
+    monkeypatch.setattr(Config(), "diff_engine", "gnu")
     difference = binary1.compare(binary2)
     expected_diff = get_data("binary_hexdump_expected_diff")
     assert difference.unified_diff == expected_diff
 
 
+def test_compare_inprocess_without_xxd(xxd_not_found, binary1, binary2):
+    difference = binary1.compare_bytes(binary2)
+    expected_diff = get_data("binary_expected_diff")
+    assert difference.unified_diff == expected_diff
+
+
+@skip_unless_tools_exist("xxd")
+@pytest.mark.parametrize("context", (0, 3))
+@pytest.mark.parametrize("size", (4096, 4000, 4100))
+@pytest.mark.parametrize(
+    "changes",
+    ([], [(0, b"x")], [(100, b"xy"), (150, b"z"), (1000, b"\0" * 40)]),
+)
+def test_compare_inprocess_like_xxd(
+    monkeypatch, tmpdir, context, size, changes
+):
+    data = bytes(range(256)) * 16
+    changed = bytearray(data)
+    for offset, val in changes:
+        changed[offset : offset + len(val)] = val
+    changed = changed[:size] + b"\xff" * (size - len(changed))
+
+    path1, path2 = str(tmpdir.join("a")), str(tmpdir.join("b"))
+    with open(path1, "wb") as f:
+        f.write(data)
+    with open(path2, "wb") as f:
+        f.write(changed)
+
+    monkeypatch.setattr(Config(), "diff_context", context)
+    file1, file2 = FilesystemFile(path1), FilesystemFile(path2)
+    difference = file1.compare_bytes(file2)
+
+    monkeypatch.setattr(Config(), "diff_engine", "gnu")
+    expected = file1.compare_bytes(file2)
+
+    if expected is None:
+        assert difference is None
+        return
+
+    assert normalize_zeros(difference.unified_diff) == normalize_zeros(
+        expected.unified_diff
+    )
+
+
 def test_with_compare_details():
     d = Difference(TEST_FILE1_PATH, TEST_FILE2_PATH, source="source")
 
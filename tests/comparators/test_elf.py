@@ -19,16 +19,20 @@
 # along with diffoscope.  If not, see <https://www.gnu.org/licenses/>.
 
 import re
+import zlib
+import shutil
 import pytest
 import os.path
 import subprocess
 
 from diffoscope.config import Config
 from diffoscope.comparators.ar import ArFile
+from diffoscope.comparators.deb import BuildIdIndex
 from diffoscope.comparators.elf import ElfFile
 from diffoscope.comparators.binary import FilesystemFile
 from diffoscope.comparators.directory import FilesystemDirectory
 from diffoscope.comparators.missing_file import MissingFile
+from diffoscope.comparators.utils.elf import ElfImage, crc32_suffix
 from diffoscope.comparators.utils.specialize import specialize
 
 from ..utils.data import data, load_fixture, assert_diff
@@ -78,6 +82,52 @@ def test_obj_no_differences(obj1):
     assert difference is None
 
 
+@skip_unless_tools_exist("readelf")
+def test_obj_sections(obj1):
+    container = obj1.as_container
+    assert container.elf is not None
+    assert container._read_sections() == container._parse_readelf_sections()
+
+
+@skip_unless_tools_exist("readelf")
+def test_obj_identical_sections(obj1, obj2):
+    sections1 = obj1.as_container._sections
+    sections2 = obj2.as_container._sections
+
+    assert not sections1[".text"].has_same_content_as(sections2[".text"])
+    assert sections1[".data"].has_same_content_as(sections2[".data"])
+    assert not sections1[".data"].has_same_content_as(sections2[".bss"])
+
+
+@pytest.mark.parametrize(
+    "buf,target", [(b"", 0), (b"foo", 0xFFFFFFFF), (b"\0" * 1000, 0x76F9942D)]
+)
+def test_crc32_suffix(buf, target):
+    suffix = crc32_suffix(zlib.crc32(buf), target)
+    assert zlib.crc32(buf + suffix) == target
+
+
+@skip_unless_tools_exist("readelf")
+def test_verify_build_id(tmp_path):
+    modified = str(tmp_path / "modified.debug")
+    shutil.copy(data("test1.debug"), modified)
+
+    # Make the Build ID the SHA-1 of the file, as _verify_build_id expects
+    verified = str(tmp_path / "verified.debug")
+    shutil.copy(modified, verified)
+    elf = ElfImage(verified)
+    offset, _ = elf.build_id_note()
+    with open(verified, "r+b") as f:
+        f.seek(offset)
+        f.write(bytes.fromhex(elf.build_id_digest()))
+
+    comment = "File has been modified after NT_GNU_BUILD_ID has been applied."
+    for path, expected in ((modified, [comment]), (verified, [])):
+        elf_file = specialize(FilesystemFile(path))
+        elf_file.as_container
+        assert elf_file._comments == expected
+
+
 @pytest.fixture
 def obj_differences(obj1, obj2):
     return obj1.compare(obj2).details
@@ -261,6 +311,17 @@ def test_original_gnu_debuglink(dbgsym_differences):
     assert_diff(bin_details.details[2], "gnu_debuglink_expected_diff")
 
 
+def test_build_id_index(dbgsym_dir1):
+    index = BuildIdIndex()
+    container = dbgsym_dir1.container
+
+    assert index.lookup("0" * 40, container) is None
+    assert list(index.containers) == [container.source.path]
+
+    index.clear()
+    assert index.containers == {}
+
+
 def test_ignore_readelf_errors1_identify(ignore_readelf_errors1):
     assert isinstance(ignore_readelf_errors1, ElfFile)
 
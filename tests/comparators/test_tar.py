@@ -23,7 +23,7 @@ from diffoscope.config import Config
 from diffoscope.comparators.tar import TarFile
 from diffoscope.comparators.missing_file import MissingFile
 
-from ..utils.data import load_fixture, get_data
+from ..utils.data import data, load_fixture, get_data, init_file
 from ..utils.nonexisting import assert_non_existing
 
 
@@ -65,6 +65,29 @@ def test_text_file(differences):
     assert differences[1].unified_diff == expected_diff
 
 
+def test_identical_members_are_not_extracted(tar1):
+    container1 = tar1.as_container
+    container2 = init_file(data("test1.tar")).as_container
+
+    names = [x.name for x, _, _ in container1.comparisons(container2)]
+    assert "dir/text" not in names
+    assert "dir/link" in names
+
+    assert list(container1.compare(container2)) == []
+    assert "dir/text" not in container1._paths
+    assert "dir/text" not in container2._paths
+
+
+def test_identical_members_force_details(monkeypatch, tar1):
+    monkeypatch.setattr(Config(), "force_details", True)
+
+    container1 = tar1.as_container
+    container2 = init_file(data("test1.tar")).as_container
+
+    names = [x.name for x, _, _ in container1.comparisons(container2)]
+    assert "dir/text" in names
+
+
 def test_compare_non_existing(monkeypatch, tar1):
     assert_non_existing(monkeypatch, tar1)
 
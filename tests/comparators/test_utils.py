@@ -17,14 +17,28 @@
 # You should have received a copy of the GNU General Public License
 # along with diffoscope.  If not, see <https://www.gnu.org/licenses/>.
 
+import re
 import codecs
 import os
 import pytest
+import random
 import threading
 
 from diffoscope.config import Config
 from diffoscope.difference import Difference
+from diffoscope.exc import ContainerExtractionError
+from diffoscope.comparators import ComparatorManager
+from diffoscope.comparators.binary import FilesystemFile
 from diffoscope.comparators.utils.command import Command
+from diffoscope.comparators.utils.file import add_streamed_details
+from diffoscope.comparators.utils import fuzzy
+from diffoscope.comparators.utils.fuzzy import Digest, perform_fuzzy_matching
+from diffoscope.comparators.utils.specialize import (
+    RegexStep,
+    scoped_pattern,
+    specialize,
+    try_recognize,
+)
 
 from ..utils.data import data, load_fixture
 from ..utils.tools import (
@@ -87,6 +101,82 @@ def test_fuzzy_matching_only_once(fuzzy_tar1, fuzzy_tar3):
     assert len(differences) == 2
 
 
+class FuzzyMember:
+    def __init__(self, fuzzy_hash):
+        self.fuzzy_hash = fuzzy_hash
+
+    def is_directory(self):
+        return False
+
+
+def random_bytes(rnd, n):
+    # Random.randbytes() requires Python 3.9
+    return rnd.getrandbits(8 * n).to_bytes(n, "little")
+
+
+def fuzzy_members(seed, n):
+    import tlsh
+
+    rnd = random.Random(seed)
+    base = [random_bytes(rnd, rnd.randrange(512, 4096)) for _ in range(5)]
+
+    def member():
+        buf = bytearray(rnd.choice(base))
+        for _ in range(rnd.randrange(len(buf) // 8)):
+            buf[rnd.randrange(len(buf))] = rnd.randrange(256)
+        return FuzzyMember(tlsh.hash(bytes(buf)))
+
+    return {f"{seed}-{x}": (member(), None) for x in range(n)}
+
+
+def fuzzy_matching_linear(members1, members2):
+    import tlsh
+
+    seen = set()
+    for name1, (file1, _) in members1.items():
+        comparisons = [
+            (tlsh.diff(file1.fuzzy_hash, file2.fuzzy_hash), name2)
+            for name2, (file2, _) in members2.items()
+            if name2 not in seen
+        ]
+        if not comparisons:
+            continue
+        score, name2 = min(comparisons, key=lambda x: x[0])
+        if score < Config().fuzzy_threshold:
+            seen.add(name2)
+            yield name1, name2, score
+
+
+@skip_unless_module_exists("tlsh")
+@pytest.mark.parametrize("vectorised", (1, 1000))
+@pytest.mark.parametrize("threshold", (1, 60, 150, 400))
+def test_fuzzy_matching_index(monkeypatch, threshold, vectorised):
+    monkeypatch.setattr(Config(), "fuzzy_threshold", threshold)
+    monkeypatch.setattr(fuzzy, "MIN_VECTORISED", vectorised)
+
+    members1 = fuzzy_members(1, 100)
+    members2 = fuzzy_members(2, 80)
+    # Exact and tied matches
+    members2.update(list(members1.items())[:10])
+    members2.update({f"copy-{k}": v for k, v in list(members1.items())[:5]})
+
+    result = list(perform_fuzzy_matching(members1, members2))
+
+    assert result
+    assert result == list(fuzzy_matching_linear(members1, members2))
+
+
+@skip_unless_module_exists("tlsh")
+def test_fuzzy_digest_distance():
+    import tlsh
+
+    digests = [x.fuzzy_hash for x, _ in fuzzy_members(3, 30).values()]
+
+    for x in digests:
+        for y in digests:
+            assert Digest.parse(x).distance(Digest.parse(y)) == tlsh.diff(x, y)
+
+
 fuzzy_tar_in_tar1 = load_fixture("fuzzy-tar-in-tar1.tar")
 fuzzy_tar_in_tar2 = load_fixture("fuzzy-tar-in-tar2.tar")
 
@@ -136,3 +226,66 @@ def test_trim_stderr_in_command():
         )
         in difference.comment
     )
+
+
+def specialize_linear(file):
+    for method in ("recognizes", "fallback_recognizes"):
+        for cls in ComparatorManager().classes:
+            if try_recognize(file, cls, getattr(cls, method)):
+                return file
+    return file
+
+
+def test_specialize_index():
+    root = os.path.dirname(data("test1.tar"))
+
+    for x in sorted(os.listdir(root)):
+        path = os.path.join(root, x)
+        expected = specialize_linear(FilesystemFile(path))
+        file = specialize(FilesystemFile(path))
+
+        assert type(file).__mro__[:2] == type(expected).__mro__[:2], path
+
+
+def test_specialize_index_regex_order():
+    class File:
+        name = "test.tar.gz"
+        magic_file_type = "POSIX tar archive, gzip compressed data"
+
+    class Gzip(File):
+        pass
+
+    class Tar(File):
+        pass
+
+    patterns = [
+        scoped_pattern(re.compile(r"^gzip compressed data")),
+        scoped_pattern(re.compile(r"\bGZIP\b", re.IGNORECASE)),
+        scoped_pattern(re.compile(r"\btar archive\b")),
+    ]
+    step = RegexStep((Gzip, Gzip, Tar), patterns)
+
+    # The first matching pattern wins, not the leftmost match
+    file = File()
+    assert step(file)
+    assert isinstance(file, Gzip)
+
+    assert scoped_pattern(re.compile(r"(?P<x>a)")) is None
+    assert scoped_pattern(re.compile(r"(a)\1")) is None
+
+
+def test_streamed_details_error():
+    def members():
+        yield Difference("a/1", "b/1", comment="first")
+        raise ContainerExtractionError("a/2", OSError("truncated"))
+
+    difference = add_streamed_details(Difference("a", "b"), [], members())
+    details = difference.details
+
+    assert [x.comments for x in details] == [
+        ["first"],
+        [
+            "Error extracting 'a/2': \"truncated\". Remaining contents "
+            "were not compared."
+        ],
+    ]
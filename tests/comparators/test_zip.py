@@ -17,11 +17,27 @@
 # You should have received a copy of the GNU General Public License
 # along with diffoscope.  If not, see <https://www.gnu.org/licenses/>.
 
+import zlib
 import pytest
-
-from diffoscope.comparators.zip import ZipFile, MozillaZipFile, JmodJavaModule
-
-from ..utils.data import load_fixture, assert_diff
+import zipfile
+import subprocess
+
+from diffoscope.config import Config
+from diffoscope.comparators.zip import (
+    ZipFile,
+    ZipContainer,
+    MozillaZipFile,
+    JmodJavaModule,
+)
+from diffoscope.comparators.utils.zip import (
+    CentralDirectory,
+    read_central_directory,
+    zipinfo_listing,
+    zipnote_listing,
+)
+from diffoscope.comparators.utils.elf import crc32_suffix
+
+from ..utils.data import data, load_fixture, assert_diff, init_file
 from ..utils.tools import skip_unless_tools_exist
 from ..utils.nonexisting import assert_non_existing
 
@@ -80,6 +96,30 @@ def test_compare_non_existing(monkeypatch, zip1):
     assert_non_existing(monkeypatch, zip1)
 
 
+@skip_unless_tools_exist("zipinfo")
+@pytest.mark.parametrize(
+    "filename", ("test1.zip", "test2.zip", "test3.zip", "test_comment2.zip")
+)
+def test_zipinfo_listing(filename):
+    output = subprocess.check_output(["zipinfo", data(filename)])
+    expected = output.decode("utf-8").split("\n", 1)[1]
+    assert zipinfo_listing(CentralDirectory(data(filename))) == expected
+
+
+def test_zipnote_listing():
+    assert zipnote_listing(CentralDirectory(data("test_comment2.zip"))) == (
+        "Filename: foo\nComment: hello\n\nZip file comment: goodbye"
+    )
+
+
+@pytest.mark.parametrize("filename", ("test1.mozzip", "test1.jmod"))
+def test_listing_unsupported(filename):
+    # Left to zipinfo(1) as it warns about their layout
+    cd = read_central_directory(data(filename))
+    assert cd is None or zipinfo_listing(cd) is None
+    assert cd is None or zipnote_listing(cd) is None
+
+
 def test_mozzip_identification(mozzip1):
     assert isinstance(mozzip1, MozillaZipFile)
 
@@ -143,3 +183,55 @@ def comment_differences(test_comment1, test_comment2):
 @skip_unless_tools_exist("zipnote")
 def test_commented(comment_differences):
     assert_diff(comment_differences[1], "comment_zipinfo_expected_diff")
+
+
+def test_identical_members_are_not_extracted(monkeypatch, zip1, zip3):
+    extracted = []
+    monkeypatch.setattr(
+        ZipContainer,
+        "extract",
+        lambda self, member_name, dest_dir: extracted.append(member_name),
+    )
+
+    container1 = zip1.as_container
+    container2 = zip3.as_container
+
+    names = [x.name for x, _, _ in container1.comparisons(container2)]
+    assert "dir/text" not in names
+
+    assert list(container1.compare(container2)) == []
+    assert extracted == []
+
+
+def test_identical_members_force_details(monkeypatch, zip1, zip3):
+    monkeypatch.setattr(Config(), "force_details", True)
+
+    container1 = zip1.as_container
+    container2 = zip3.as_container
+
+    names = [x.name for x, _, _ in container1.comparisons(container2)]
+    assert "dir/text" in names
+
+
+@pytest.fixture
+def crc32_collision(tmp_path):
+    # Two members with the same size and CRC32 but different contents
+    paths = []
+    for x in (b"a", b"b"):
+        content = x * 64
+        content += crc32_suffix(zlib.crc32(content), 0)
+        path = str(tmp_path / "{}.zip".format(x.decode()))
+        with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as z:
+            z.writestr("dir/text", content)
+        paths.append(path)
+    return [init_file(x).as_container for x in paths]
+
+
+def test_crc32_collision(monkeypatch, crc32_collision):
+    container1, container2 = crc32_collision
+
+    assert not container1.is_identical("dir/text", container2, "dir/text")
+    assert container1.is_identical("dir/text", container1, "dir/text")
+
+    monkeypatch.setattr(Config(), "trust_zip_crc32", True)
+    assert container1.is_identical("dir/text", container2, "dir/text")
@@ -0,0 +1,184 @@
+#
+# diffoscope: in-depth comparison of files, archives, and directories
+#
+# Copyright © 2022 Chris Lamb <lamby@debian.org>
+#
+# diffoscope is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# diffoscope is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with diffoscope.  If not, see <https://www.gnu.org/licenses/>.
+
+import os
+import pytest
+
+from diffoscope.main import main
+
+from .utils.data import data
+from .utils.tools import skip_unless_module_exists
+
+
+def run(capsys, *args):
+    with pytest.raises(SystemExit) as exc:
+        main(args + (data("test1.tar"), data("test2.tar")))
+
+    out, err = capsys.readouterr()
+
+    assert err == ""
+
+    return exc.value.code, out
+
+
+def entries(path):
+    return [
+        os.path.join(root, x)
+        for root, _, files in os.walk(path)
+        for x in files
+        if x.endswith(".json.gz")
+    ]
+
+
+def test_cache_hit(capsys, tmpdir, monkeypatch):
+    cache_dir = str(tmpdir)
+
+    ret, expected = run(capsys, "--cache-dir", cache_dir)
+    assert ret == 1
+    assert os.listdir(cache_dir)
+
+    def fail(*args, **kwargs):
+        raise AssertionError("should have been cached")
+
+    monkeypatch.setattr(
+        "diffoscope.comparators.utils.compare._compare_files", fail
+    )
+
+    ret, out = run(capsys, "--cache-dir", cache_dir)
+    assert ret == 1
+    assert out == expected
+
+
+def test_cache_key_includes_config(capsys, tmpdir):
+    cache_dir = str(tmpdir)
+
+    _, out1 = run(capsys, "--cache-dir", cache_dir)
+    _, out2 = run(capsys, "--cache-dir", cache_dir, "--diff-context=1")
+
+    assert out1 != out2
+
+
+def test_cache_eviction(capsys, tmpdir):
+    cache_dir = str(tmpdir)
+
+    run(capsys, "--cache-dir", cache_dir)
+    assert entries(cache_dir)
+
+    run(
+        capsys,
+        "--cache-dir",
+        cache_dir,
+        "--cache-max-size=1",
+        "--diff-context=1",
+    )
+    assert entries(cache_dir) == []
+
+
+def test_fingerprint_cache(tmpdir, monkeypatch):
+    from diffoscope.cache import file_fingerprint, compute_fingerprint
+    from diffoscope.config import Config
+    from diffoscope.comparators.binary import FilesystemFile
+
+    monkeypatch.setattr(Config(), "cache_dir", str(tmpdir.mkdir("cache")))
+    path = str(tmpdir.join("file"))
+    with open(path, "wb") as f:
+        f.write(b"contents")
+
+    expected = compute_fingerprint(path)
+    assert file_fingerprint(FilesystemFile(path)) == expected
+
+    def fail(path, fuzzy=False):
+        raise AssertionError("should have been cached")
+
+    monkeypatch.setattr("diffoscope.cache.compute_fingerprint", fail)
+    assert file_fingerprint(FilesystemFile(path)) == expected
+
+    # Changing the file invalidates its entry
+    with open(path, "ab") as f:
+        f.write(b" changed")
+    with pytest.raises(AssertionError):
+        file_fingerprint(FilesystemFile(path))
+
+
+@skip_unless_module_exists("tlsh")
+def test_fingerprint_fuzzy(tmpdir):
+    from diffoscope.cache import file_fingerprint
+    from diffoscope.comparators.binary import FilesystemFile
+
+    path = str(tmpdir.join("file"))
+    with open(path, "wb") as f:
+        f.write(bytes(range(256)) * 16)
+
+    # TLSH is only calculated when fuzzy matching asks for it
+    file = FilesystemFile(path)
+    assert file_fingerprint(file).tlsh is None
+    assert file.fuzzy_hash is not None
+    assert file_fingerprint(file) == file_fingerprint(file, fuzzy=True)
+
+
+def test_cache_key_includes_tools(capsys, tmpdir, monkeypatch):
+    from diffoscope.cache import ComparisonCache
+    from diffoscope.comparators.utils import compare
+
+    cache_dir = str(tmpdir)
+    run(capsys, "--cache-dir", cache_dir)
+
+    calls = []
+    original = compare._compare_files
+
+    def counting(*args, **kwargs):
+        calls.append(args)
+        return original(*args, **kwargs)
+
+    monkeypatch.setattr(compare, "_compare_files", counting)
+
+    # eg. after upgrading a tool
+    tools = ComparisonCache().installed_tools()
+    monkeypatch.setattr(
+        ComparisonCache,
+        "installed_tools",
+        lambda self: tools + [("upgraded", "/usr/bin/upgraded", 1, 1)],
+    )
+    run(capsys, "--cache-dir", cache_dir)
+
+    assert calls
+
+
+def test_cache_eviction_concurrent(capsys, tmpdir, monkeypatch):
+    from diffoscope.cache import ComparisonCache
+
+    cache_dir = str(tmpdir)
+    run(capsys, "--cache-dir", cache_dir)
+    assert entries(cache_dir)
+
+    # Another process removes each entry before we stat(2) it
+    original = ComparisonCache.entries
+
+    def entries_removed(self):
+        for x in original(self):
+            os.unlink(x.path)
+            yield x
+
+    monkeypatch.setattr(ComparisonCache, "entries", entries_removed)
+    run(
+        capsys,
+        "--cache-dir",
+        cache_dir,
+        "--cache-max-size=1",
+        "--diff-context=1",
+    )
@@ -0,0 +1,132 @@
+#
+# diffoscope: in-depth comparison of files, archives, and directories
+#
+# Copyright © 2022 Chris Lamb <lamby@debian.org>
+#
+# diffoscope is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# diffoscope is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with diffoscope.  If not, see <https://www.gnu.org/licenses/>.
+
+import random
+import pytest
+
+from diffoscope import diff as diff_module
+from diffoscope import feeders
+from diffoscope.diff import diff, linediff, linediff_myers
+from diffoscope.config import Config
+
+from .utils.tools import skip_unless_tools_exist
+
+
+def random_pair(seed):
+    rnd = random.Random(seed)
+    alphabet = rnd.choice((2, 5, 50))
+    a = [b"%d\n" % rnd.randrange(alphabet) for _ in range(rnd.choice((0, 30)))]
+    b = list(a)
+
+    for _ in range(rnd.randrange(10)):
+        x = rnd.choice((a, b))
+        pos = rnd.randrange(len(x) + 1)
+        if rnd.random() < 0.5:
+            x.insert(pos, b"%d\n" % rnd.randrange(alphabet * 2))
+        elif x:
+            del x[min(pos, len(x) - 1)]
+
+    a, b = b"".join(a), b"".join(b)
+    if seed % 3 == 0:
+        a = a.rstrip(b"\n")
+    if seed % 5 == 0:
+        b = b.rstrip(b"\n")
+
+    return a, b
+
+
+PAIRS = [
+    (b"", b"a\n"),
+    (b"a\n", b""),
+    (b"a\nb\nc\n", b"a\nc\n"),
+    (b"a\nb", b"a\nb\n"),
+    (b"a\n" * 21, b"b\n" * 21),
+    (b"".join(b"%d\n" % x for x in range(40)), b"0\n39\n"),
+] + [random_pair(x) for x in range(50)]
+
+
+def run(monkeypatch, engine, data1, data2, **kwargs):
+    monkeypatch.setattr(Config(), "diff_engine", engine)
+    for k, v in kwargs.items():
+        monkeypatch.setattr(Config(), k, v)
+
+    return diff(feeders.from_text(data1), feeders.from_text(data2))
+
+
+@skip_unless_tools_exist("diff")
+@pytest.mark.parametrize("context", (0, 3, 7))
+@pytest.mark.parametrize("max_lines", (float("inf"), 1, 3))
+def test_engines_are_identical(monkeypatch, context, max_lines):
+    kwargs = {
+        "diff_context": context,
+        "max_diff_block_lines_saved": max_lines,
+    }
+
+    for data1, data2 in PAIRS:
+        expected = run(monkeypatch, "gnu", data1, data2, **kwargs)
+        assert run(monkeypatch, "python", data1, data2, **kwargs) == expected
+
+
+@skip_unless_tools_exist("diff")
+def test_auto_falls_back_to_gnu_diff(monkeypatch):
+    data1, data2 = PAIRS[-1]
+    expected = run(monkeypatch, "python", data1, data2)
+
+    def fail(*args, **kwargs):
+        raise AssertionError("should not have been called")
+
+    monkeypatch.setattr(diff_module, "diff_inprocess", fail)
+    monkeypatch.setattr(diff_module, "MAX_INPROCESS_DIFF_SIZE", 1)
+
+    assert run(monkeypatch, "auto", data1, data2) == expected
+
+
+def test_no_differences(monkeypatch):
+    assert run(monkeypatch, "python", b"a\n", b"a\n") is None
+
+
+@pytest.mark.parametrize(
+    "s,t,expected",
+    (
+        ("kitten", "sitting", ("<k>itt<e>n", "<s>itt<i>n<g>")),
+        ("abcdef", "azced", ("a<b>c<d>e<f>", "a<z>ce<d>")),
+        ("0x1234 foo", "0x12 foo bar", ("0x12<34> foo", "0x12 foo< bar>")),
+        ("ab", "ba", ("<ab>", "<ba>")),
+    ),
+)
+def test_linediff(s, t, expected):
+    assert linediff(s, t, "<", ">") == expected
+
+
+def test_linediff_long_lines():
+    s = "".join(f"var a{x}=function(){{return {x}}};" for x in range(1500))
+    t = s.replace("a1234=", "b1234=").replace("return 1432", "return 0")
+
+    s1, t1 = linediff(s, t, "<", ">")
+
+    assert "truncated" not in s1
+    assert "var <a>1234=" in s1
+    assert "var <b>1234=" in t1
+    assert s1.replace("<", "").replace(">", "") == s
+    assert t1.replace("<", "").replace(">", "") == t
+
+
+def test_linediff_myers_too_expensive():
+    pairs = list(linediff_myers("abc", "cba", max_cost=1))
+
+    assert pairs == [((True, "abc"), (True, "cba"))]
@@ -21,6 +21,8 @@ import re
 import pytest
 
 from diffoscope.main import main
+from diffoscope.config import Config
+from diffoscope.feeders import DiffMasks, filter_lines, required_literal
 
 
 def run(capsys, *args):
@@ -68,3 +70,50 @@ def test_specific(capsys):
     assert "[masked] ipsum dolor sit amet" in out
     assert '"Lorem ipsum"' in out
     assert ret == 1
+
+
+@pytest.mark.parametrize(
+    "pattern,expected",
+    [
+        ("^Lorem", "Lorem"),
+        (r"/build/[^/]+/src", "/build/"),
+        (r"Build ID: [0-9a-f]+", "Build ID: "),
+        (r"ab?c", "a"),
+        (r"abc+d", "abc"),
+        (r"(?:abcdef)?xyz", "xyz"),
+        (r"\.debug", ".debug"),
+        (r"\d+", None),
+        (r"foo|bar", None),
+        (r"(?i)foo", None),
+        (r"\x41BC", None),
+    ],
+)
+def test_required_literal(pattern, expected):
+    assert required_literal(pattern) == expected
+
+
+@pytest.mark.parametrize("chunk_size", [1, 10, 2**16])
+def test_filter_lines(monkeypatch, chunk_size):
+    masks = [r"^foo", r"ba[rz]$", r"/build/[^/\s]+/", r"\[masked\]x", "q*"]
+    lines = [
+        b"foo bar\n",
+        b"bar foo\n",
+        b"\n",
+        b"",
+        b"x/build/pkg-1.0/x\n",
+        b"without newline ba",
+        b"z foo\n",
+        b"foox\n",
+    ]
+    monkeypatch.setattr(Config(), "diff_masks", masks)
+    monkeypatch.setattr(DiffMasks, "CHUNK_SIZE", chunk_size)
+
+    def filter_each(buf):
+        # As each mask was applied before DiffMasks
+        for x in masks:
+            buf = re.sub(x.encode("utf-8"), b"[masked]", buf) if buf else buf
+        return buf
+
+    assert list(filter_lines(iter(lines))) == [
+        (x, filter_each(x)) for x in lines
+    ]
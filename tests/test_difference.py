@@ -18,11 +18,19 @@
 # along with diffoscope.  If not, see <https://www.gnu.org/licenses/>.
 
 import io
-import itertools
+import signal
 import pytest
+import itertools
+import subprocess
 
+from diffoscope import diffstore
 from diffoscope.config import Config
 from diffoscope.difference import Difference
+from diffoscope.comparators.utils.command import Command
+from diffoscope.comparators.utils import parallel
+from diffoscope.comparators.utils.parallel import Slots, shutdown_executor
+
+from .utils.data import data
 
 
 def assert_size(diff, size):
@@ -143,3 +151,210 @@ def test_adjust_diff_context(monkeypatch):
     )
     difference = Difference.from_text_readers(a, b, "a", "b")
     assert difference.unified_diff.count("\n") == 7
+
+
+class Cat(Command):
+    def cmdline(self):
+        return ["cat", self.path]
+
+
+class Reverse(Command):
+    def cmdline(self):
+        return ["tac", self.path]
+
+
+class CatWithWarning(Command):
+    def cmdline(self):
+        return [
+            "sh",
+            "-c",
+            'cat "$1"; echo warning >&2; exit 1',
+            "-",
+            self.path,
+        ]
+
+
+def test_from_operations(monkeypatch):
+    a = data("text_ascii1")
+    b = data("text_ascii2")
+    klasses = [Cat, Reverse, Cat]
+
+    expected = [Difference.from_operation(x, a, b) for x in klasses]
+
+    monkeypatch.setattr(Config(), "max_subprocesses", 4)
+    try:
+        differences = Difference.from_operations(klasses, a, b)
+    finally:
+        shutdown_executor()
+
+    assert len(differences) == len(klasses)
+    for x, y in zip(differences, expected):
+        assert x.equals(y)
+
+
+def test_from_operations_streaming_slots(monkeypatch):
+    a = data("text_ascii1")
+    b = data("text_ascii2")
+    klasses = [Cat, Reverse, Cat]
+
+    expected = [Difference.from_operation(x, a, b) for x in klasses]
+
+    # Streaming commands count towards --max-subprocesses
+    slots = Slots(2)
+    free = []
+
+    original = Command._start_streaming
+
+    def start_streaming(self, *args):
+        free.append(slots.free)
+        return original(self, *args)
+
+    monkeypatch.setattr(Command, "_start_streaming", start_streaming)
+    monkeypatch.setattr(Command, "STREAM_MIN_SIZE", 0)
+    monkeypatch.setattr(Config(), "max_subprocesses", 4)
+    monkeypatch.setattr(parallel, "_get_subprocess_slots", lambda: slots)
+    try:
+        differences = Difference.from_operations(klasses, a, b)
+    finally:
+        shutdown_executor()
+
+    assert len(differences) == len(klasses)
+    for x, y in zip(differences, expected):
+        assert x.equals(y)
+
+    assert free == [0] * 2 * len(klasses)
+    assert slots.free == 2
+
+
+def test_slots():
+    slots = Slots(2)
+
+    # Never wait for more slots than there are
+    assert slots.acquire(3) == 2
+    assert slots.free == 0
+    slots.release(2)
+    assert slots.free == 2
+
+
+@pytest.mark.parametrize("max_lines", (float("inf"), 2))
+@pytest.mark.parametrize("klass", (Cat, CatWithWarning))
+def test_from_operation_streaming(monkeypatch, klass, max_lines):
+    a = data("text_ascii1")
+    b = data("text_ascii2")
+
+    monkeypatch.setattr(Config(), "max_diff_input_lines", max_lines)
+
+    def compare():
+        try:
+            return Difference.from_operation(klass, a, b)
+        except subprocess.CalledProcessError as exc:
+            return exc.returncode, exc.output
+
+    expected = compare()
+
+    monkeypatch.setattr(Command, "STREAM_MIN_SIZE", 0)
+    started = []
+    monkeypatch.setattr(
+        Command, "_start_streaming", wrap(Command._start_streaming, started)
+    )
+
+    assert started == []
+    result = compare()
+    # Commands are only run as their output is read, so the second is not
+    # needed once the first fails.
+    assert len(started) == (2 if klass is Cat else 1)
+
+    if klass is Cat:
+        assert result.equals(expected)
+    else:
+        assert result == expected == (1, b"warning\n")
+
+
+def test_streaming_terminate(monkeypatch):
+    monkeypatch.setattr(Command, "STREAM_MIN_SIZE", 0)
+
+    class Yes(Command):
+        def cmdline(self):
+            return ["yes", self.path]
+
+    operation = Yes(data("text_ascii1"))
+    operation.start()
+    assert next(operation.iter_output()).startswith(b"/")
+
+    operation.terminate()
+    assert operation.returncode == -signal.SIGKILL
+
+
+def test_lazy_details():
+    computed = []
+
+    def details():
+        for x in ("b", "c"):
+            computed.append(x)
+            yield Difference.from_text(x, x + "2", x, x)
+
+    difference = Difference.from_text("a", "a2", "a", "a")
+    difference.add_lazy_details(details())
+    difference.add_details([Difference.from_text("d", "d2", "d", "d")])
+    assert computed == []
+
+    events = difference.events(consume=True)
+    assert [(x[0], x[1].source1) for x in itertools.islice(events, 3)] == [
+        ("enter", "a"),
+        ("diff", "a"),
+        ("enter", "b"),
+    ]
+    assert computed == ["b"]
+
+    assert [(x[0], x[1].source1) for x in events][-4:] == [
+        ("enter", "d"),
+        ("diff", "d"),
+        ("exit", "d"),
+        ("exit", "a"),
+    ]
+    assert computed == ["b", "c"]
+
+    # Consumed details are not retained
+    assert difference.details == []
+
+
+def test_lazy_details_materialize():
+    difference = Difference("a", "b")
+    difference.add_lazy_details(
+        iter([None, Difference.from_text("c", "c2", "c", "c")])
+    )
+    assert [x.source1 for x in difference.details] == ["c"]
+    assert difference.size() > 0
+
+
+def test_stored_diff(monkeypatch):
+    expected = Difference.from_text("a\n" * 10, "b\n" * 10, "a", "b")
+    assert isinstance(expected._unified_diff, str)
+
+    monkeypatch.setattr(diffstore, "SPILL_MIN_SIZE", 8)
+
+    difference = Difference.from_text("a\n" * 10, "b\n" * 10, "a", "b")
+    assert isinstance(difference._unified_diff, diffstore.StoredDiff)
+    assert difference.unified_diff == expected.unified_diff
+    assert difference.size() == expected.size()
+    assert difference.equals(expected)
+
+
+@pytest.mark.parametrize(
+    "val", (b"\xc3\xa9" * 10, b"\xff\xc3" * 10 + b"\xc3", b"x" * 100)
+)
+def test_stored_diff_size(monkeypatch, val):
+    monkeypatch.setattr(diffstore, "DECODE_CHUNK", 3)
+    monkeypatch.setattr(diffstore, "SPILL_MIN_SIZE", 1)
+
+    stored = diffstore.store_diff(val)
+    assert str(stored) == val.decode("utf-8", errors="replace")
+    assert len(stored) == len(str(stored))
+
+
+def wrap(fn, calls):
+    def inner(*args, **kwargs):
+        calls.append(args)
+        return fn(*args, **kwargs)
+
+    return inner
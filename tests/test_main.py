@@ -17,14 +17,20 @@
 # You should have received a copy of the GNU General Public License
 # along with diffoscope.  If not, see <https://www.gnu.org/licenses/>.
 
+import io
 import os
+import re
 import sys
+import json
 import pytest
 import signal
+import tarfile
 import tempfile
 
 from diffoscope.main import main
 
+from .utils.tools import skip_unless_tools_exist
+
 TEST_TAR1_PATH = os.path.join(os.path.dirname(__file__), "data/test1.tar")
 TEST_TAR2_PATH = os.path.join(os.path.dirname(__file__), "data/test2.tar")
 TEST_TARS = (TEST_TAR1_PATH, TEST_TAR2_PATH)
@@ -159,6 +165,51 @@ def test_profiling(capsys):
     assert "Profiling output for" in out
     assert err == ""
 
+    # Specializing files is summarised under a single key
+    assert "\n## specialize " in out
+    assert re.search(r"^ .* calls? +specialize$", out, re.MULTILINE)
+
+
+def test_profiling_chrome(capsys):
+    ret, out, err = run(
+        capsys, *TEST_TARS, "--profile=-", "--profile-format=chrome"
+    )
+
+    assert ret == 1
+    assert err == ""
+
+    events = json.loads(out.splitlines()[-1])["traceEvents"]
+    spans = {x["args"]["id"]: x for x in events if x["ph"] == "X"}
+    extract = [x for x in spans.values() if x["cat"] == "container_extract"]
+
+    assert extract
+    assert extract[0]["args"]["path"].endswith("test1.tar ::: dir/text")
+
+    # The extraction happened whilst comparing that member
+    parent = spans[extract[0]["args"]["parent"]]
+    while parent["cat"] != "compare_files":
+        parent = spans[parent["args"]["parent"]]
+    assert parent["args"]["path"] == extract[0]["args"]["path"]
+
+    specialize = [x for x in spans.values() if x["cat"] == "specialize"]
+    assert specialize
+    assert all(x["name"] == "specialize" for x in specialize)
+    assert any(x["args"]["class"].endswith("TarFile") for x in specialize)
+
+
+def test_profiling_folded(capsys):
+    ret, out, err = run(
+        capsys, *TEST_TARS, "--profile=-", "--profile-format=folded"
+    )
+
+    assert ret == 1
+    assert err == ""
+
+    stacks = [x for x in out.splitlines() if "container_extract(" in x]
+    assert stacks
+    assert all(";compare_files(" in x for x in stacks)
+    assert all(x.rsplit(" ", 1)[1].isdigit() for x in stacks)
+
 
 def test_non_unicode_filename(capsys, tmpdir):
     # Bug reference: https://bugs.debian.org/898022
@@ -191,3 +242,58 @@ def test_usage(capsys):
 
     assert out == ""
     assert "usage:" in err
+
+
+@pytest.mark.parametrize("path", ("test1.deb", "test1.tar"))
+def test_jobs(capsys, path):
+    path1 = os.path.join(os.path.dirname(__file__), "data", path)
+    path2 = path1.replace("1.", "2.")
+
+    _, expected, _ = run(capsys, "--json=-", path1, path2)
+    ret, out, err = run(capsys, "--json=-", "--jobs=4", path1, path2)
+
+    assert ret == 1
+    assert err == ""
+    assert out == expected
+
+
+@pytest.mark.parametrize("path", ("test1.deb", "test1.o"))
+def test_max_subprocesses(capsys, path):
+    path1 = os.path.join(os.path.dirname(__file__), "data", path)
+    path2 = path1.replace("1.", "2.")
+
+    _, expected, _ = run(
+        capsys, "--json=-", "--max-subprocesses=1", path1, path2
+    )
+    ret, out, err = run(
+        capsys, "--json=-", "--max-subprocesses=4", path1, path2
+    )
+
+    assert ret == 1
+    assert err == ""
+    assert out == expected
+
+
+@skip_unless_tools_exist("gzip")
+def test_streaming_corrupt_archive(capsys, tmpdir):
+    content = os.urandom(65536)
+
+    # gzip records their names, so file(1) differs before we get to the
+    # truncated contents
+    paths = []
+    for x in ("test1", "test2"):
+        path = str(tmpdir.join("{}.tar.gz".format(x)))
+        with tarfile.open(path, "w:gz") as f:
+            info = tarfile.TarInfo("file")
+            info.size = len(content)
+            f.addfile(info, io.BytesIO(content))
+        paths.append(path)
+    with open(paths[1], "r+b") as f:
+        f.truncate(32768)
+
+    _, expected, _ = run(capsys, "--text=-", *paths)
+    ret, out, _ = run(capsys, "--text=-", "--stream", *paths)
+
+    assert ret == 1
+    assert "Command `gzip -d -c" in out
+    assert out == expected
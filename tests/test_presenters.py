@@ -133,6 +133,47 @@ def test_json(capsys):
     assert out == get_data("output.json")
 
 
+def test_streaming(capsys):
+    out = run(capsys, "--stream", "--text", "-")
+
+    assert out == get_data("output.txt")
+
+
+def test_streaming_multiple_formats(tmpdir, capsys):
+    report_path = str(tmpdir.join("report.json"))
+    run(capsys, "--stream", "--text", "-", "--json", report_path)
+
+    with open(report_path, "r", encoding="utf-8") as f:
+        assert f.read() == get_data("output.json")
+
+
+def test_multiple_formats(tmpdir, capsys):
+    paths = {x: str(tmpdir.join(x)) for x in ("md", "rst", "json")}
+
+    out = run(
+        capsys,
+        "--text",
+        "-",
+        "--markdown",
+        paths["md"],
+        "--restructured-text",
+        paths["rst"],
+        "--json",
+        paths["json"],
+    )
+
+    assert out == get_data("output.txt")
+    for k, v in paths.items():
+        with open(v, "r", encoding="utf-8") as f:
+            assert f.read() == get_data("output.{}".format(k))
+
+
+def test_multiple_formats_same_target(capsys):
+    out = run(capsys, "--text", "-", "--json", "-")
+
+    assert out == get_data("output.txt") + get_data("output.json")
+
+
 def test_no_report_option(capsys):
     out = run(capsys)
 
@@ -182,7 +223,8 @@ def test_html_option_with_stdout(capsys):
     assert body.count('div class="difference"') == 4
 
 
-def test_html_regression_875281(tmpdir, capsys):
+@pytest.mark.parametrize("jobs", (1, 2))
+def test_html_regression_875281(tmpdir, capsys, jobs):
     diff_path = expand_collapsed_json(tmpdir, "debian-bug-875281")
     report_path = str(tmpdir.join("report.html"))
     out = run(
@@ -190,6 +232,7 @@ def test_html_regression_875281(tmpdir, capsys):
         "--html",
         report_path,
         "--max-page-size=5000",
+        f"--jobs={jobs}",
         f"--load-existing-diff={diff_path}",
     )
     assert out == ""
@@ -200,6 +243,31 @@ def test_html_regression_875281(tmpdir, capsys):
         )
 
 
+def test_htmldir_jobs(tmpdir, capsys):
+    def output(jobs):
+        html_dir = str(tmpdir.join(f"jobs{jobs}"))
+        run(
+            capsys,
+            "--html-dir",
+            html_dir,
+            "--max-page-size=1000",
+            "--max-page-diff-block-lines=2",
+            "--max-diff-block-lines=10",
+            f"--jobs={jobs}",
+            pair=("test1.deb", "test2.deb"),
+        )
+
+        result = {}
+        for x in sorted(os.listdir(html_dir)):
+            with open(os.path.join(html_dir, x), "rb") as f:
+                result[x] = f.read()
+        return result
+
+    expected = output(1)
+    assert len(expected) > 4
+    assert output(2) == expected
+
+
 def test_limited_print():
     def fake(x):
         return None
@@ -17,11 +17,23 @@
 # You should have received a copy of the GNU General Public License
 # along with diffoscope.  If not, see <https://www.gnu.org/licenses/>.
 
+import io
+import json
 import pytest
+import builtins
 
 from diffoscope.main import main
+from diffoscope.presenters.json import JSON_FORMAT_MAGIC
+from diffoscope.presenters.binary import (
+    BINARY_FORMAT_MAGIC,
+    CODEC_ZSTD,
+    HEADER,
+    U8,
+)
 from diffoscope.comparators.utils.compare import compare_root_paths
-from diffoscope.readers import load_diff_from_path
+from diffoscope.readers import load_diff, load_diff_from_path
+from diffoscope.readers.json import JSONTokenizer
+from diffoscope.readers.utils import UnrecognizedFormatError
 
 from .utils.data import cwd_data, get_data
 
@@ -48,3 +60,125 @@ def run_diff_read(diffpath):
 def test_json(capsys):
     run_read_write(capsys, "output.json", "--json", "-")
     run_diff_read("output.json")
+
+
+@pytest.mark.parametrize("chunk_size", (1, 7, 2**16))
+def test_json_incremental(monkeypatch, chunk_size):
+    # Exercise tokens (and their separators) being split across reads
+    monkeypatch.setattr(JSONTokenizer, "CHUNK_SIZE", chunk_size)
+    run_diff_read("output.json")
+
+
+@pytest.mark.parametrize("chunk_size", (7, 2**16))
+def test_json_magic_last(monkeypatch, chunk_size):
+    # The magic need not be the first key, even if the report is too large
+    # to decode at once.
+    monkeypatch.setattr(JSONTokenizer, "CHUNK_SIZE", chunk_size)
+
+    raw = json.loads(get_data("output.json"))
+    raw[JSON_FORMAT_MAGIC] = raw.pop(JSON_FORMAT_MAGIC)
+    assert list(raw)[-1] == JSON_FORMAT_MAGIC
+
+    with cwd_data():
+        diff = compare_root_paths("test1.tar", "test2.tar")
+    read = load_diff(io.StringIO(json.dumps(raw)), "test.json")
+    assert diff.equals(read)
+
+
+@pytest.mark.parametrize("chunk_size", (7, 2**16))
+def test_json_unrecognized_nested(monkeypatch, chunk_size):
+    monkeypatch.setattr(JSONTokenizer, "CHUNK_SIZE", chunk_size)
+
+    val = json.dumps({"details": [{"details": [{}]}]})
+    with pytest.raises(UnrecognizedFormatError):
+        load_diff(io.StringIO(val), "test.json")
+
+
+@pytest.mark.parametrize("val", ("{}", "[]", '{"source1": "a"}'))
+def test_json_unrecognized(val):
+    with pytest.raises(UnrecognizedFormatError):
+        load_diff(io.StringIO(val), "test.json")
+
+
+def test_binary(tmpdir, capsys):
+    report_path = str(tmpdir.join("report.bin"))
+    with pytest.raises(SystemExit), cwd_data():
+        main(("--binary-output", report_path, "test1.tar", "test2.tar"))
+    capsys.readouterr()
+
+    with pytest.raises(SystemExit) as exc:
+        main(("--json", "-", f"--load-existing-diff={report_path}"))
+    out, err = capsys.readouterr()
+
+    assert err == ""
+    assert exc.value.code == 1
+    assert out == get_data("output.json")
+    run_diff_read(report_path)
+
+
+def test_binary_lazy(tmpdir, capsys):
+    report_path = str(tmpdir.join("report.bin"))
+    with pytest.raises(SystemExit), cwd_data():
+        main(("--binary-output", report_path, "test1.tar", "test2.tar"))
+    capsys.readouterr()
+
+    difference = load_diff_from_path(report_path)
+
+    # Children are only read from the report once they are required
+    assert difference._pending is not None
+    assert len(difference.details) == 3
+    assert difference._pending is None
+
+
+@pytest.fixture
+def opened(monkeypatch):
+    result = []
+
+    def fake_open(*args, **kwargs):
+        result.append(builtins.open(*args, **kwargs))
+        return result[-1]
+
+    monkeypatch.setattr("diffoscope.readers.open", fake_open, raising=False)
+    return result
+
+
+def test_binary_closed(tmpdir, capsys, opened):
+    report_path = str(tmpdir.join("report.bin"))
+    with pytest.raises(SystemExit), cwd_data():
+        main(("--binary-output", report_path, "test1.tar", "test2.tar"))
+    capsys.readouterr()
+
+    difference = load_diff_from_path(report_path)
+    assert len(difference.details) == 3
+    assert not opened[0].closed
+
+    del difference
+    assert opened[0].closed
+
+    # An unsupported version
+    with open(report_path, "r+b") as f:
+        f.seek(len(BINARY_FORMAT_MAGIC))
+        f.write(HEADER.pack(0))
+
+    with pytest.raises(UnrecognizedFormatError):
+        load_diff_from_path(report_path)
+    assert opened[1].closed
+
+
+def test_binary_zstandard_missing(monkeypatch, tmpdir, capsys, opened):
+    report_path = str(tmpdir.join("report.bin"))
+    with pytest.raises(SystemExit), cwd_data():
+        main(("--binary-output", report_path, "test1.tar", "test2.tar"))
+    capsys.readouterr()
+
+    # Mark the report as containing compressed diffs
+    with open(report_path, "r+b") as f:
+        f.seek(-len(BINARY_FORMAT_MAGIC) - U8.size, 2)
+        f.write(U8.pack(1 << CODEC_ZSTD))
+
+    monkeypatch.setattr("diffoscope.readers.binary.zstandard", None)
+
+    # This is reported when the report is loaded, not once presenting it
+    with pytest.raises(RuntimeError, match="zstandard"):
+        load_diff_from_path(report_path)
+    assert opened[0].closed